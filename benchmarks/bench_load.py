@@ -0,0 +1,260 @@
+"""Нагрузочный прогон сервиса, имитирующий параллельных E2E-исполнителей.
+
+Приложение из main.py поднимается в процессе со своим lifespan и работает с БД из settings.env
+(или BOTFARM_SETTINGS_FILE). Запросы идут напрямую в ASGI-приложение, без сети и HTTP-клиента,
+поэтому замеряется сам сервис и БД. Перед прогоном создаются --projects проектов и --users
+свободных пользователей в них. Затем каждый из --concurrency исполнителей повторяет цикл,
+пока не истечет --duration секунд: создание пользователя, checkout, освобождение по токену
+и страница списка пользователей проекта.
+
+По каждому эндпоинту в JSON выводятся пропускная способность, p50/p95/p99 задержки, доля
+ответов 423 и время ожидания соединения из пула. Пользователи и проекты прогона удаляются в конце.
+
+Запуск: python -m benchmarks.bench_load [--users 1000] [--projects 10] [--concurrency 50]
+    [--duration 30] [--lease 60] [--output bench_output.txt]
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import math
+import pathlib
+import random
+import time
+import urllib.parse
+import uuid
+from collections import abc, defaultdict
+
+import sqlalchemy as sa
+
+from botfarm.components import db, metrics
+from botfarm.entities import models
+from main import app
+
+PASSWORD = 'load-test'
+
+# Ожидания соединения из пула, которые случились при обработке текущего запроса
+_pool_waits: contextvars.ContextVar[list[float] | None] = contextvars.ContextVar('pool_waits', default=None)
+
+
+class PoolWaitProbe:
+    """Обертка метрики ожидания пула, которая дополнительно относит ожидание к текущему запросу"""
+
+    def __init__(self, histogram: metrics.Histogram) -> None:
+        self.histogram = histogram
+
+    def observe(self, value: float, **labels: str) -> None:
+        self.histogram.observe(value, **labels)
+        waits = _pool_waits.get()
+        if waits is not None:
+            waits.append(value)
+
+
+class EndpointStats:
+    """Замеры одного эндпоинта"""
+
+    def __init__(self) -> None:
+        self.latencies: list[float] = []
+        self.pool_waits: list[float] = []
+        self.statuses: defaultdict[int, int] = defaultdict(int)
+
+    def add(self, status: int, latency: float, pool_wait: float) -> None:
+        self.latencies.append(latency)
+        self.pool_waits.append(pool_wait)
+        self.statuses[status] += 1
+
+    def report(self, duration: float) -> dict:
+        requests = len(self.latencies)
+        return {
+            'requests': requests,
+            'throughput_rps': round(requests / duration, 2),
+            'latency_ms': _percentiles(self.latencies),
+            'locked_rate': round(self.statuses.get(423, 0) / requests, 4) if requests else 0,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'pool_wait_ms': {
+                'mean': round(sum(self.pool_waits) / requests * 1000, 3) if requests else 0,
+                **_percentiles(self.pool_waits),
+            },
+        }
+
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    """Возвращает p50/p95/p99 в миллисекундах по методу ближайшего ранга"""
+    ordered = sorted(values)
+    result = {}
+    for percentile in (50, 95, 99):
+        if not ordered:
+            result[f'p{percentile}'] = 0
+            continue
+        rank = max(math.ceil(percentile / 100 * len(ordered)), 1)
+        result[f'p{percentile}'] = round(ordered[rank - 1] * 1000, 3)
+    return result
+
+
+class AsgiClient:
+    """Минимальный клиент, который вызывает ASGI-приложение напрямую и записывает замеры"""
+
+    def __init__(self, app: abc.Callable) -> None:
+        self.app = app
+        self.stats: defaultdict[str, EndpointStats] = defaultdict(EndpointStats)
+
+    async def request(self, endpoint: str, method: str, path: str, params: dict | None = None) -> tuple[int, bytes]:
+        """Выполняет запрос и относит замеры к endpoint - шаблону маршрута, а не фактическому пути"""
+        query = urllib.parse.urlencode({key: value for key, value in (params or {}).items() if value is not None})
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': [(b'host', b'botfarm')],
+            'client': ('127.0.0.1', 0),
+            'server': ('botfarm', 80),
+        }
+        status = 0
+        body = []
+        request_sent = False
+
+        async def receive() -> dict:
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await asyncio.Future()
+
+        async def send(message: dict) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                body.append(message.get('body', b''))
+
+        waits: list[float] = []
+        token = _pool_waits.set(waits)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            latency = time.perf_counter() - start
+            _pool_waits.reset(token)
+        self.stats[endpoint].add(status, latency, sum(waits))
+        return status, b''.join(body)
+
+
+class Run:
+    """Один нагрузочный прогон с уникальными именами проектов и логинами"""
+
+    def __init__(self, client: AsgiClient, args: argparse.Namespace) -> None:
+        self.client = client
+        self.args = args
+        self.prefix = f'load-{uuid.uuid4().hex[:8]}'
+        self.project_names = [f'{self.prefix}-{i}' for i in range(args.projects)]
+        self.created = 0
+
+    def next_login(self) -> str:
+        self.created += 1
+        return f'{self.prefix}-{self.created}@example.com'
+
+    async def create_user(self, project_name: str) -> int:
+        status, _ = await self.client.request('POST /users', 'POST', '/users', {
+            'login': self.next_login(),
+            'password': PASSWORD,
+            'project_name': project_name,
+            'env': models.EnvType.prod.value,
+            'domain': models.DomainType.regular.value,
+        })
+        return status
+
+    async def seed(self) -> None:
+        for name in self.project_names:
+            status, _ = await self.client.request('POST /projects', 'POST', '/projects', {'name': name})
+            if status != 200:
+                raise RuntimeError(f'Не удалось создать проект {name}: {status}')
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def create(index: int) -> None:
+            async with semaphore:
+                await self.create_user(self.project_names[index % len(self.project_names)])
+
+        await asyncio.gather(*(create(i) for i in range(self.args.users)))
+        # Подготовка не входит в отчет
+        self.client.stats.clear()
+
+    async def worker(self, deadline: float) -> None:
+        while time.perf_counter() < deadline:
+            project_name = random.choice(self.project_names)
+            await self.create_user(project_name)
+            status, body = await self.client.request(
+                'POST /users/checkout', 'POST', '/users/checkout',
+                {'project_name': project_name, 'lease': self.args.lease})
+            if status == 200:
+                token = json.loads(body)['lease_token']
+                await self.client.request('DELETE /locks/{token}', 'DELETE', f'/locks/{token}')
+            await self.client.request('GET /users', 'GET', '/users', {'project_name': project_name, 'limit': 50})
+
+    async def drive(self) -> float:
+        start = time.perf_counter()
+        deadline = start + self.args.duration
+        await asyncio.gather(*(self.worker(deadline) for _ in range(self.args.concurrency)))
+        return time.perf_counter() - start
+
+    async def cleanup(self) -> None:
+        async with db.get_sessionmaker()() as session:
+            await session.execute(sa.delete(models.User).where(models.User.login.startswith(self.prefix)))
+            await session.execute(sa.delete(models.Project).where(models.Project.name.in_(self.project_names)))
+            await session.commit()
+
+
+async def bench(args: argparse.Namespace) -> dict:
+    client = AsgiClient(app)
+    pool_wait = metrics.DB_POOL_WAIT
+    metrics.DB_POOL_WAIT = PoolWaitProbe(pool_wait)
+    try:
+        async with app.router.lifespan_context(app):
+            run = Run(client, args)
+            try:
+                await run.seed()
+                duration = await run.drive()
+            finally:
+                await run.cleanup()
+            pool = db.get_pool_stats()
+    finally:
+        metrics.DB_POOL_WAIT = pool_wait
+    requests = sum(len(stats.latencies) for stats in client.stats.values())
+    return {
+        'config': {
+            'users': args.users,
+            'projects': args.projects,
+            'concurrency': args.concurrency,
+            'duration_seconds': args.duration,
+            'lease_seconds': args.lease,
+        },
+        'duration_seconds': round(duration, 3),
+        'throughput_rps': round(requests / duration, 2),
+        'pool': pool.model_dump(),
+        'endpoints': {endpoint: stats.report(duration) for endpoint, stats in sorted(client.stats.items())},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--projects', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--lease', type=int, default=60)
+    parser.add_argument('--output', type=pathlib.Path, default=None)
+    args = parser.parse_args()
+
+    report = json.dumps(asyncio.run(bench(args)), indent=2, ensure_ascii=False) + '\n'
+    print(report, end='')
+    if args.output is not None:
+        args.output.write_text(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Сравнение бэкендов блокировки column и advisory на живой БД.
+
+Каждый из --workers параллельных исполнителей --cycles раз берет свободного пользователя
+checkout и отпускает его по токену. Для каждого бэкенда считаются блокировки в секунду
+и объем WAL, записанный за прогон (разница pg_current_wal_lsn до и после).
+Пользователи для прогона создаются в отдельном проекте и удаляются в конце.
+
+Нужна БД из settings.env (или BOTFARM_SETTINGS_FILE) с примененными миграциями.
+Запуск: python -m benchmarks.bench_locks [--users 200] [--workers 20] [--cycles 200] [--output bench_output.txt]
+"""
+import argparse
+import asyncio
+import pathlib
+import time
+import uuid
+
+import sqlalchemy as sa
+
+from botfarm.components import db, locks, migrations, users
+from botfarm.entities import models
+
+PROJECT_NAME = 'bench-locks'
+
+
+async def seed(count: int) -> uuid.UUID:
+    """Создает проект прогона и count свободных пользователей в нем"""
+    project_id = uuid.uuid4()
+    async with db.get_sessionmaker()() as session:
+        session.add(models.Project(id=project_id, name=PROJECT_NAME))
+        await session.flush()
+        await session.execute(sa.insert(models.User), [
+            {
+                'id': uuid.uuid4(),
+                'login': f'bench-lock-{i}@example.com',
+                'password': 'hash',
+                'project_id': project_id,
+                'env': models.EnvType.prod,
+                'domain': models.DomainType.regular,
+            }
+            for i in range(count)
+        ])
+        await session.commit()
+    return project_id
+
+
+async def cleanup(project_id: uuid.UUID) -> None:
+    async with db.get_sessionmaker()() as session:
+        await session.execute(sa.delete(models.User).where(models.User.project_id == project_id))
+        await session.execute(sa.delete(models.Project).where(models.Project.id == project_id))
+        await session.commit()
+
+
+async def wal_lsn() -> str:
+    async with db.get_engine().connect() as connection:
+        return await connection.scalar(sa.text('SELECT pg_current_wal_lsn()::text'))
+
+
+async def wal_bytes(start: str) -> int:
+    async with db.get_engine().connect() as connection:
+        return await connection.scalar(
+            sa.text('SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), CAST(:start AS pg_lsn))'), {'start': start})
+
+
+async def worker(cycles: int) -> None:
+    for _ in range(cycles):
+        async with db.get_sessionmaker()() as session:
+            locked = await users.checkout_users(1, session, project_name=PROJECT_NAME)
+            await users.release_lock_by_token(locked[0].lease_token, session)
+
+
+async def run(backend: locks.LockBackend, workers: int, cycles: int) -> dict[str, float]:
+    """Прогоняет нагрузку на бэкенде и возвращает блокировки в секунду и байты WAL"""
+    locks._backend = backend
+    start_lsn = await wal_lsn()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(cycles) for _ in range(workers)))
+    elapsed = time.perf_counter() - start
+    written = await wal_bytes(start_lsn)
+    await locks.close_backend()
+    return {'locks_per_second': workers * cycles / elapsed, 'wal_bytes': written}
+
+
+async def bench(user_count: int, workers: int, cycles: int) -> str:
+    await migrations.upgrade(db.get_engine())
+    project_id = await seed(user_count)
+    try:
+        results = {
+            'column': await run(locks.ColumnLockBackend(), workers, cycles),
+            'advisory': await run(locks.AdvisoryLockBackend(), workers, cycles),
+        }
+    finally:
+        await cleanup(project_id)
+        await db.dispose_engine()
+    lines = [f'users: {user_count}, workers: {workers}, cycles per worker: {cycles}']
+    for name, result in results.items():
+        lines.append(
+            f'{name + ":":<9} {result["locks_per_second"]:.0f} locks/s, '
+            f'WAL {result["wal_bytes"] / (workers * cycles):.0f} bytes per lock'
+        )
+    return '\n'.join(lines) + '\n'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=20)
+    parser.add_argument('--cycles', type=int, default=200)
+    parser.add_argument('--output', type=pathlib.Path, default=None)
+    args = parser.parse_args()
+
+    if args.workers > args.users:
+        parser.error('--workers не может превышать --users, иначе checkout будет получать 423')
+    report = asyncio.run(bench(args.users, args.workers, args.cycles))
+    print(report, end='')
+    if args.output is not None:
+        args.output.write_text(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Сравнение старого и быстрого пути ответа списка пользователей.
+
+Старый путь: model_validate на каждого пользователя с проверкой логина email-validator, повторная
+валидация списка по response_model маршрута и JSONResponse FastAPI. Быстрый путь: одна валидация
+списка TypeAdapter без повторной проверки email и dump_json сразу в байты.
+
+Запуск: python -m benchmarks.bench_serialization [--users 10000] [--repeat 5] [--output bench_output.txt]
+"""
+import argparse
+import asyncio
+import pathlib
+import time
+import uuid
+from collections import abc
+from datetime import datetime, timedelta, timezone
+
+import pydantic
+from fastapi import responses, routing
+
+from botfarm import api
+from botfarm.entities import models, schemas
+
+
+def make_users(count: int) -> list[models.User]:
+    created_at = datetime.now(timezone.utc)
+    return [
+        models.User(
+            id=uuid.uuid4(),
+            created_at=created_at + timedelta(microseconds=i),
+            login=f'user{i}@example.com',
+            password='hash',
+            project_id=uuid.uuid4() if i % 2 else None,
+            env=models.EnvType.prod,
+            domain=models.DomainType.regular,
+            locktime=None,
+        )
+        for i in range(count)
+    ]
+
+
+class LegacyUser(schemas.User):
+    """Схема ответа до оптимизации: логин заново проверялся как email"""
+    login: pydantic.EmailStr
+
+
+async def _list_users() -> list[LegacyUser]:
+    """Маршрут со старой схемой ответа, из него берется response_field для FastAPI"""
+
+
+LEGACY_ROUTE = routing.APIRoute('/users', _list_users, response_model=list[LegacyUser])
+
+
+async def legacy_response(users: list[models.User]) -> bytes:
+    items = [LegacyUser.model_validate(user) for user in users]
+    content = await routing.serialize_response(field=LEGACY_ROUTE.response_field, response_content=items)
+    return responses.JSONResponse(content).body
+
+
+async def fast_response(users: list[models.User]) -> bytes:
+    items = schemas.user_list_adapter.validate_python(users, from_attributes=True)
+    return api._json_response(schemas.user_list_adapter, items).body
+
+
+def measure(
+    render: abc.Callable[[list[models.User]], abc.Awaitable[bytes]],
+    users: list[models.User],
+    repeat: int,
+) -> float:
+    """Возвращает лучшее время из repeat прогонов в секундах"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        asyncio.run(render(users))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', type=pathlib.Path, default=None)
+    args = parser.parse_args()
+
+    users = make_users(args.users)
+    legacy_body = asyncio.run(legacy_response(users))
+    fast_body = asyncio.run(fast_response(users))
+    assert schemas.user_list_adapter.validate_json(legacy_body) == schemas.user_list_adapter.validate_json(fast_body)
+
+    legacy = measure(legacy_response, users, args.repeat)
+    fast = measure(fast_response, users, args.repeat)
+    report = (
+        f'users: {args.users}, best of {args.repeat}\n'
+        f'legacy: {legacy * 1000:.1f} ms\n'
+        f'fast:   {fast * 1000:.1f} ms\n'
+        f'speedup: {legacy / fast:.1f}x\n'
+    )
+    print(report, end='')
+    if args.output is not None:
+        args.output.write_text(report)
+
+
+if __name__ == '__main__':
+    main()
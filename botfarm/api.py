@@ -1,10 +1,22 @@
+import uuid
+from collections import abc
+
 import fastapi
+import pydantic
+from fastapi import responses
 from sqlalchemy.ext import asyncio as sa_asyncio
 
-from botfarm.components import db, projects, users
-from botfarm.entities import models, schemas
+from botfarm.components import db, metrics, projects, quotas, streams, users, utils
+from botfarm.entities import constants, models, schemas
+
+router = fastapi.APIRouter(route_class=metrics.MetricsRoute)
 
-router = fastapi.APIRouter()
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+TOTAL_COUNT_HEADER = 'X-Total-Count'
+EXPORT_MEDIA_TYPES = {
+    schemas.DataFormat.ndjson: 'application/x-ndjson',
+    schemas.DataFormat.csv: 'text/csv',
+}
 
 
 @router.post('/users')
@@ -15,24 +27,150 @@ async def create_user(
     return await users.create_user(request, session=session)
 
 
-@router.get('/users')
+def _json_response(adapter: pydantic.TypeAdapter, value: object) -> fastapi.Response:
+    """Сериализует уже провалидированный ответ сразу в байты JSON.
+
+    FastAPI не валидирует и не кодирует повторно возвращенный Response, а response_model
+    маршрута остается только для схемы OpenAPI.
+    """
+    return fastapi.Response(content=adapter.dump_json(value), media_type='application/json')
+
+
+def _set_page_headers(response: fastapi.Response, next_cursor: str | None, total: int | None) -> None:
+    """Передает курсор следующей страницы и общее количество в заголовках ответа"""
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    if total is not None:
+        response.headers[TOTAL_COUNT_HEADER] = str(total)
+
+
+@router.post('/users/import')
+async def import_users(
+    http_request: fastapi.Request,
+    data_format: schemas.DataFormat = fastapi.Query(default=schemas.DataFormat.ndjson, alias='format'),
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
+) -> schemas.ImportReport:
+    lines = utils.iter_lines(http_request.stream(), constants.IMPORT_MAX_LINE_BYTES)
+    return await users.import_users(lines, data_format, session=session)
+
+
+@router.get('/users', response_model=list[schemas.User])
 async def get_users(
     limit: int = fastapi.Query(default=100, ge=1),
     project_name: str | None = fastapi.Query(default=None),
     domain: models.DomainType | None = fastapi.Query(default=None),
     env: models.EnvType | None = fastapi.Query(default=None),
+    cursor: str | None = fastapi.Query(default=None),
+    total: bool = fastapi.Query(default=False),
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_read_session),
+) -> fastapi.Response:
+    page = await users.get_users(
+        limit, project_name=project_name, domain=domain, env=env, cursor=cursor, with_total=total, session=session)
+    response = _json_response(schemas.user_list_adapter, page.items)
+    _set_page_headers(response, page.next_cursor, page.total)
+    return response
+
+
+@router.get('/users/export')
+async def export_users(
+    data_format: schemas.DataFormat = fastapi.Query(default=schemas.DataFormat.ndjson, alias='format'),
+    project_name: str | None = fastapi.Query(default=None),
+    domain: models.DomainType | None = fastapi.Query(default=None),
+    env: models.EnvType | None = fastapi.Query(default=None),
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_read_session),
+) -> responses.StreamingResponse:
+    rows = await users.export_users(data_format, session, project_name=project_name, domain=domain, env=env)
+    return responses.StreamingResponse(rows, media_type=EXPORT_MEDIA_TYPES[data_format])
+
+
+@router.get('/users/events')
+async def watch_users(
+    project_name: str | None = fastapi.Query(default=None),
+    domain: models.DomainType | None = fastapi.Query(default=None),
+    env: models.EnvType | None = fastapi.Query(default=None),
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_read_session),
+) -> responses.StreamingResponse:
+    events = await streams.watch_users(session, project_name=project_name, domain=domain, env=env)
+    return responses.StreamingResponse(
+        events, media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@router.get('/users/stats')
+async def get_user_stats() -> schemas.UserStats:
+    return await users.get_user_stats()
+
+
+@router.post('/users/checkout')
+async def checkout_user(
+    project_name: str | None = fastapi.Query(default=None),
+    domain: models.DomainType | None = fastapi.Query(default=None),
+    env: models.EnvType | None = fastapi.Query(default=None),
+    lease: int = fastapi.Query(default=constants.LOCK_LEASE_SECONDS, ge=1, le=constants.LOCK_LEASE_MAX_SECONDS),
+    wait: float = fastapi.Query(default=0, ge=0, le=constants.CHECKOUT_MAX_WAIT_SECONDS),
+    owner: str | None = fastapi.Query(default=None, max_length=255),
     session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
-) -> list[schemas.User]:
-    return await users.get_users(limit, project_name=project_name, domain=domain, env=env, session=session)
+) -> schemas.LockedUser:
+    return await users.checkout_user(
+        session, project_name=project_name, domain=domain, env=env, lease=lease, wait=wait, owner=owner)
+
+
+@router.post('/users/checkout/batch', response_model=list[schemas.LockedUser])
+async def checkout_users(
+    count: int = fastapi.Query(ge=1, le=constants.LOCK_CHECKOUT_MAX_COUNT),
+    all_or_nothing: bool = fastapi.Query(default=False),
+    project_name: str | None = fastapi.Query(default=None),
+    domain: models.DomainType | None = fastapi.Query(default=None),
+    env: models.EnvType | None = fastapi.Query(default=None),
+    lease: int = fastapi.Query(default=constants.LOCK_LEASE_SECONDS, ge=1, le=constants.LOCK_LEASE_MAX_SECONDS),
+    owner: str | None = fastapi.Query(default=None, max_length=255),
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
+) -> fastapi.Response:
+    locked = await users.checkout_users(
+        count, session, project_name=project_name, domain=domain, env=env,
+        all_or_nothing=all_or_nothing, lease=lease, owner=owner)
+    return _json_response(schemas.locked_user_list_adapter, locked)
+
+
+async def _get_user_session(
+    lock: bool = fastapi.Query(default=False),
+) -> abc.AsyncIterator[sa_asyncio.AsyncSession]:
+    """Выдает сессию основной БД для блокировки, а для чтения - сессию для чтения.
+
+    Отставание реплики проверяется, только если сессия для чтения действительно нужна.
+    """
+    sessionmaker = db.get_sessionmaker() if lock else await db.get_read_sessionmaker()
+    async with sessionmaker() as session:
+        yield session
 
 
 @router.get('/users/{login}')
 async def get_user(
     login: str,
     lock: bool = fastapi.Query(default=False),
+    lease: int = fastapi.Query(default=constants.LOCK_LEASE_SECONDS, ge=1, le=constants.LOCK_LEASE_MAX_SECONDS),
+    owner: str | None = fastapi.Query(default=None, max_length=255),
+    session: sa_asyncio.AsyncSession = fastapi.Depends(_get_user_session),
+) -> schemas.LockedUser:
+    return await users.get_user(login, lock=lock, lease=lease, owner=owner, session=session)
+
+
+@router.post('/users/{login}/heartbeat')
+async def extend_lock(
+    login: str,
+    lease: int = fastapi.Query(default=constants.LOCK_LEASE_SECONDS, ge=1, le=constants.LOCK_LEASE_MAX_SECONDS),
+    token: uuid.UUID | None = fastapi.Query(default=None),
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
+) -> schemas.User:
+    return await users.extend_lock(login, lease=lease, token=token, session=session)
+
+
+@router.post('/users/{login}/password/verify')
+async def verify_password(
+    login: str,
+    request: schemas.PasswordCheck,
     session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
 ) -> schemas.User:
-    return await users.get_user(login, lock=lock, session=session)
+    return await users.verify_password(login, request.password, session=session)
 
 
 @router.patch('/users/{login}')
@@ -52,6 +190,39 @@ async def delete_user(
     return await users.delete_user(login, session=session)
 
 
+@router.patch('/users')
+async def update_users(
+    request: schemas.UserBulkUpdate,
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
+) -> schemas.UsersAffected:
+    return await users.update_users(request, session=session)
+
+
+@router.delete('/users')
+async def delete_users(
+    selector: schemas.UserSelector,
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
+) -> schemas.UsersAffected:
+    return await users.delete_users(selector, session=session)
+
+
+@router.delete('/locks/{token}')
+async def release_lock(
+    token: uuid.UUID,
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
+) -> schemas.User:
+    return await users.release_lock_by_token(token, session=session)
+
+
+@router.delete('/locks')
+async def release_owner_locks(
+    owner: str = fastapi.Query(max_length=255),
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
+) -> schemas.LocksReleased:
+    released = await users.release_owner_locks(owner, session=session)
+    return schemas.LocksReleased(released=released)
+
+
 @router.post('/projects')
 async def create_project(
     request: schemas.ProjectCreate = fastapi.Depends(),
@@ -60,16 +231,24 @@ async def create_project(
     return await projects.create_project(request, session=session)
 
 
-@router.get('/projects')
+@router.get('/projects', response_model=list[schemas.Project])
 async def get_projects(
     limit: int = fastapi.Query(default=100, ge=1),
-    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
-) -> list[schemas.Project]:
-    return await projects.get_projects(limit, session=session)
+    cursor: str | None = fastapi.Query(default=None),
+    total: bool = fastapi.Query(default=False),
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_read_session),
+) -> fastapi.Response:
+    page = await projects.get_projects(limit, cursor=cursor, with_total=total, session=session)
+    response = _json_response(schemas.project_list_adapter, page.items)
+    _set_page_headers(response, page.next_cursor, page.total)
+    return response
 
 
 @router.get('/projects/{name}')
-async def get_project(name: str, session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session)) -> schemas.Project:
+async def get_project(
+    name: str,
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_read_session),
+) -> schemas.Project:
     return await projects.get_project(name, session=session)
 
 
@@ -88,3 +267,43 @@ async def delete_project(
     session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
 ) -> None:
     return await projects.delete_project(name, session=session)
+
+
+@router.get('/projects/{name}/quotas')
+async def get_lock_quotas(
+    name: str,
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_read_session),
+) -> list[schemas.LockQuota]:
+    return await quotas.get_quotas(name, session=session)
+
+
+@router.put('/projects/{name}/quotas')
+async def set_lock_quota(
+    name: str,
+    request: schemas.LockQuotaUpdate = fastapi.Depends(),
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
+) -> schemas.LockQuota:
+    return await quotas.set_quota(name, request, session=session)
+
+
+@router.delete('/projects/{name}/quotas', status_code=204)
+async def delete_lock_quota(
+    name: str,
+    env: models.EnvType | None = fastapi.Query(default=None),
+    session: sa_asyncio.AsyncSession = fastapi.Depends(db.get_session),
+) -> None:
+    return await quotas.delete_quota(name, env, session=session)
+
+
+@router.get('/db/pool')
+async def get_pool_stats() -> schemas.PoolStats:
+    return db.get_pool_stats()
+
+
+@router.get('/metrics', response_class=responses.PlainTextResponse)
+async def get_metrics() -> responses.PlainTextResponse:
+    metrics.set_pool_stats(db.get_pool_stats())
+    stats = await users.get_user_stats()
+    metrics.USERS.set(stats.free, state='free')
+    metrics.USERS.set(stats.locked, state='locked')
+    return responses.PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
@@ -1,18 +1,152 @@
+import logging
+import math
+import time
 from collections import abc
 
 import asyncpg
 import sqlalchemy
+from sqlalchemy import exc as sa_exc
+from sqlalchemy import pool
 from sqlalchemy.ext import asyncio as sa_asyncio
 
-from botfarm.entities import db, exceptions, models
+from botfarm.components import metrics
+from botfarm.entities import db, exceptions, schemas
 
-async_default_engine = sa_asyncio.create_async_engine(
-    db.db_default_credentials.url)
-async_default_sessionmaker = sa_asyncio.async_sessionmaker(
-    async_default_engine)
+logger = logging.getLogger(__name__)
 
-async_engine = sa_asyncio.create_async_engine(db.db_credentials.url)
-async_sessionmaker = sa_asyncio.async_sessionmaker(async_engine)
+_engine: sa_asyncio.AsyncEngine | None = None
+_sessionmaker: sa_asyncio.async_sessionmaker | None = None
+_replica_engine: sa_asyncio.AsyncEngine | None = None
+_replica_sessionmaker: sa_asyncio.async_sessionmaker | None = None
+_replica_lag: float | None = None
+_replica_lag_checked_at = -math.inf
+
+# Отставание реплики в секундах. Если реплика получила все WAL, то она актуальна, даже если
+# последняя транзакция была давно. На основной БД функции возвращают NULL, это отставание 0
+REPLICA_LAG_QUERY = sqlalchemy.text(
+    'SELECT COALESCE(CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END, 0)'
+)
+
+
+class TimedQueuePool(pool.AsyncAdaptedQueuePool):
+    """Пул соединений, который замеряет ожидание соединения и считает таймауты пула"""
+
+    # Метка target метрик пула
+    target = 'primary'
+
+    def _do_get(self) -> pool.ConnectionPoolEntry:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            metrics.DB_POOL_TIMEOUTS.inc(target=self.target)
+            raise
+        finally:
+            metrics.DB_POOL_WAIT.observe(time.perf_counter() - start, target=self.target)
+
+
+class ReplicaTimedQueuePool(TimedQueuePool):
+    """Пул соединений реплики с теми же замерами"""
+
+    target = 'replica'
+
+
+def _instrument(engine: sa_asyncio.AsyncEngine, target: str) -> None:
+    """Подписывает метрики на события пула соединений"""
+    sqlalchemy.event.listen(engine.sync_engine, 'connect', lambda *_: metrics.DB_POOL_CONNECTIONS.inc(target=target))
+    sqlalchemy.event.listen(engine.sync_engine, 'checkout', lambda *_: metrics.DB_POOL_CHECKOUTS.inc(target=target))
+    sqlalchemy.event.listen(
+        engine.sync_engine, 'invalidate', lambda *_: metrics.DB_POOL_INVALIDATIONS.inc(target=target))
+
+
+def get_engine() -> sa_asyncio.AsyncEngine:
+    """Лениво создает движок основной БД при первом обращении"""
+    global _engine
+    if _engine is None:
+        credentials = db.get_db_credentials()
+        _engine = sa_asyncio.create_async_engine(
+            credentials.url, poolclass=TimedQueuePool, **credentials.engine_options)
+        _instrument(_engine, TimedQueuePool.target)
+    return _engine
+
+
+def get_sessionmaker() -> sa_asyncio.async_sessionmaker:
+    """Лениво создает фабрику сессий основной БД"""
+    global _sessionmaker
+    if _sessionmaker is None:
+        _sessionmaker = sa_asyncio.async_sessionmaker(get_engine())
+    return _sessionmaker
+
+
+def get_replica_sessionmaker() -> sa_asyncio.async_sessionmaker | None:
+    """Лениво создает фабрику сессий реплики для чтения, если реплика указана в настройках"""
+    global _replica_engine, _replica_sessionmaker
+    settings = db.get_db_replica_settings()
+    if settings is None:
+        return None
+    if _replica_sessionmaker is None:
+        credentials = settings.credentials
+        _replica_engine = sa_asyncio.create_async_engine(
+            credentials.url, poolclass=ReplicaTimedQueuePool, **credentials.engine_options)
+        _instrument(_replica_engine, ReplicaTimedQueuePool.target)
+        _replica_sessionmaker = sa_asyncio.async_sessionmaker(_replica_engine)
+    return _replica_sessionmaker
+
+
+async def _measure_replica_lag(sessionmaker: sa_asyncio.async_sessionmaker) -> float | None:
+    """Возвращает отставание реплики в секундах или None, если реплика недоступна"""
+    try:
+        async with sessionmaker() as session:
+            return float(await session.scalar(REPLICA_LAG_QUERY))
+    except Exception:
+        logger.warning('Не удалось проверить отставание реплики', exc_info=True)
+        return None
+
+
+async def get_read_sessionmaker() -> sa_asyncio.async_sessionmaker:
+    """Возвращает фабрику сессий для чтения: реплики, если она указана и отстает не больше
+    допустимого, иначе основной БД.
+
+    Отставание перепроверяется не чаще lag_check_interval_seconds. Пока идет проверка,
+    одновременные запросы используют предыдущий результат.
+    """
+    global _replica_lag, _replica_lag_checked_at
+    replica = get_replica_sessionmaker()
+    if replica is None:
+        return get_sessionmaker()
+    settings = db.get_db_replica_settings()
+    now = time.monotonic()
+    if now - _replica_lag_checked_at >= settings.lag_check_interval_seconds:
+        _replica_lag_checked_at = now
+        _replica_lag = await _measure_replica_lag(replica)
+        if _replica_lag is not None:
+            metrics.DB_REPLICA_LAG.set(_replica_lag)
+    if _replica_lag is None or _replica_lag > settings.max_lag_seconds:
+        metrics.DB_READ_SESSIONS.inc(target='primary')
+        return get_sessionmaker()
+    metrics.DB_READ_SESSIONS.inc(target='replica')
+    return replica
+
+
+async def dispose_engine() -> None:
+    """Закрывает соединения пулов основной БД и реплики"""
+    global _engine, _sessionmaker, _replica_engine, _replica_sessionmaker, _replica_lag, _replica_lag_checked_at
+    for engine in (_engine, _replica_engine):
+        if engine is not None:
+            await engine.dispose()
+    _engine = None
+    _sessionmaker = None
+    _replica_engine = None
+    _replica_sessionmaker = None
+    _replica_lag = None
+    _replica_lag_checked_at = -math.inf
+
+
+def create_default_engine() -> sa_asyncio.AsyncEngine:
+    """Создает движок дефолтной БД без пула: он нужен один раз, чтобы создать основную БД"""
+    credentials = db.get_db_default_credentials()
+    return sa_asyncio.create_async_engine(credentials.url, poolclass=pool.NullPool)
 
 
 async def is_db_exists(sessionmaker: sa_asyncio.async_sessionmaker) -> bool:
@@ -27,26 +161,45 @@ async def is_db_exists(sessionmaker: sa_asyncio.async_sessionmaker) -> bool:
 
 
 async def ensure_db_exists() -> None:
-    """Убеждается, что БД создана и при необходимости создаёт ее через дефолтное подключение"""
-    default_db_exists = await is_db_exists(async_default_sessionmaker)
-    db_exists = await is_db_exists(async_sessionmaker)
-    if not default_db_exists and not db_exists:
-        raise exceptions.BotfarmDBError(
-            'Не создана ни одна из указанных баз данных, продолжение работы невозможно')
-    if db_exists:
-        return
-    async with async_default_engine.connect() as conn:
-        conn: sa_asyncio.AsyncConnection = await conn.execution_options(isolation_level='AUTOCOMMIT')
-        await conn.execute(sqlalchemy.text(f'CREATE DATABASE {db.db_credentials.name}'))
-
+    """Убеждается, что БД создана и при необходимости создаёт ее через дефолтное подключение.
 
-async def create_tables():
-    """Создает таблицы по моделям"""
-    async with async_engine.begin() as conn:
-        await conn.run_sync(models.Base.metadata.create_all)
+    Сначала проверяется основная БД, дефолтное подключение открывается, только если ее нет.
+    """
+    if await is_db_exists(get_sessionmaker()):
+        return
+    default_engine = create_default_engine()
+    try:
+        if not await is_db_exists(sa_asyncio.async_sessionmaker(default_engine)):
+            raise exceptions.BotfarmDBError(
+                'Не создана ни одна из указанных баз данных, продолжение работы невозможно')
+        async with default_engine.connect() as conn:
+            conn: sa_asyncio.AsyncConnection = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            await conn.execute(sqlalchemy.text(f'CREATE DATABASE {db.get_db_credentials().name}'))
+    finally:
+        await default_engine.dispose()
 
 
 async def get_session() -> abc.AsyncIterator[sa_asyncio.AsyncSession]:
     """Выдает сессию, используется как Dependency Injection"""
-    async with async_sessionmaker() as session:
+    async with get_sessionmaker()() as session:
         yield session
+
+
+async def get_read_session() -> abc.AsyncIterator[sa_asyncio.AsyncSession]:
+    """Выдает сессию только для чтения: реплики или основной БД, используется как Dependency Injection"""
+    sessionmaker = await get_read_sessionmaker()
+    async with sessionmaker() as session:
+        yield session
+
+
+def get_pool_stats() -> schemas.PoolStats:
+    """Возвращает текущее состояние пула соединений основной БД"""
+    engine_pool = get_engine().pool
+    return schemas.PoolStats(
+        size=engine_pool.size(),
+        max_overflow=db.get_db_credentials().max_overflow,
+        checked_in=engine_pool.checkedin(),
+        checked_out=engine_pool.checkedout(),
+        overflow=max(engine_pool.overflow(), 0),
+        timeout=engine_pool.timeout(),
+    )
@@ -0,0 +1,120 @@
+import asyncio
+import contextlib
+import json
+import logging
+import uuid
+from collections import abc, defaultdict
+
+from sqlalchemy.ext import asyncio as sa_asyncio
+
+from botfarm.entities import models
+
+logger = logging.getLogger(__name__)
+
+USERS_CHANNEL = 'botfarm_users'
+PROJECTS_CHANNEL = 'botfarm_projects'
+RECONNECT_DELAY_SECONDS = 5
+
+
+def matches_user_filters(
+    event: dict,
+    project_id: uuid.UUID | None,
+    domain: models.DomainType | None,
+    env: models.EnvType | None,
+) -> bool:
+    """Проверяет, подходит ли пользователь из события канала USERS_CHANNEL под фильтры"""
+    if project_id is not None and event.get('project_id') != str(project_id):
+        return False
+    if domain is not None and event.get('domain') != domain.value:
+        return False
+    if env is not None and event.get('env') != env.value:
+        return False
+    return True
+
+
+class Listener:
+    """Общее LISTEN-подключение к Postgres, которое раздает события подписчикам внутри процесса.
+
+    Args:
+        channels: имена каналов, на которые подписывается подключение
+    """
+
+    def __init__(self, channels: abc.Iterable[str]) -> None:
+        self.channels = tuple(channels)
+        self._callbacks: dict[str, list[abc.Callable[[dict], None]]] = defaultdict(list)
+        self._engine: sa_asyncio.AsyncEngine | None = None
+        self._connection: sa_asyncio.AsyncConnection | None = None
+        self._reconnect_task: asyncio.Task | None = None
+
+    def subscribe(self, channel: str, callback: abc.Callable[[dict], None]) -> None:
+        """Добавляет подписчика, которому будут передаваться события канала"""
+        self._callbacks[channel].append(callback)
+
+    def unsubscribe(self, channel: str, callback: abc.Callable[[dict], None]) -> None:
+        """Удаляет подписчика канала"""
+        self._callbacks[channel].remove(callback)
+
+    async def start(self, engine: sa_asyncio.AsyncEngine) -> None:
+        """Занимает подключение из пула движка и подписывается на каналы"""
+        self._engine = engine
+        self._connection = await engine.connect()
+        raw_connection = await self._connection.get_raw_connection()
+        driver_connection = raw_connection.driver_connection
+        for channel in self.channels:
+            await driver_connection.add_listener(channel, self._dispatch)
+        driver_connection.add_termination_listener(self._on_termination)
+
+    async def stop(self) -> None:
+        """Отписывается от каналов и возвращает подключение в пул"""
+        self._engine = None
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        try:
+            raw_connection = await connection.get_raw_connection()
+            for channel in self.channels:
+                await raw_connection.driver_connection.remove_listener(channel, self._dispatch)
+        finally:
+            await connection.close()
+
+    def _dispatch(self, connection, pid: int, channel: str, payload: str) -> None:
+        """Разбирает уведомление и передает его всем подписчикам канала"""
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning('Некорректное уведомление в канале %s: %s', channel, payload)
+            return
+        for callback in list(self._callbacks[channel]):
+            try:
+                callback(event)
+            except Exception:
+                logger.exception('Подписчик канала %s завершился с ошибкой', channel)
+
+    def _on_termination(self, connection) -> None:
+        """Переподключается, если LISTEN-подключение было разорвано"""
+        if self._engine is None or self._reconnect_task is not None:
+            return
+        logger.warning('LISTEN-подключение к каналам %s разорвано', ', '.join(self.channels))
+        self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        """Пытается восстановить подписку, пока не получится или слушатель не остановят"""
+        engine = self._engine
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            with contextlib.suppress(Exception):
+                await connection.invalidate()
+        while self._engine is not None:
+            try:
+                await self.start(engine)
+                break
+            except Exception:
+                logger.exception('Не удалось переподключиться к каналам %s', ', '.join(self.channels))
+                await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+        self._reconnect_task = None
+
+
+listener = Listener((USERS_CHANNEL, PROJECTS_CHANNEL))
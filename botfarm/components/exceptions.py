@@ -4,6 +4,14 @@ from fastapi import responses, status
 from botfarm.entities import exceptions
 
 
+async def handle_invalid_cursor_error(request: fastapi.Request, exc: exceptions.BotfarmInvalidCursorError):
+    """Возвращает ответ 422, если передан некорректный курсор пагинации"""
+    return responses.JSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+        content={'detail': str(exc)},
+    )
+
+
 async def handle_project_not_exists_error(request: fastapi.Request, exc: exceptions.BotfarmProjectNotExistsError):
     """Возвращает ответ 422, если указанный проект не найден"""
     return responses.JSONResponse(
@@ -20,9 +28,49 @@ async def handle_user_not_exists_error(request: fastapi.Request, exc: exceptions
     )
 
 
+async def handle_invalid_password_error(request: fastapi.Request, exc: exceptions.BotfarmInvalidPasswordError):
+    """Возвращает ответ 401, если пароль пользователя неверный"""
+    return responses.JSONResponse(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        content={'detail': str(exc)},
+    )
+
+
 async def handle_user_locked_error(request: fastapi.Request, exc: exceptions.BotfarmUserLockedError):
     """Возвращает ответ 423, если пользователь уже занят"""
     return responses.JSONResponse(
         status_code=status.HTTP_423_LOCKED,
         content={'detail': str(exc)},
     )
+
+
+async def handle_no_free_users_error(request: fastapi.Request, exc: exceptions.BotfarmNoFreeUsersError):
+    """Возвращает ответ 423, если все подходящие пользователи заняты"""
+    return responses.JSONResponse(
+        status_code=status.HTTP_423_LOCKED,
+        content={'detail': str(exc)},
+    )
+
+
+async def handle_lock_quota_exceeded_error(request: fastapi.Request, exc: exceptions.BotfarmLockQuotaExceededError):
+    """Возвращает ответ 429, если проект исчерпал лимит одновременных блокировок"""
+    return responses.JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={'detail': str(exc)},
+    )
+
+
+async def handle_user_not_locked_error(request: fastapi.Request, exc: exceptions.BotfarmUserNotLockedError):
+    """Возвращает ответ 409, если пользователь не заблокирован"""
+    return responses.JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={'detail': str(exc)},
+    )
+
+
+async def handle_lock_not_exists_error(request: fastapi.Request, exc: exceptions.BotfarmLockNotExistsError):
+    """Возвращает ответ 422, если блокировка с указанным токеном не найдена"""
+    return responses.JSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+        content={'detail': str(exc)},
+    )
@@ -0,0 +1,117 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+from collections import abc
+from concurrent import futures
+
+from botfarm.components import utils
+from botfarm.entities import hashing
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+_executor: futures.ThreadPoolExecutor | None = None
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, dklen=HASH_BYTES, maxmem=256 * n * r * p,
+    )
+
+
+def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations, dklen=HASH_BYTES)
+
+
+def hash_password_sync(password: str, settings: hashing.HashingSettings) -> str:
+    """Хеширует пароль алгоритмом из настроек и возвращает хеш вместе с параметрами и солью"""
+    algorithm = settings.algorithm
+    if algorithm == hashing.HashAlgorithm.sha256:
+        return utils.hash_password(password)
+    salt = os.urandom(SALT_BYTES)
+    if algorithm == hashing.HashAlgorithm.scrypt:
+        digest = _scrypt(password, salt, settings.scrypt_n, settings.scrypt_r, settings.scrypt_p)
+        params = f'{settings.scrypt_n}${settings.scrypt_r}${settings.scrypt_p}'
+    else:
+        digest = _pbkdf2(password, salt, settings.pbkdf2_iterations)
+        params = str(settings.pbkdf2_iterations)
+    return f'{algorithm.value}${params}${_b64encode(salt)}${_b64encode(digest)}'
+
+
+def verify_password_sync(password: str, encoded: str) -> bool:
+    """Проверяет пароль по хешу любого поддерживаемого формата, включая старый SHA-256"""
+    algorithm, _, rest = encoded.partition('$')
+    try:
+        if not rest:
+            return hmac.compare_digest(utils.hash_password(password), encoded)
+        if algorithm == hashing.HashAlgorithm.scrypt.value:
+            n, r, p, salt, digest = rest.split('$')
+            expected = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+        elif algorithm == hashing.HashAlgorithm.pbkdf2_sha256.value:
+            iterations, salt, digest = rest.split('$')
+            expected = _pbkdf2(password, base64.b64decode(salt), int(iterations))
+        else:
+            return False
+        return hmac.compare_digest(expected, base64.b64decode(digest))
+    except ValueError:
+        return False
+
+
+def needs_rehash(encoded: str, settings: hashing.HashingSettings | None = None) -> bool:
+    """Проверяет, что хеш посчитан не текущим алгоритмом или не с текущими параметрами"""
+    settings = settings or hashing.get_hashing_settings()
+    algorithm, _, rest = encoded.partition('$')
+    if settings.algorithm == hashing.HashAlgorithm.sha256:
+        return bool(rest)
+    if algorithm != settings.algorithm.value:
+        return True
+    params = rest.rsplit('$', 2)[0]
+    if settings.algorithm == hashing.HashAlgorithm.scrypt:
+        return params != f'{settings.scrypt_n}${settings.scrypt_r}${settings.scrypt_p}'
+    return params != str(settings.pbkdf2_iterations)
+
+
+def _get_executor() -> futures.ThreadPoolExecutor:
+    """Лениво создает пул потоков для хеширования. hashlib отпускает GIL на время расчета"""
+    global _executor
+    if _executor is None:
+        _executor = futures.ThreadPoolExecutor(
+            max_workers=hashing.get_hashing_settings().workers, thread_name_prefix='botfarm-hashing')
+    return _executor
+
+
+async def hash_password(password: str) -> str:
+    """Хеширует пароль в пуле потоков, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(), hash_password_sync, password, hashing.get_hashing_settings())
+
+
+async def hash_passwords(passwords: abc.Iterable[str]) -> list[str]:
+    """Хеширует пачку паролей параллельно во всех потоках пула, сохраняя порядок"""
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    return list(await asyncio.gather(*(
+        loop.run_in_executor(executor, hash_password_sync, password, hashing.get_hashing_settings())
+        for password in passwords
+    )))
+
+
+async def verify_password(password: str, encoded: str) -> bool:
+    """Проверяет пароль по хешу в пуле потоков, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), verify_password_sync, password, encoded)
+
+
+def shutdown() -> None:
+    """Останавливает пул потоков хеширования"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
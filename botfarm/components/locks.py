@@ -0,0 +1,632 @@
+import abc
+import asyncio
+import functools
+import json
+import uuid
+from collections.abc import Callable, Iterable
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy as sa
+from sqlalchemy import exc as sa_exc
+from sqlalchemy import orm
+from sqlalchemy.ext import asyncio as sa_asyncio
+
+from botfarm.components import db, events, quotas
+from botfarm.entities import constants, exceptions, locks, models, schemas
+
+
+def _lease_expiration(lease: int) -> sa.ColumnElement:
+    """Возвращает SQL-выражение момента окончания аренды блокировки"""
+    return sa.func.now() + timedelta(seconds=lease)
+
+
+def _lock_values(lease: int, owner: str | None) -> dict:
+    """Возвращает значения колонок для постановки блокировки с новым токеном аренды"""
+    return {
+        'locktime': sa.func.now(),
+        'lease_expires_at': _lease_expiration(lease),
+        'owner': owner,
+        'lease_token': sa.func.gen_random_uuid(),
+    }
+
+
+_RELEASE_VALUES = {
+    'locktime': None,
+    'lease_expires_at': None,
+    'owner': None,
+    'lease_token': None,
+    # Снятие блокировки со свободного пользователя не отодвигает его в конец очереди выдачи
+    'last_released_at': sa.case(
+        (models.User.locktime.is_not(None), sa.func.now()), else_=models.User.last_released_at),
+}
+
+
+async def _user_exists(session: sa_asyncio.AsyncSession, login: str) -> bool:
+    return await session.scalar(sa.select(models.User.id).where(models.User.login == login)) is not None
+
+
+class LockBackend(abc.ABC):
+    """Способ блокировки пользователей.
+
+    Методы бросают те же исключения, что и функции components.users, которые их вызывают.
+    candidates в checkout - SELECT id пользователей, которые матчатся с фильтрами.
+    """
+
+    @abc.abstractmethod
+    async def acquire(
+        self, login: str, session: sa_asyncio.AsyncSession, lease: int, owner: str | None,
+    ) -> schemas.LockedUser:
+        """Блокирует пользователя по логину"""
+
+    @abc.abstractmethod
+    async def checkout(
+        self,
+        candidates: sa.Select,
+        count: int,
+        session: sa_asyncio.AsyncSession,
+        all_or_nothing: bool,
+        lease: int,
+        owner: str | None,
+    ) -> list[schemas.LockedUser]:
+        """Блокирует до count свободных пользователей из candidates"""
+
+    @abc.abstractmethod
+    async def is_locked(self, user: models.User, session: sa_asyncio.AsyncSession) -> bool:
+        """Проверяет, заблокирован ли пользователь"""
+
+    @abc.abstractmethod
+    async def extend(
+        self, login: str, session: sa_asyncio.AsyncSession, lease: int, token: uuid.UUID | None,
+    ) -> schemas.User:
+        """Продлевает аренду блокировки"""
+
+    @abc.abstractmethod
+    async def release(self, login: str, session: sa_asyncio.AsyncSession) -> schemas.User:
+        """Снимает блокировку пользователя по логину"""
+
+    @abc.abstractmethod
+    async def release_by_token(self, token: uuid.UUID, session: sa_asyncio.AsyncSession) -> schemas.User:
+        """Снимает блокировку по токену аренды"""
+
+    @abc.abstractmethod
+    async def release_owner(self, owner: str, session: sa_asyncio.AsyncSession) -> int:
+        """Снимает все блокировки владельца и возвращает их количество"""
+
+    @abc.abstractmethod
+    async def release_expired(self, session: sa_asyncio.AsyncSession) -> int:
+        """Снимает блокировки с истекшей арендой и возвращает их количество"""
+
+    async def start(self) -> None:
+        """Готовит бэкенд при запуске приложения"""
+
+    async def close(self) -> None:
+        """Освобождает ресурсы бэкенда при остановке приложения"""
+
+
+class ColumnLockBackend(LockBackend):
+    """Блокировка записью locktime, аренды и токена в строку пользователя.
+
+    Состояние видно всем процессам и запросам к users, переживает перезапуск приложения.
+    """
+
+    async def acquire(
+        self, login: str, session: sa_asyncio.AsyncSession, lease: int, owner: str | None,
+    ) -> schemas.LockedUser:
+        """Блокировка ставится условным UPDATE в CTE, а внешний SELECT по той же строке
+        позволяет за один запрос отличить отсутствующего пользователя от занятого"""
+        updated = (
+            sa.update(models.User)
+            .where(models.User.login == login, models.User.locktime.is_(None))
+            .values(**_lock_values(lease, owner))
+            .returning(*models.User.__table__.c)
+            .cte('updated')
+        )
+        locked_user = orm.aliased(models.User, updated)
+        result = await session.execute(
+            sa.select(models.User.id, locked_user)
+            .outerjoin(updated, updated.c.id == models.User.id)
+            .where(models.User.login == login)
+        )
+        row = result.one_or_none()
+        if row is None:
+            await session.rollback()
+            raise exceptions.BotfarmUserNotExistsError
+        _, user = row
+        if user is None:
+            await session.rollback()
+            raise exceptions.BotfarmUserLockedError
+        locked = schemas.LockedUser.model_validate(user)
+        await session.commit()
+        return locked
+
+    async def checkout(
+        self,
+        candidates: sa.Select,
+        count: int,
+        session: sa_asyncio.AsyncSession,
+        all_or_nothing: bool,
+        lease: int,
+        owner: str | None,
+    ) -> list[schemas.LockedUser]:
+        """Выбор и блокировка выполняются одним UPDATE с подзапросом FOR UPDATE SKIP LOCKED,
+        поэтому параллельные вызовы получают разных пользователей без повторных попыток.
+
+        Первыми выдаются никогда не освобождавшиеся, затем освобожденные раньше всех.
+        Для фильтра по проекту, окружению и домену это один проход по индексу ix_users_free_lru.
+        Пользователи проектов с исчерпанным лимитом не выбираются. Если лимит исчерпали параллельные
+        блокировки уже после выборки, то триггер пропускает строки, и недостающие выбираются
+        заново, не больше LOCK_CHECKOUT_QUOTA_RETRIES раз.
+        """
+        locked: list[schemas.LockedUser] = []
+        for _ in range(constants.LOCK_CHECKOUT_QUOTA_RETRIES + 1):
+            selected, users = await self._lock_free(candidates, count - len(locked), session, lease, owner)
+            locked.extend(users)
+            if len(users) == selected or len(locked) == count:
+                break
+        if not locked:
+            await session.rollback()
+            raise exceptions.BotfarmNoFreeUsersError
+        if all_or_nothing and len(locked) < count:
+            await session.rollback()
+            raise exceptions.BotfarmNotEnoughFreeUsersError
+        await session.commit()
+        return locked
+
+    async def _lock_free(
+        self, candidates: sa.Select, count: int, session: sa_asyncio.AsyncSession, lease: int, owner: str | None,
+    ) -> tuple[int, list[schemas.LockedUser]]:
+        """Блокирует до count свободных кандидатов и возвращает, сколько их было выбрано и кто заблокирован.
+
+        Выбранных меньше, чем заблокированных, если триггер лимитов пропустил часть строк.
+        """
+        free = (
+            candidates
+            .where(models.User.locktime.is_(None), quotas.has_room())
+            .order_by(models.User.last_released_at.asc().nulls_first())
+            .limit(count)
+            .with_for_update(skip_locked=True)
+            .cte('free')
+        )
+        updated = (
+            sa.update(models.User)
+            .where(models.User.id.in_(sa.select(free.c.id)))
+            .values(**_lock_values(lease, owner))
+            .returning(*models.User.__table__.c)
+            .cte('updated')
+        )
+        selected = sa.select(sa.func.count().label('selected')).select_from(free).subquery()
+        locked_user = orm.aliased(models.User, updated)
+        result = await session.execute(
+            sa.select(selected.c.selected, locked_user).select_from(selected).outerjoin(updated, sa.true())
+        )
+        selected_count = 0
+        users = []
+        for selected_count, user in result.all():
+            if user is not None:
+                users.append(user)
+        return selected_count, schemas.locked_user_list_adapter.validate_python(users, from_attributes=True)
+
+    async def is_locked(self, user: models.User, session: sa_asyncio.AsyncSession) -> bool:
+        return user.locktime is not None
+
+    async def extend(
+        self, login: str, session: sa_asyncio.AsyncSession, lease: int, token: uuid.UUID | None,
+    ) -> schemas.User:
+        statement = sa.update(models.User).where(
+            models.User.login == login, models.User.locktime.is_not(None))
+        if token is not None:
+            statement = statement.where(models.User.lease_token == token)
+        user = await session.scalar(
+            statement
+            .values(lease_expires_at=_lease_expiration(lease))
+            .returning(models.User)
+            .execution_options(synchronize_session=False)
+        )
+        if user is None:
+            await session.rollback()
+            if not await _user_exists(session, login):
+                raise exceptions.BotfarmUserNotExistsError
+            raise exceptions.BotfarmUserNotLockedError
+        extended = schemas.User.model_validate(user)
+        await session.commit()
+        return extended
+
+    async def release(self, login: str, session: sa_asyncio.AsyncSession) -> schemas.User:
+        return await self._release_one(models.User.login == login, session, exceptions.BotfarmUserNotExistsError)
+
+    async def release_by_token(self, token: uuid.UUID, session: sa_asyncio.AsyncSession) -> schemas.User:
+        return await self._release_one(models.User.lease_token == token, session, exceptions.BotfarmLockNotExistsError)
+
+    async def release_owner(self, owner: str, session: sa_asyncio.AsyncSession) -> int:
+        return await self._release_many(models.User.owner == owner, session)
+
+    async def release_expired(self, session: sa_asyncio.AsyncSession) -> int:
+        return await self._release_many(models.User.lease_expires_at <= sa.func.now(), session)
+
+    async def _release_one(
+        self, condition: sa.ColumnElement, session: sa_asyncio.AsyncSession, missing: type[Exception],
+    ) -> schemas.User:
+        """Снимает блокировку одним UPDATE ... RETURNING"""
+        user = await session.scalar(
+            sa.update(models.User)
+            .where(condition)
+            .values(**_RELEASE_VALUES)
+            .returning(models.User)
+            .execution_options(synchronize_session=False)
+        )
+        if user is None:
+            await session.rollback()
+            raise missing
+        released = schemas.User.model_validate(user)
+        await session.commit()
+        return released
+
+    async def _release_many(self, condition: sa.ColumnElement, session: sa_asyncio.AsyncSession) -> int:
+        """Снимает блокировки одним UPDATE и возвращает их количество"""
+        result = await session.execute(
+            sa.update(models.User)
+            .where(condition)
+            .values(**_RELEASE_VALUES)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        return result.rowcount
+
+
+def advisory_key(user_id: uuid.UUID) -> int:
+    """Ключ advisory lock пользователя: первые 8 байт UUID как знаковое bigint"""
+    return int.from_bytes(user_id.bytes[:8], 'big', signed=True)
+
+
+_TRY_LOCK = sa.text(
+    'SELECT k FROM unnest(CAST(:keys AS bigint[])) AS k WHERE pg_try_advisory_lock(k)'
+)
+# Снятие advisory lock не меняет users, поэтому уведомление для ожидающих checkout
+# отправляется явно в том же формате, что и триггер освобождения
+_UNLOCK = sa.text(
+    'SELECT pg_advisory_unlock(k), pg_notify(:channel, p) '
+    'FROM unnest(CAST(:keys AS bigint[]), CAST(:payloads AS text[])) AS t(k, p)'
+)
+_UNLOCK_SILENTLY = sa.text('SELECT pg_advisory_unlock(k) FROM unnest(CAST(:keys AS bigint[])) AS k')
+# Блокировку процесса держит первое выделенное подключение. Ключ из двух int4 лежит
+# в отдельном от ключей пользователей пространстве pg_locks (objsubid = 2)
+_PROCESS_GUARD = sa.text('SELECT pg_try_advisory_lock(:classid, 0)')
+PROCESS_GUARD_CLASSID = 0x626F7466
+_IS_LOCKED = sa.text(
+    "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND granted "
+    'AND database = (SELECT oid FROM pg_database WHERE datname = current_database()) '
+    'AND classid = :classid AND objid = :objid AND objsubid = 1)'
+)
+
+
+def _release_payload(user: schemas.User) -> str:
+    return json.dumps({
+        'event': 'release',
+        'login': user.login,
+        'project_id': str(user.project_id) if user.project_id else None,
+        'env': user.env.value,
+        'domain': user.domain.value,
+        'owner': user.owner,
+    })
+
+
+def _unlocked(user: schemas.LockedUser) -> schemas.User:
+    return schemas.User(**user.model_dump(exclude={'locktime', 'lease_expires_at', 'owner', 'lease_token'}))
+
+
+class _AdvisoryConnection:
+    """Выделенное подключение, которое держит advisory locks своей доли ключей.
+
+    Запросы к нему выполняются под mutex, потому что одно подключение не выполняет их параллельно.
+
+    Args:
+        get_engine: функция, возвращающая движок, из пула которого берется подключение
+        on_lost: вызывается, когда подключение оборвалось вместе со всеми его блокировками
+        guard: держать на подключении блокировку процесса, чтобы бэкенд не запустился во втором
+    """
+
+    def __init__(
+        self,
+        get_engine: Callable[[], sa_asyncio.AsyncEngine],
+        on_lost: Callable[[], None],
+        guard: bool = False,
+    ) -> None:
+        self._get_engine = get_engine
+        self._on_lost = on_lost
+        self._guard = guard
+        self._connection: sa_asyncio.AsyncConnection | None = None
+        self.mutex = asyncio.Lock()
+
+    async def open(self) -> None:
+        """Открывает подключение, если оно еще не открыто"""
+        if self._connection is not None:
+            return
+        connection = await self._get_engine().connect()
+        connection = await connection.execution_options(isolation_level='AUTOCOMMIT')
+        if self._guard:
+            result = await connection.execute(_PROCESS_GUARD, {'classid': PROCESS_GUARD_CLASSID})
+            if not result.scalar():
+                await connection.close()
+                raise exceptions.BotfarmLockBackendBusyError
+        self._connection = connection
+
+    async def execute(self, statement: sa.TextClause, parameters: dict) -> sa.CursorResult:
+        """Выполняет запрос, открывая подключение при необходимости"""
+        await self.open()
+        try:
+            return await self._connection.execute(statement, parameters)
+        except sa_exc.DBAPIError as exc:
+            if exc.connection_invalidated or self._connection.invalidated:
+                # Вместе с подключением Postgres снял и все его блокировки
+                await self.close()
+                self._on_lost()
+            raise
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._connection.close()
+        self._connection = None
+
+
+class AdvisoryLockBackend(LockBackend):
+    """Блокировка session-level advisory lock Postgres по ключу из UUID пользователя.
+
+    Блокировки держат несколько выделенных подключений процесса: ключ пользователя всегда
+    попадает на одно и то же подключение по остатку от деления, поэтому операции с разными
+    пользователями идут параллельно. Аренды, владельцы и токены хранятся в памяти, поэтому
+    lock и unlock не пишут в users и не порождают WAL. При обрыве подключения Postgres снимает
+    все его блокировки.
+
+    Токены и владельцы есть только в памяти, поэтому снять блокировку по ним может только процесс,
+    который ее выдал. Чтобы запрос не попал в другой воркер, бэкенд работает в одном процессе на БД:
+    первое подключение держит блокировку процесса, и второй процесс не запускается.
+
+    Args:
+        get_engine: функция, возвращающая движок, из пула которого берутся подключения
+        connections: количество выделенных подключений, по умолчанию из настроек
+    """
+
+    def __init__(
+        self,
+        get_engine: Callable[[], sa_asyncio.AsyncEngine] = db.get_engine,
+        connections: int | None = None,
+    ) -> None:
+        if connections is None:
+            connections = locks.get_lock_settings().advisory_connections
+        self._connections = [
+            _AdvisoryConnection(get_engine, functools.partial(self._forget, index), guard=index == 0)
+            for index in range(connections)
+        ]
+        self._locks: dict[str, schemas.LockedUser] = {}
+        self._logins_by_token: dict[uuid.UUID, str] = {}
+
+    async def acquire(
+        self, login: str, session: sa_asyncio.AsyncSession, lease: int, owner: str | None,
+    ) -> schemas.LockedUser:
+        user = await session.scalar(sa.select(models.User).where(models.User.login == login))
+        if user is None:
+            raise exceptions.BotfarmUserNotExistsError
+        locked = await self._lock([schemas.User.model_validate(user)], 1, lease, owner)
+        if not locked:
+            raise exceptions.BotfarmUserLockedError
+        return locked[0]
+
+    async def checkout(
+        self,
+        candidates: sa.Select,
+        count: int,
+        session: sa_asyncio.AsyncSession,
+        all_or_nothing: bool,
+        lease: int,
+        owner: str | None,
+    ) -> list[schemas.LockedUser]:
+        """Перебирает подходящих пользователей по id пачками и пробует взять их блокировки
+        одним запросом на подключение, пока не наберет count"""
+        locked: list[schemas.LockedUser] = []
+        batch_size = max(2 * count, constants.LOCK_CHECKOUT_BATCH_SIZE)
+        statement = sa.select(models.User).where(models.User.id.in_(candidates)).order_by(models.User.id)
+        last_id = None
+        while len(locked) < count:
+            batch = statement if last_id is None else statement.where(models.User.id > last_id)
+            result = await session.scalars(batch.limit(batch_size))
+            users = schemas.user_list_adapter.validate_python(result.all(), from_attributes=True)
+            if not users:
+                break
+            last_id = users[-1].id
+            locked += await self._lock(users, count - len(locked), lease, owner)
+        await session.rollback()
+        if not locked:
+            raise exceptions.BotfarmNoFreeUsersError
+        if all_or_nothing and len(locked) < count:
+            await self._unlock(locked, notify=False)
+            raise exceptions.BotfarmNotEnoughFreeUsersError
+        return locked
+
+    async def is_locked(self, user: models.User, session: sa_asyncio.AsyncSession) -> bool:
+        """Проверяет блокировку по памяти, а затем по pg_locks на своем подключении к основной БД.
+
+        Сессия вызывающего для этого не подходит: на реплике advisory locks основной БД не видны.
+        """
+        if user.login in self._locks:
+            return True
+        key = advisory_key(user.id) & 0xFFFF_FFFF_FFFF_FFFF
+        connection = self._connections[self._connection_index(user.id)]
+        async with connection.mutex:
+            result = await connection.execute(_IS_LOCKED, {'classid': key >> 32, 'objid': key & 0xFFFF_FFFF})
+            return result.scalar()
+
+    async def extend(
+        self, login: str, session: sa_asyncio.AsyncSession, lease: int, token: uuid.UUID | None,
+    ) -> schemas.User:
+        locked = self._locks.get(login)
+        if locked is None or (token is not None and locked.lease_token != token):
+            if not await _user_exists(session, login):
+                raise exceptions.BotfarmUserNotExistsError
+            raise exceptions.BotfarmUserNotLockedError
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=lease)
+        self._locks[login] = locked = locked.model_copy(update={'lease_expires_at': expires_at})
+        return schemas.User(**locked.model_dump(exclude={'lease_token'}))
+
+    async def release(self, login: str, session: sa_asyncio.AsyncSession) -> schemas.User:
+        locked = self._locks.get(login)
+        if locked is not None:
+            await self._unlock([locked])
+            return _unlocked(locked)
+        user = await session.scalar(sa.select(models.User).where(models.User.login == login))
+        if user is None:
+            raise exceptions.BotfarmUserNotExistsError
+        if await self.is_locked(user, session):
+            # Блокировку держит чужое подключение, снять ее отсюда нельзя
+            raise exceptions.BotfarmUserLockedError
+        return schemas.User.model_validate(user)
+
+    async def release_by_token(self, token: uuid.UUID, session: sa_asyncio.AsyncSession) -> schemas.User:
+        login = self._logins_by_token.get(token)
+        if login is None:
+            raise exceptions.BotfarmLockNotExistsError
+        locked = self._locks[login]
+        await self._unlock([locked])
+        return _unlocked(locked)
+
+    async def release_owner(self, owner: str, session: sa_asyncio.AsyncSession) -> int:
+        return await self._unlock([locked for locked in self._locks.values() if locked.owner == owner])
+
+    async def release_expired(self, session: sa_asyncio.AsyncSession) -> int:
+        now = datetime.now(timezone.utc)
+        return await self._unlock([locked for locked in self._locks.values() if locked.lease_expires_at <= now])
+
+    async def start(self) -> None:
+        """Берет блокировку процесса при запуске приложения, а не при первой блокировке"""
+        connection = self._connections[0]
+        async with connection.mutex:
+            await connection.open()
+
+    async def close(self) -> None:
+        """Закрывает выделенные подключения, Postgres при этом снимает все их блокировки"""
+        for connection in self._connections:
+            async with connection.mutex:
+                await connection.close()
+        self._locks.clear()
+        self._logins_by_token.clear()
+
+    def _connection_index(self, user_id: uuid.UUID) -> int:
+        return advisory_key(user_id) % len(self._connections)
+
+    def _group(self, users: Iterable[schemas.User]) -> dict[int, list]:
+        """Раскладывает пользователей по подключениям, которые держат их ключи"""
+        groups: dict[int, list] = {}
+        for user in users:
+            groups.setdefault(self._connection_index(user.id), []).append(user)
+        return groups
+
+    async def _lock(
+        self, users: list[schemas.User], limit: int, lease: int, owner: str | None,
+    ) -> list[schemas.LockedUser]:
+        """Берет блокировки не больше чем limit пользователей из users в их порядке.
+
+        Каждое подключение пробует взять свою долю ключей одним запросом параллельно с остальными,
+        а взятые сверх limit сразу снимаются.
+        """
+        now = datetime.now(timezone.utc)
+        results = await asyncio.gather(
+            *(self._try_lock(index, group, now, lease, owner) for index, group in self._group(users).items()),
+            return_exceptions=True,
+        )
+        taken = {
+            user.login: user for result in results if not isinstance(result, BaseException) for user in result
+        }
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            await self._unlock(list(taken.values()), notify=False)
+            raise errors[0]
+        ordered = [taken[user.login] for user in users if user.login in taken]
+        await self._unlock(ordered[limit:], notify=False)
+        return ordered[:limit]
+
+    async def _try_lock(
+        self, index: int, users: list[schemas.User], now: datetime, lease: int, owner: str | None,
+    ) -> list[schemas.LockedUser]:
+        """Пробует взять блокировки пользователей на одном подключении.
+
+        Session-level advisory lock реентерабелен, поэтому уже выданные этим процессом
+        блокировки отсекаются по памяти, а проверка, захват и запись идут под мьютексом подключения.
+        """
+        connection = self._connections[index]
+        async with connection.mutex:
+            free = {advisory_key(user.id): user for user in users if user.login not in self._locks}
+            if not free:
+                return []
+            result = await connection.execute(_TRY_LOCK, {'keys': list(free)})
+            locked = []
+            for key in result.scalars().all():
+                user = schemas.LockedUser(
+                    **free[key].model_dump(exclude={'locktime', 'lease_expires_at', 'owner'}),
+                    locktime=now,
+                    lease_expires_at=now + timedelta(seconds=lease),
+                    owner=owner,
+                    lease_token=uuid.uuid4(),
+                )
+                self._locks[user.login] = user
+                self._logins_by_token[user.lease_token] = user.login
+                locked.append(user)
+            return locked
+
+    async def _unlock(self, users: list[schemas.LockedUser], notify: bool = True) -> int:
+        """Снимает блокировки одним запросом на подключение и уведомляет ожидающих checkout"""
+        if not users:
+            return 0
+        counts = await asyncio.gather(
+            *(self._unlock_group(index, group, notify) for index, group in self._group(users).items()))
+        return sum(counts)
+
+    async def _unlock_group(self, index: int, users: list[schemas.LockedUser], notify: bool) -> int:
+        connection = self._connections[index]
+        async with connection.mutex:
+            users = [user for user in users if self._locks.get(user.login) is user]
+            if not users:
+                return 0
+            keys = [advisory_key(user.id) for user in users]
+            if notify:
+                await connection.execute(_UNLOCK, {
+                    'channel': events.USERS_CHANNEL,
+                    'keys': keys,
+                    'payloads': [_release_payload(user) for user in users],
+                })
+            else:
+                await connection.execute(_UNLOCK_SILENTLY, {'keys': keys})
+            for user in users:
+                del self._locks[user.login]
+                del self._logins_by_token[user.lease_token]
+            return len(users)
+
+    def _forget(self, index: int) -> None:
+        """Забывает блокировки подключения, которое оборвалось"""
+        for login, locked in list(self._locks.items()):
+            if self._connection_index(locked.id) == index:
+                del self._locks[login]
+                del self._logins_by_token[locked.lease_token]
+
+
+_backend: LockBackend | None = None
+
+
+def get_backend() -> LockBackend:
+    """Лениво создает бэкенд блокировок, выбранный в настройках"""
+    global _backend
+    if _backend is None:
+        backend = locks.get_lock_settings().backend
+        _backend = AdvisoryLockBackend() if backend == locks.LockBackendType.advisory else ColumnLockBackend()
+    return _backend
+
+
+async def start_backend() -> None:
+    """Создает и запускает бэкенд блокировок, выбранный в настройках"""
+    await get_backend().start()
+
+
+async def close_backend() -> None:
+    """Закрывает бэкенд блокировок, если он был создан"""
+    global _backend
+    if _backend is not None:
+        await _backend.close()
+    _backend = None
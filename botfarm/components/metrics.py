@@ -0,0 +1,253 @@
+import abc
+import bisect
+import inspect
+import math
+import time
+from collections.abc import Callable, Coroutine, Iterator, Sequence
+
+import fastapi
+from fastapi import routing
+from starlette import concurrency
+
+from botfarm.entities import schemas
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(abc.ABC):
+    """Базовая метрика с набором меток, значения хранятся по кортежу значений меток"""
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'Метрика {self.name} ожидает метки {self.labelnames}, переданы {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def _samples(self) -> Iterator[str]:
+        """Возвращает строки значений метрики в текстовом формате Prometheus"""
+
+    def render(self) -> str:
+        header = f'# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n'
+        return header + ''.join(f'{sample}\n' for sample in self._samples())
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if amount < 0:
+            raise ValueError('Счетчик может только расти')
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Gauge(Counter):
+    """Значение, которое может как расти, так и уменьшаться"""
+    kind = 'gauge'
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Распределение значений по накопительным корзинам, как в Prometheus"""
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] = self._sums.get(key, 0) + value
+
+    def count(self, **labels: str) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def _samples(self) -> Iterator[str]:
+        bucket_labels = (*self.labelnames, 'le')
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                labels = _format_labels(bucket_labels, (*key, _format_value(bound)))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(self._sums[key])}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+    """Набор метрик, который отдается эндпоинтом /metrics"""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f'Метрика {metric.name} уже зарегистрирована')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return ''.join(metric.render() for metric in self._metrics.values())
+
+
+registry = Registry()
+
+HTTP_REQUEST_DURATION = registry.register(Histogram(
+    'botfarm_http_request_duration_seconds', 'Время обработки запроса до отправки ответа',
+    ('method', 'route', 'status'),
+))
+HTTP_REQUESTS_IN_PROGRESS = registry.register(Gauge(
+    'botfarm_http_requests_in_progress', 'Запросы, которые обрабатываются сейчас', ('method', 'route'),
+))
+DB_POOL_WAIT = registry.register(Histogram(
+    'botfarm_db_pool_wait_seconds', 'Время получения соединения из пула, включая открытие нового', ('target',),
+))
+DB_POOL_TIMEOUTS = registry.register(Counter(
+    'botfarm_db_pool_timeouts_total', 'Запросы соединения, не дождавшиеся его за pool_timeout', ('target',),
+))
+DB_POOL_CONNECTIONS = registry.register(Counter(
+    'botfarm_db_pool_connections_total', 'Открытые пулом соединения с БД', ('target',),
+))
+DB_POOL_CHECKOUTS = registry.register(Counter(
+    'botfarm_db_pool_checkouts_total', 'Выдачи соединений из пула', ('target',),
+))
+DB_POOL_INVALIDATIONS = registry.register(Counter(
+    'botfarm_db_pool_invalidations_total', 'Соединения, признанные пулом нерабочими', ('target',),
+))
+DB_POOL_SIZE = registry.register(Gauge('botfarm_db_pool_size', 'Размер пула соединений'))
+DB_POOL_CHECKED_OUT = registry.register(Gauge(
+    'botfarm_db_pool_checked_out', 'Соединения, выданные из пула',
+))
+DB_POOL_CHECKED_IN = registry.register(Gauge(
+    'botfarm_db_pool_checked_in', 'Свободные соединения в пуле',
+))
+DB_POOL_OVERFLOW = registry.register(Gauge(
+    'botfarm_db_pool_overflow', 'Соединения, открытые сверх размера пула',
+))
+DB_REPLICA_LAG = registry.register(Gauge(
+    'botfarm_db_replica_lag_seconds', 'Отставание реплики при последней проверке',
+))
+DB_READ_SESSIONS = registry.register(Counter(
+    'botfarm_db_read_sessions_total', 'Сессии для чтения по БД, в которую они ушли', ('target',),
+))
+LOCK_ACQUIRES = registry.register(Counter(
+    'botfarm_lock_acquires_total', 'Попытки блокировки пользователей по результату', ('result',),
+))
+LOCK_RELEASES = registry.register(Counter(
+    'botfarm_lock_releases_total', 'Снятые блокировки по способу снятия', ('reason',),
+))
+USERS = registry.register(Gauge(
+    'botfarm_users', 'Пользователи по состоянию блокировки из кешированной сводки', ('state',),
+))
+
+
+def set_pool_stats(stats: schemas.PoolStats) -> None:
+    """Обновляет метрики пула по его текущему состоянию"""
+    DB_POOL_SIZE.set(stats.size)
+    DB_POOL_CHECKED_OUT.set(stats.checked_out)
+    DB_POOL_CHECKED_IN.set(stats.checked_in)
+    DB_POOL_OVERFLOW.set(stats.overflow)
+
+
+async def _handle_exception(request: fastapi.Request, exc: Exception) -> fastapi.Response:
+    """Строит ответ зарегистрированным в приложении обработчиком исключения.
+
+    Так статус ответа известен уже в маршруте. Исключения без обработчика пробрасываются дальше.
+    """
+    handlers = request.app.exception_handlers
+    for cls in type(exc).__mro__:
+        handler = handlers.get(cls)
+        if handler is not None:
+            break
+    else:
+        raise exc
+    if inspect.iscoroutinefunction(handler):
+        return await handler(request, exc)
+    return await concurrency.run_in_threadpool(handler, request, exc)
+
+
+class MetricsRoute(routing.APIRoute):
+    """Маршрут, который замеряет время обработки и количество запросов в работе.
+
+    Метка route - шаблон пути, а не фактический путь, чтобы число рядов метрики не росло.
+    Для потоковых ответов время считается до начала отправки тела.
+    """
+
+    def get_route_handler(self) -> Callable[[fastapi.Request], Coroutine]:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: fastapi.Request) -> fastapi.Response:
+            labels = {'method': request.method, 'route': self.path}
+            HTTP_REQUESTS_IN_PROGRESS.inc(**labels)
+            start = time.perf_counter()
+            status = 500
+            try:
+                try:
+                    response = await handler(request)
+                except Exception as exc:
+                    response = await _handle_exception(request, exc)
+                status = response.status_code
+                return response
+            finally:
+                HTTP_REQUESTS_IN_PROGRESS.dec(**labels)
+                HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, status=str(status), **labels)
+
+        return timed_handler
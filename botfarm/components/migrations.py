@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import re
+
+import sqlalchemy as sa
+from sqlalchemy.ext import asyncio as sa_asyncio
+
+from botfarm.entities import exceptions, migrations
+
+logger = logging.getLogger(__name__)
+
+_CONCURRENT_INDEX = re.compile(
+    r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)', re.IGNORECASE)
+
+
+async def _disable_timeouts(conn: sa_asyncio.AsyncConnection) -> None:
+    """Снимает таймауты из настроек пула: миграции и ожидание advisory lock бывают долгими"""
+    await conn.execute(sa.text('SET statement_timeout = 0'))
+    await conn.execute(sa.text('SET lock_timeout = 0'))
+
+
+async def _reset_timeouts(conn: sa_asyncio.AsyncConnection) -> None:
+    """Возвращает таймауты к значениям подключения перед возвратом соединения в пул"""
+    await conn.execute(sa.text('RESET statement_timeout'))
+    await conn.execute(sa.text('RESET lock_timeout'))
+
+
+async def _wait_for_lock(conn: sa_asyncio.AsyncConnection) -> None:
+    """Берет advisory lock миграций, опрашивая его pg_try_advisory_lock не дольше MIGRATIONS_LOCK_WAIT_SECONDS.
+
+    Ожидание внутри pg_advisory_lock держит снимок открытым, а CREATE INDEX CONCURRENTLY
+    у процесса с блокировкой ждет все старые снимки, поэтому процессы ждали бы друг друга вечно.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + migrations.MIGRATIONS_LOCK_WAIT_SECONDS
+    lock_key = {'key': migrations.MIGRATIONS_LOCK_KEY}
+    while not await conn.scalar(sa.text('SELECT pg_try_advisory_lock(:key)'), lock_key):
+        if loop.time() >= deadline:
+            raise exceptions.BotfarmMigrationLockTimeoutError
+        await asyncio.sleep(migrations.MIGRATIONS_LOCK_POLL_SECONDS)
+
+
+async def _drop_invalid_index(conn: sa_asyncio.AsyncConnection, statement: str) -> None:
+    """Удаляет индекс, который остался INVALID после прерванного CREATE INDEX CONCURRENTLY.
+
+    Иначе повторная попытка пропустит его из-за IF NOT EXISTS, миграция запишется
+    как примененная, а планировщик так и не будет использовать индекс.
+    """
+    match = _CONCURRENT_INDEX.match(statement.strip())
+    if match is None:
+        return
+    name = match.group(1)
+    invalid = await conn.scalar(
+        sa.text('SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)'), {'name': name})
+    if invalid:
+        logger.warning('Индекс %s остался невалидным после прерванного построения и будет пересоздан', name)
+        await conn.execute(sa.text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+
+
+async def _apply(engine: sa_asyncio.AsyncEngine, migration: migrations.Migration) -> None:
+    """Выполняет выражения миграции и записывает ее версию в таблицу миграций"""
+    record = sa.text(
+        f'INSERT INTO {migrations.MIGRATIONS_TABLE} (version, name) VALUES (:version, :name)'
+    ).bindparams(version=migration.version, name=migration.name)
+    if migration.transactional:
+        async with engine.begin() as conn:
+            await conn.execute(sa.text('SET LOCAL statement_timeout = 0'))
+            await conn.execute(sa.text('SET LOCAL lock_timeout = 0'))
+            for statement in migration.statements:
+                await conn.execute(sa.text(statement))
+            await conn.execute(record)
+        return
+    async with engine.connect() as conn:
+        conn: sa_asyncio.AsyncConnection = await conn.execution_options(isolation_level='AUTOCOMMIT')
+        await _disable_timeouts(conn)
+        try:
+            for statement in migration.statements:
+                await _drop_invalid_index(conn, statement)
+                await conn.execute(sa.text(statement))
+            await conn.execute(record)
+        finally:
+            await _reset_timeouts(conn)
+
+
+async def upgrade(engine: sa_asyncio.AsyncEngine) -> list[int]:
+    """Применяет еще не примененные миграции по порядку и возвращает их версии.
+
+    Параллельно стартующие процессы сериализуются на advisory lock, поэтому каждая
+    миграция применяется ровно один раз. Блокировка ожидается опросом без открытого запроса.
+    Если сохраненный в комментарии к таблице миграций отпечаток совпадает с текущим,
+    проверка обходится одним запросом без DDL и блокировок.
+    """
+    fingerprint = migrations.get_schema_fingerprint()
+    async with engine.connect() as conn:
+        stored = await conn.scalar(
+            sa.text("SELECT obj_description(to_regclass(:table), 'pg_class')"),
+            {'table': migrations.MIGRATIONS_TABLE},
+        )
+    if stored == fingerprint:
+        return []
+    async with engine.connect() as conn:
+        conn: sa_asyncio.AsyncConnection = await conn.execution_options(isolation_level='AUTOCOMMIT')
+        await _disable_timeouts(conn)
+        try:
+            await conn.execute(sa.text(
+                f'CREATE TABLE IF NOT EXISTS {migrations.MIGRATIONS_TABLE} ('
+                'version INTEGER PRIMARY KEY, '
+                'name VARCHAR(255) NOT NULL, '
+                'applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())'
+            ))
+            await _wait_for_lock(conn)
+            try:
+                result = await conn.scalars(sa.text(f'SELECT version FROM {migrations.MIGRATIONS_TABLE}'))
+                applied = set(result.all())
+                pending = [migration for migration in migrations.MIGRATIONS if migration.version not in applied]
+                for migration in sorted(pending, key=lambda migration: migration.version):
+                    logger.info('Применяется миграция %d: %s', migration.version, migration.name)
+                    await _apply(engine, migration)
+                await conn.execute(sa.text(f"COMMENT ON TABLE {migrations.MIGRATIONS_TABLE} IS '{fingerprint}'"))
+            finally:
+                await conn.execute(sa.text('SELECT pg_advisory_unlock(:key)'), {'key': migrations.MIGRATIONS_LOCK_KEY})
+        finally:
+            await _reset_timeouts(conn)
+    return [migration.version for migration in pending]
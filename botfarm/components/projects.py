@@ -1,7 +1,79 @@
+import time
+import uuid
+from collections import OrderedDict, abc
+
 import sqlalchemy as sa
 from sqlalchemy.ext import asyncio as sa_asyncio
 
-from botfarm.entities import exceptions, models, schemas
+from botfarm.components import utils
+from botfarm.entities import constants, exceptions, models, schemas
+
+
+class ProjectCache:
+    """LRU-кеш соответствий имени и UUID проекта с ограниченным временем жизни записей.
+
+    Каждая инвалидация увеличивает version. Запись, прочитанная из БД до инвалидации,
+    не попадет в кеш, даже если ответ пришел уже после нее.
+
+    Args:
+        maxsize: максимальное количество проектов в кеше
+        ttl: время жизни записи в секундах
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = 0
+        self._by_name: OrderedDict[str, tuple[uuid.UUID, float]] = OrderedDict()
+        self._by_id: dict[uuid.UUID, str] = {}
+
+    def get_id(self, name: str) -> uuid.UUID | None:
+        """Возвращает UUID проекта по имени, если он есть в кеше и не устарел"""
+        entry = self._by_name.get(name)
+        if entry is None:
+            return None
+        project_id, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._pop(name)
+            return None
+        self._by_name.move_to_end(name)
+        return project_id
+
+    def get_name(self, project_id: uuid.UUID) -> str | None:
+        """Возвращает имя проекта по UUID, если он есть в кеше и не устарел"""
+        name = self._by_id.get(project_id)
+        if name is None or self.get_id(name) != project_id:
+            return None
+        return name
+
+    def put(self, project_id: uuid.UUID, name: str, version: int) -> None:
+        """Кладет проект в кеш, если с момента чтения version кеш не инвалидировали"""
+        if version != self.version:
+            return
+        self._pop(name)
+        self._by_name[name] = (project_id, time.monotonic() + self.ttl)
+        self._by_id[project_id] = name
+        while len(self._by_name) > self.maxsize:
+            self._pop(next(iter(self._by_name)))
+
+    def invalidate(self) -> None:
+        """Очищает кеш и увеличивает версию"""
+        self.version += 1
+        self._by_name.clear()
+        self._by_id.clear()
+
+    def _pop(self, name: str) -> None:
+        entry = self._by_name.pop(name, None)
+        if entry is not None and self._by_id.get(entry[0]) == name:
+            del self._by_id[entry[0]]
+
+
+cache = ProjectCache(constants.PROJECT_CACHE_SIZE, constants.PROJECT_CACHE_TTL_SECONDS)
+
+
+def invalidate_cache(event: dict | None = None) -> None:
+    """Сбрасывает кеш проектов, в том числе по уведомлению об изменении проекта в другом процессе"""
+    cache.invalidate()
 
 
 async def _fetch_project(session: sa_asyncio.AsyncSession, name: str) -> models.Project | None:
@@ -13,12 +85,69 @@ async def _fetch_project(session: sa_asyncio.AsyncSession, name: str) -> models.
 
 async def get_project(name: str, session: sa_asyncio.AsyncSession) -> schemas.Project:
     """Возвращает проект по имени"""
+    project_id = cache.get_id(name)
+    if project_id is not None:
+        return schemas.Project(id=project_id, name=name)
+    version = cache.version
     project = await _fetch_project(session, name)
     if project is None:
         raise exceptions.BotfarmProjectNotExistsError
+    cache.put(project.id, project.name, version)
     return schemas.Project.model_validate(project)
 
 
+async def get_project_id(name: str, session: sa_asyncio.AsyncSession) -> uuid.UUID:
+    """Возвращает UUID проекта по имени, обращаясь к БД только при промахе кеша"""
+    project_id = cache.get_id(name)
+    if project_id is not None:
+        return project_id
+    version = cache.version
+    project_id = await session.scalar(
+        sa.select(models.Project.id).where(models.Project.name == name)
+    )
+    if project_id is None:
+        raise exceptions.BotfarmProjectNotExistsError
+    cache.put(project_id, name, version)
+    return project_id
+
+
+async def get_project_ids(names: abc.Iterable[str], session: sa_asyncio.AsyncSession) -> dict[str, uuid.UUID]:
+    """Возвращает UUID существующих проектов по именам, запрашивая из БД только промахи кеша"""
+    project_ids: dict[str, uuid.UUID] = {}
+    missing = []
+    for name in set(names):
+        project_id = cache.get_id(name)
+        if project_id is None:
+            missing.append(name)
+        else:
+            project_ids[name] = project_id
+    if missing:
+        version = cache.version
+        result = await session.execute(
+            sa.select(models.Project.id, models.Project.name).where(
+                models.Project.name.in_(missing))
+        )
+        for project_id, name in result.all():
+            cache.put(project_id, name, version)
+            project_ids[name] = project_id
+    return project_ids
+
+
+async def get_project_name(project_id: uuid.UUID, session: sa_asyncio.AsyncSession) -> str:
+    """Возвращает имя проекта по UUID, обращаясь к БД только при промахе кеша"""
+    name = cache.get_name(project_id)
+    if name is not None:
+        return name
+    version = cache.version
+    name = await session.scalar(
+        sa.select(models.Project.name).where(models.Project.id == project_id)
+    )
+    if name is None:
+        raise exceptions.BotfarmProjectNotExistsError
+    cache.put(project_id, name, version)
+    return name
+
+
 async def create_project(request: schemas.ProjectCreate, session: sa_asyncio.AsyncSession) -> schemas.Project:
     """Создает проект, если его еще нет"""
     project = await _fetch_project(session, request.name)
@@ -31,11 +160,30 @@ async def create_project(request: schemas.ProjectCreate, session: sa_asyncio.Asy
     return schemas.Project.model_validate(project)
 
 
-async def get_projects(limit: int, session: sa_asyncio.AsyncSession) -> list[schemas.Project]:
-    """Возвращает список проектов"""
-    result = await session.scalars(sa.select(models.Project).limit(limit))
-    projects = result.all()
-    return [schemas.Project.model_validate(project) for project in projects]
+async def get_projects(
+    limit: int,
+    session: sa_asyncio.AsyncSession,
+    cursor: str | None = None,
+    with_total: bool = False,
+) -> schemas.ProjectPage:
+    """Возвращает страницу проектов, упорядоченных по уникальному имени.
+
+    Следующая страница начинается строго после проекта из cursor. Курсор следующей страницы
+    возвращается, только если текущая заполнена целиком.
+    """
+    total = None
+    if with_total:
+        total = await session.scalar(sa.select(sa.func.count()).select_from(models.Project))
+    statement = sa.select(models.Project)
+    if cursor is not None:
+        name, = utils.decode_cursor(cursor, 1)
+        statement = statement.where(models.Project.name > name)
+    result = await session.scalars(statement.order_by(models.Project.name).limit(limit))
+    projects = schemas.project_list_adapter.validate_python(result.all(), from_attributes=True)
+    next_cursor = None
+    if len(projects) == limit:
+        next_cursor = utils.encode_cursor(projects[-1].name)
+    return schemas.ProjectPage(items=projects, next_cursor=next_cursor, total=total)
 
 
 async def update_project(name: str, request: schemas.ProjectUpdate, session: sa_asyncio.AsyncSession) -> schemas.Project:
@@ -46,6 +194,7 @@ async def update_project(name: str, request: schemas.ProjectUpdate, session: sa_
     if request.name is not None:
         project.name = request.name
     await session.commit()
+    cache.invalidate()
     await session.refresh(project)
     return schemas.Project.model_validate(project)
 
@@ -61,3 +210,4 @@ async def delete_project(name: str, session: sa_asyncio.AsyncSession) -> None:
     )
     await session.delete(project)
     await session.commit()
+    cache.invalidate()
@@ -0,0 +1,117 @@
+import uuid
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
+from sqlalchemy.ext import asyncio as sa_asyncio
+
+from botfarm.components import projects
+from botfarm.entities import models, schemas
+
+
+def _env_condition(env: models.EnvType | None) -> sa.ColumnElement:
+    """Условие на лимит именно этого окружения или лимит всего проекта, если env не указан"""
+    return models.LockQuota.env.is_(None) if env is None else models.LockQuota.env == env
+
+
+def _user_quota_exhausted() -> sa.Exists:
+    """Условие в запросе к users: исчерпан лимит проекта пользователя или его окружения"""
+    return sa.exists().where(
+        models.LockQuota.project_id == models.User.project_id,
+        sa.or_(models.LockQuota.env.is_(None), models.LockQuota.env == models.User.env),
+        models.LockQuota.locked >= models.LockQuota.max_locked,
+    )
+
+
+def has_room() -> sa.ColumnElement:
+    """Условие в запросе к users: пользователя можно заблокировать, не превысив лимиты его проекта"""
+    return ~_user_quota_exhausted()
+
+
+async def get_quotas(project_name: str, session: sa_asyncio.AsyncSession) -> list[schemas.LockQuota]:
+    """Возвращает лимиты проекта вместе с текущим количеством блокировок"""
+    project_id = await projects.get_project_id(project_name, session=session)
+    result = await session.scalars(
+        sa.select(models.LockQuota)
+        .where(models.LockQuota.project_id == project_id)
+        .order_by(models.LockQuota.env.nulls_first())
+    )
+    return [schemas.LockQuota.model_validate(quota) for quota in result.all()]
+
+
+async def set_quota(
+    project_name: str, request: schemas.LockQuotaUpdate, session: sa_asyncio.AsyncSession,
+) -> schemas.LockQuota:
+    """Задает лимит блокировок проекта или его окружения.
+
+    Счетчик нового лимита считается один раз, пока users заблокирована от записи, чтобы
+    не потерять параллельные блокировки. Дальше его ведет триггер, а изменение лимита счетчик не трогает.
+    """
+    project_id = await projects.get_project_id(project_name, session=session)
+    await session.execute(sa.text('LOCK TABLE users IN SHARE MODE'))
+    locked = sa.select(sa.func.count()).where(
+        models.User.project_id == project_id, models.User.locktime.is_not(None))
+    if request.env is not None:
+        locked = locked.where(models.User.env == request.env)
+    statement = pg.insert(models.LockQuota).values(
+        project_id=project_id, env=request.env, max_locked=request.max_locked, locked=locked.scalar_subquery())
+    if request.env is None:
+        statement = statement.on_conflict_do_update(
+            index_elements=[models.LockQuota.project_id],
+            index_where=models.LockQuota.env.is_(None),
+            set_={'max_locked': statement.excluded.max_locked},
+        )
+    else:
+        statement = statement.on_conflict_do_update(
+            index_elements=[models.LockQuota.project_id, models.LockQuota.env],
+            index_where=models.LockQuota.env.is_not(None),
+            set_={'max_locked': statement.excluded.max_locked},
+        )
+    quota = await session.scalar(statement.returning(models.LockQuota))
+    result = schemas.LockQuota.model_validate(quota)
+    await session.commit()
+    return result
+
+
+async def delete_quota(project_name: str, env: models.EnvType | None, session: sa_asyncio.AsyncSession) -> None:
+    """Снимает лимит проекта или его окружения, если он был задан"""
+    project_id = await projects.get_project_id(project_name, session=session)
+    await session.execute(
+        sa.delete(models.LockQuota).where(models.LockQuota.project_id == project_id, _env_condition(env))
+    )
+    await session.commit()
+
+
+async def is_exhausted(
+    project_name: str | None, env: models.EnvType | None, session: sa_asyncio.AsyncSession,
+) -> bool:
+    """Проверяет, исчерпан ли лимит, который мешает блокировке пользователей проекта.
+
+    Вызывается только после неудачной блокировки, чтобы отличить лимит от нехватки свободных.
+    """
+    if project_name is None:
+        return False
+    project_id = await projects.get_project_id(project_name, session=session)
+    return await is_project_exhausted(project_id, env, session=session)
+
+
+async def is_project_exhausted(
+    project_id: uuid.UUID | None, env: models.EnvType | None, session: sa_asyncio.AsyncSession,
+) -> bool:
+    """Проверяет, исчерпан ли лимит всего проекта, а если env указан, то и лимит этого окружения"""
+    if project_id is None:
+        return False
+    condition = models.LockQuota.env.is_(None)
+    if env is not None:
+        condition = sa.or_(condition, models.LockQuota.env == env)
+    return await session.scalar(sa.select(sa.exists().where(
+        models.LockQuota.project_id == project_id,
+        models.LockQuota.locked >= models.LockQuota.max_locked,
+        condition,
+    )))
+
+
+async def is_user_blocked(login: str, session: sa_asyncio.AsyncSession) -> bool:
+    """Проверяет, что свободного пользователя нельзя заблокировать из-за исчерпанного лимита его проекта"""
+    return await session.scalar(sa.select(sa.exists().where(
+        models.User.login == login, models.User.locktime.is_(None), _user_quota_exhausted(),
+    )))
@@ -0,0 +1,139 @@
+import asyncio
+import contextlib
+import json
+import uuid
+from collections import abc
+
+from sqlalchemy.ext import asyncio as sa_asyncio
+
+from botfarm.components import events, projects
+from botfarm.entities import constants, models
+
+# События пользователей, которые отдаются подписчикам потока
+USER_EVENTS = frozenset({'lock', 'release', 'create', 'delete'})
+
+
+class Subscriber:
+    """Клиент потока событий пользователей, который матчится с фильтрами.
+
+    События копятся в ограниченном буфере. Если клиент не успевает их забирать, то новые
+    события отбрасываются, пока буфер не опустеет, после чего клиент получает событие
+    dropped с количеством пропущенных и может перечитать состояние.
+
+    Args:
+        project_id: UUID проекта из фильтра
+        domain: тип пользователя из фильтра
+        env: окружение из фильтра
+        buffer_size: сколько событий может ждать отправки клиенту
+    """
+
+    def __init__(
+        self,
+        project_id: uuid.UUID | None,
+        domain: models.DomainType | None,
+        env: models.EnvType | None,
+        buffer_size: int,
+    ) -> None:
+        self.project_id = project_id
+        self.domain = domain
+        self.env = env
+        self.dropped = 0
+        self._queue: asyncio.Queue[dict] = asyncio.Queue(buffer_size)
+
+    def matches(self, event: dict) -> bool:
+        return event.get('event') in USER_EVENTS and events.matches_user_filters(
+            event, self.project_id, self.domain, self.env)
+
+    def put(self, event: dict) -> None:
+        """Кладет событие в буфер, не блокируя раздачу остальным подписчикам"""
+        if self.dropped:
+            self.dropped += 1
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped = 1
+
+    async def get(self, timeout: float) -> dict | None:
+        """Возвращает следующее событие или None, если за timeout секунд событий не было"""
+        if self._queue.empty() and self.dropped:
+            event = {'event': 'dropped', 'count': self.dropped}
+            self.dropped = 0
+            return event
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Hub:
+    """Раздает события общего LISTEN-подключения подписчикам потоков внутри процесса"""
+
+    def __init__(self) -> None:
+        self._subscribers: set[Subscriber] = set()
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    @contextlib.contextmanager
+    def subscribe(
+        self,
+        project_id: uuid.UUID | None = None,
+        domain: models.DomainType | None = None,
+        env: models.EnvType | None = None,
+        buffer_size: int = constants.EVENTS_BUFFER_SIZE,
+    ) -> abc.Iterator[Subscriber]:
+        """Добавляет подписчика и удаляет его по выходу из контекста"""
+        subscriber = Subscriber(project_id, domain, env, buffer_size)
+        self._subscribers.add(subscriber)
+        try:
+            yield subscriber
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event: dict) -> None:
+        """Передает событие всем подходящим подписчикам"""
+        for subscriber in self._subscribers:
+            if subscriber.matches(event):
+                subscriber.put(event)
+
+
+def format_event(event: dict) -> bytes:
+    """Форматирует событие как сообщение Server-Sent Events"""
+    return f'event: {event["event"]}\ndata: {json.dumps(event)}\n\n'.encode()
+
+
+async def _stream_events(
+    project_id: uuid.UUID | None,
+    domain: models.DomainType | None,
+    env: models.EnvType | None,
+) -> abc.AsyncIterator[bytes]:
+    """Отдает события в формате SSE, а в паузах - комментарии, чтобы прокси не рвали соединение.
+
+    Подписка живет, пока клиент читает поток, и снимается при его отключении.
+    """
+    with hub.subscribe(project_id, domain, env) as subscriber:
+        yield b': connected\n\n'
+        while True:
+            event = await subscriber.get(constants.EVENTS_KEEPALIVE_SECONDS)
+            yield b': keepalive\n\n' if event is None else format_event(event)
+
+
+async def watch_users(
+    session: sa_asyncio.AsyncSession,
+    project_name: str | None = None,
+    domain: models.DomainType | None = None,
+    env: models.EnvType | None = None,
+) -> abc.AsyncIterator[bytes]:
+    """Возвращает поток событий lock, release, create и delete пользователей, которые матчатся с фильтрами.
+
+    Проект проверяется сразу, а соединение с БД отпускается до начала потока.
+    """
+    project_id = None
+    if project_name is not None:
+        project_id = await projects.get_project_id(project_name, session=session)
+        await session.rollback()
+    return _stream_events(project_id, domain, env)
+
+
+hub = Hub()
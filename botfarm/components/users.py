@@ -1,10 +1,22 @@
-from datetime import datetime, timezone
+import asyncio
+import csv
+import io
+import json
+import logging
+import time
+import uuid
+from collections import abc
+from datetime import datetime, timedelta, timezone
 
+import pydantic
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
 from sqlalchemy.ext import asyncio as sa_asyncio
 
-from botfarm.components import projects, utils
-from botfarm.entities import exceptions, models, schemas
+from botfarm.components import db, hashing, locks, metrics, projects, quotas, utils, waiters
+from botfarm.entities import constants, exceptions, models, schemas
+
+logger = logging.getLogger(__name__)
 
 
 async def _fetch_user(session: sa_asyncio.AsyncSession, login: str) -> models.User | None:
@@ -14,23 +26,224 @@ async def _fetch_user(session: sa_asyncio.AsyncSession, login: str) -> models.Us
     )
 
 
+async def _filter_conditions(
+    session: sa_asyncio.AsyncSession,
+    project_name: str | None = None,
+    domain: models.DomainType | None = None,
+    env: models.EnvType | None = None,
+) -> list[sa.ColumnElement]:
+    """Возвращает условия фильтрации пользователей по проекту, домену и окружению.
+
+    Проект резолвится через кеш, поэтому несуществующий проект сразу дает ошибку.
+    """
+    conditions = []
+    if project_name is not None:
+        project_id = await projects.get_project_id(project_name, session=session)
+        conditions.append(models.User.project_id == project_id)
+    if domain is not None:
+        conditions.append(models.User.domain == domain)
+    if env is not None:
+        conditions.append(models.User.env == env)
+    return conditions
+
+
 async def create_user(request: schemas.UserCreate, session: sa_asyncio.AsyncSession) -> schemas.User:
-    """Создает нового пользователя, привязывая к проекту, если он указан"""
-    project_id = None
-    if request.project_name is not None:
-        project = await projects.get_project(request.project_name, session=session)
-        project_id = project.id
-    user = models.User(
-        login=request.login,
-        password=utils.hash_password(request.password),
-        project_id=project_id,
-        env=request.env,
-        domain=request.domain,
+    """Создает нового пользователя, привязывая к проекту, если он указан.
+
+    Пользователь вставляется одним INSERT ... RETURNING, а id и created_at заполняет БД.
+    Проект подставляется через INSERT ... SELECT, поэтому отдельный запрос за ним не нужен.
+    """
+    values = {
+        'login': request.login,
+        'password': await hashing.hash_password(request.password),
+        'env': request.env,
+        'domain': request.domain,
+    }
+    if request.project_name is None:
+        statement = sa.insert(models.User).values(**values)
+    else:
+        columns = models.User.__table__.c
+        statement = sa.insert(models.User).from_select(
+            [*values, 'project_id'],
+            sa.select(
+                *(sa.literal(value, columns[name].type) for name, value in values.items()),
+                models.Project.id,
+            ).where(models.Project.name == request.project_name),
+        )
+    result = await session.execute(statement.returning(*models.User.__table__.c))
+    row = result.one_or_none()
+    if row is None:
+        await session.rollback()
+        raise exceptions.BotfarmProjectNotExistsError
+    user = schemas.User.model_validate(row)
+    await session.commit()
+    return user
+
+
+def _report_import_error(report: schemas.ImportReport, line: int, login: str | None, detail: str) -> None:
+    """Учитывает ошибку строки импорта, сохраняя в отчете не больше IMPORT_MAX_REPORTED_ERRORS ошибок"""
+    report.failed += 1
+    if len(report.errors) < constants.IMPORT_MAX_REPORTED_ERRORS:
+        report.errors.append(schemas.ImportRowError(line=line, login=login, detail=detail))
+
+
+def _describe_import_error(exc: ValueError | csv.Error) -> str:
+    """Возвращает короткое описание ошибки разбора строки импорта"""
+    if isinstance(exc, pydantic.ValidationError):
+        error = exc.errors()[0]
+        location = '.'.join(str(part) for part in error['loc'])
+        return f'{location}: {error["msg"]}' if location else error['msg']
+    return str(exc)
+
+
+async def _import_batch(
+    batch: list[tuple[int, schemas.UserCreate]],
+    session: sa_asyncio.AsyncSession,
+    report: schemas.ImportReport,
+) -> None:
+    """Вставляет пачку пользователей одним INSERT ... ON CONFLICT DO NOTHING и коммитит ее"""
+    project_ids = await projects.get_project_ids(
+        {request.project_name for _, request in batch if request.project_name is not None}, session=session)
+    lines = []
+    rows = []
+    for line, request in batch:
+        project_id = None
+        if request.project_name is not None:
+            project_id = project_ids.get(request.project_name)
+            if project_id is None:
+                _report_import_error(report, line, request.login, str(exceptions.BotfarmProjectNotExistsError()))
+                continue
+        lines.append(line)
+        rows.append({
+            'login': request.login,
+            'password': request.password,
+            'project_id': project_id,
+            'env': request.env,
+            'domain': request.domain,
+        })
+    if not rows:
+        return
+    passwords = await hashing.hash_passwords(row['password'] for row in rows)
+    for row, password in zip(rows, passwords):
+        row['password'] = password
+    result = await session.scalars(
+        pg.insert(models.User)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=[models.User.login])
+        .returning(models.User.login)
     )
-    session.add(user)
+    inserted = set(result.all())
     await session.commit()
-    await session.refresh(user)
-    return schemas.User.model_validate(user)
+    report.created += len(inserted)
+    for line, row in zip(lines, rows):
+        if row['login'] in inserted:
+            inserted.discard(row['login'])
+        else:
+            _report_import_error(report, line, row['login'], str(exceptions.BotfarmUserExistsError()))
+
+
+def _csv_record_complete(record: str) -> bool:
+    """Проверяет, что все поля в кавычках CSV-записи закрыты"""
+    try:
+        next(csv.reader([record], strict=True))
+    except csv.Error as exc:
+        return str(exc) != 'unexpected end of data'
+    return True
+
+
+async def _iter_records(
+    lines: abc.AsyncIterable[str | None],
+    data_format: schemas.DataFormat,
+) -> abc.AsyncIterator[tuple[int, str | None]]:
+    """Собирает из потока строк записи импорта и возвращает их вместе с номером первой строки.
+
+    CSV-запись с переводом строки внутри поля в кавычках продолжается на следующих строках,
+    пока кавычки не закроются. Вместо записи длиннее IMPORT_MAX_LINE_BYTES возвращается None.
+    """
+    record = None
+    record_line = 0
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if record is None:
+            record_line = line_number
+        if line is None:
+            record = None
+            yield record_line, None
+            continue
+        continued = record is not None
+        if not continued:
+            record = line
+        elif len(record) + len(line) >= constants.IMPORT_MAX_LINE_BYTES:
+            record = None
+            yield record_line, None
+            continue
+        else:
+            record = f'{record}\n{line}'
+        if data_format == schemas.DataFormat.csv and ('"' in line or continued):
+            # Строка без кавычек не открывает и не закрывает поле в кавычках,
+            # поэтому начатая запись продолжается без повторного разбора
+            if '"' not in line or not _csv_record_complete(record):
+                continue
+        yield record_line, record
+        record = None
+    if record is not None:
+        yield record_line, record
+
+
+async def import_users(
+    lines: abc.AsyncIterable[str | None],
+    data_format: schemas.DataFormat,
+    session: sa_asyncio.AsyncSession,
+) -> schemas.ImportReport:
+    """Импортирует пользователей из потока строк NDJSON или CSV с заголовком.
+
+    Строки разбираются по мере чтения и вставляются пачками по IMPORT_BATCH_SIZE, каждая пачка
+    коммитится отдельно, поэтому расход памяти не зависит от размера тела запроса. Проекты
+    каждой пачки резолвятся одним запросом. Ошибки отдельных записей попадают в отчет с номером
+    их первой строки и не прерывают импорт.
+    """
+    report = schemas.ImportReport()
+    header = None
+    batch: list[tuple[int, schemas.UserCreate]] = []
+    async for line_number, record in _iter_records(lines, data_format):
+        if record is None:
+            _report_import_error(report, line_number, None, 'Строка слишком длинная')
+            continue
+        if not record.strip():
+            continue
+        row = None
+        try:
+            if data_format == schemas.DataFormat.csv:
+                values = next(csv.reader([record]))
+                if header is None:
+                    header = values
+                    continue
+                row = {key: value for key, value in zip(header, values) if value != ''}
+            else:
+                row = json.loads(record)
+            batch.append((line_number, schemas.UserCreate.model_validate(row)))
+        except (ValueError, csv.Error) as exc:
+            login = row.get('login') if isinstance(row, dict) else None
+            _report_import_error(report, line_number, login, _describe_import_error(exc))
+            continue
+        if len(batch) >= constants.IMPORT_BATCH_SIZE:
+            await _import_batch(batch, session, report)
+            batch = []
+    if batch:
+        await _import_batch(batch, session, report)
+    return report
+
+
+async def _select_users(
+    session: sa_asyncio.AsyncSession,
+    project_name: str | None = None,
+    domain: models.DomainType | None = None,
+    env: models.EnvType | None = None,
+) -> sa.Select:
+    """Возвращает запрос пользователей с фильтрами"""
+    conditions = await _filter_conditions(session, project_name=project_name, domain=domain, env=env)
+    return sa.select(models.User).where(*conditions)
 
 
 async def get_users(
@@ -39,91 +252,422 @@ async def get_users(
     project_name: str | None = None,
     domain: models.DomainType | None = None,
     env: models.EnvType | None = None,
-) -> list[schemas.User]:
-    """Возвращает список пользователей, который матчится с указанными фильтрами"""
-    statement = sa.select(models.User)
-    if project_name is not None:
-        project = await session.scalar(
-            sa.select(models.Project).where(
-                models.Project.name == project_name)
-        )
-        if project is None:
-            raise exceptions.BotfarmProjectNotExistsError
-        statement = statement.where(models.User.project_id == project.id)
-    if domain is not None:
-        statement = statement.where(models.User.domain == domain)
-    if env is not None:
-        statement = statement.where(models.User.env == env)
+    cursor: str | None = None,
+    with_total: bool = False,
+) -> schemas.UserPage:
+    """Возвращает страницу пользователей, которые матчатся с указанными фильтрами.
+
+    Пользователи упорядочены по (created_at, id), следующая страница начинается строго после
+    записи из cursor, поэтому глубокие страницы читаются по индексу за постоянное время.
+    Курсор следующей страницы возвращается, только если текущая заполнена целиком.
+    """
+    statement = await _select_users(session, project_name=project_name, domain=domain, env=env)
+    total = None
+    if with_total:
+        total = await session.scalar(sa.select(sa.func.count()).select_from(statement.subquery()))
+    if cursor is not None:
+        created_at, user_id = utils.decode_cursor(cursor, 2)
+        try:
+            key = (datetime.fromisoformat(created_at), uuid.UUID(user_id))
+        except ValueError:
+            raise exceptions.BotfarmInvalidCursorError
+        statement = statement.where(sa.tuple_(models.User.created_at, models.User.id) > key)
+    statement = statement.order_by(models.User.created_at, models.User.id)
     result = await session.scalars(statement.limit(limit))
-    users = result.all()
-    return [schemas.User.model_validate(user) for user in users]
+    users = schemas.user_list_adapter.validate_python(result.all(), from_attributes=True)
+    next_cursor = None
+    if len(users) == limit:
+        next_cursor = utils.encode_cursor(users[-1].created_at.isoformat(), str(users[-1].id))
+    return schemas.UserPage(items=users, next_cursor=next_cursor, total=total)
+
+
+def _serialize_users(users: abc.Sequence[models.User], data_format: schemas.DataFormat) -> bytes:
+    """Сериализует пачку пользователей в строки NDJSON или CSV без заголовка"""
+    if data_format == schemas.DataFormat.csv:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for user in users:
+            row = schemas.User.model_validate(user).model_dump(mode='json')
+            writer.writerow('' if value is None else value for value in row.values())
+        return buffer.getvalue().encode()
+    return b''.join(
+        schemas.User.model_validate(user).model_dump_json().encode() + b'\n' for user in users
+    )
+
+
+async def _stream_users(statement: sa.Select, data_format: schemas.DataFormat) -> abc.AsyncIterator[bytes]:
+    """Читает пользователей через серверный курсор в собственной сессии для чтения и отдает их пачками"""
+    if data_format == schemas.DataFormat.csv:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(schemas.User.model_fields)
+        yield buffer.getvalue().encode()
+    sessionmaker = await db.get_read_sessionmaker()
+    async with sessionmaker() as session:
+        result = await session.stream_scalars(
+            statement, execution_options={'yield_per': constants.EXPORT_BATCH_SIZE})
+        async for users in result.partitions():
+            yield _serialize_users(users, data_format)
+
+
+async def export_users(
+    data_format: schemas.DataFormat,
+    session: sa_asyncio.AsyncSession,
+    project_name: str | None = None,
+    domain: models.DomainType | None = None,
+    env: models.EnvType | None = None,
+) -> abc.AsyncIterator[bytes]:
+    """Возвращает поток всех пользователей, которые матчатся с фильтрами, в NDJSON или CSV.
+
+    Фильтры проверяются сразу, а строки читаются серверным курсором по EXPORT_BATCH_SIZE
+    уже во время отправки ответа, поэтому память не зависит от размера таблицы. Сессия запроса
+    живет до конца потока, поэтому ее соединение отпускается до его начала.
+    """
+    statement = await _select_users(session, project_name=project_name, domain=domain, env=env)
+    await session.rollback()
+    return _stream_users(statement.order_by(models.User.created_at, models.User.id), data_format)
+
+
+class StatsCache:
+    """Кеш последней сводки по пользователям с коротким временем жизни.
+
+    Одновременные промахи не выполняют запрос каждый сам по себе, а ждут одну общую загрузку.
+
+    Args:
+        ttl: время жизни сводки в секундах
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._stats: schemas.UserStats | None = None
+        self._expires_at = 0.0
+        self._loading: asyncio.Task | None = None
+
+    async def get(self, load: abc.Callable[[], abc.Awaitable[schemas.UserStats]]) -> schemas.UserStats:
+        """Возвращает сводку из кеша, а при ее устаревании загружает ее через load"""
+        if self._stats is not None and time.monotonic() < self._expires_at:
+            return self._stats
+        if self._loading is None:
+            self._loading = asyncio.create_task(self._load(load))
+        # shield: отмена одного из ожидающих запросов не должна прерывать общую загрузку
+        return await asyncio.shield(self._loading)
+
+    def invalidate(self) -> None:
+        """Сбрасывает сохраненную сводку"""
+        self._stats = None
+
+    async def _load(self, load: abc.Callable[[], abc.Awaitable[schemas.UserStats]]) -> schemas.UserStats:
+        try:
+            stats = await load()
+            self._stats = stats
+            self._expires_at = time.monotonic() + self.ttl
+            return stats
+        finally:
+            self._loading = None
+
+
+stats_cache = StatsCache(constants.USER_STATS_CACHE_TTL_SECONDS)
+
+
+async def _load_user_stats() -> schemas.UserStats:
+    """Считает свободных и заблокированных пользователей по группам одним GROUP BY в сессии для чтения"""
+    counts = (
+        sa.select(
+            models.User.project_id,
+            models.User.env,
+            models.User.domain,
+            sa.func.count().filter(models.User.locktime.is_(None)).label('free'),
+            sa.func.count().filter(models.User.locktime.is_not(None)).label('locked'),
+        )
+        .group_by(models.User.project_id, models.User.env, models.User.domain)
+        .subquery()
+    )
+    statement = (
+        sa.select(models.Project.name, counts.c.env, counts.c.domain, counts.c.free, counts.c.locked)
+        .select_from(counts)
+        .outerjoin(models.Project, models.Project.id == counts.c.project_id)
+        .order_by(models.Project.name.nulls_first(), counts.c.env, counts.c.domain)
+    )
+    sessionmaker = await db.get_read_sessionmaker()
+    async with sessionmaker() as session:
+        result = await session.execute(statement)
+        groups = [
+            schemas.UserStatsGroup(project_name=name, env=env, domain=domain, free=free, locked=locked)
+            for name, env, domain, free, locked in result.all()
+        ]
+    return schemas.UserStats(
+        free=sum(group.free for group in groups),
+        locked=sum(group.locked for group in groups),
+        groups=groups,
+        generated_at=datetime.now(timezone.utc),
+    )
+
+
+async def get_user_stats() -> schemas.UserStats:
+    """Возвращает количество свободных и заблокированных пользователей по проектам, окружениям и доменам.
 
+    Сводка кешируется на USER_STATS_CACHE_TTL_SECONDS, поэтому может отставать на это время.
+    """
+    return await stats_cache.get(_load_user_stats)
 
-async def get_user(login: str, session: sa_asyncio.AsyncSession, lock: bool = False) -> schemas.User:
-    """Возвращает пользователя по логину и блокирует его, если lock равен True"""
+
+async def get_user(
+    login: str,
+    session: sa_asyncio.AsyncSession,
+    lock: bool = False,
+    lease: int = constants.LOCK_LEASE_SECONDS,
+    owner: str | None = None,
+) -> schemas.User:
+    """Возвращает пользователя по логину и блокирует его на lease секунд, если lock равен True"""
     if lock:
-        return await acquire_lock(login, session=session)
+        return await acquire_lock(login, session=session, lease=lease, owner=owner)
     user = await _fetch_user(session, login)
     if user is None:
         raise exceptions.BotfarmUserNotExistsError
-    if user.locktime is not None:
+    if await locks.get_backend().is_locked(user, session):
         raise exceptions.BotfarmUserLockedError
     return schemas.User.model_validate(user)
 
 
-async def acquire_lock(login: str, session: sa_asyncio.AsyncSession) -> schemas.User:
-    """Ставит блокировку на пользователя"""
-    user = await _fetch_user(session, login)
-    if user is None:
-        raise exceptions.BotfarmUserNotExistsError
-    if user.locktime is not None:
-        raise exceptions.BotfarmUserLockedError
-    user.locktime = datetime.now(timezone.utc)
-    await session.commit()
-    await session.refresh(user)
-    return schemas.User.model_validate(user)
+async def acquire_lock(
+    login: str,
+    session: sa_asyncio.AsyncSession,
+    lease: int = constants.LOCK_LEASE_SECONDS,
+    owner: str | None = None,
+) -> schemas.LockedUser:
+    """Ставит блокировку владельца owner на пользователя с арендой на lease секунд"""
+    try:
+        locked = await locks.get_backend().acquire(login, session, lease, owner)
+    except exceptions.BotfarmUserNotExistsError:
+        metrics.LOCK_ACQUIRES.inc(result='missing')
+        raise
+    except exceptions.BotfarmUserLockedError:
+        if await quotas.is_user_blocked(login, session):
+            metrics.LOCK_ACQUIRES.inc(result='quota')
+            raise exceptions.BotfarmLockQuotaExceededError
+        metrics.LOCK_ACQUIRES.inc(result='conflict')
+        raise
+    metrics.LOCK_ACQUIRES.inc(result='acquired')
+    return locked
+
+
+async def checkout_users(
+    count: int,
+    session: sa_asyncio.AsyncSession,
+    project_name: str | None = None,
+    domain: models.DomainType | None = None,
+    env: models.EnvType | None = None,
+    all_or_nothing: bool = False,
+    lease: int = constants.LOCK_LEASE_SECONDS,
+    owner: str | None = None,
+) -> list[schemas.LockedUser]:
+    """Блокирует до count свободных пользователей, которые матчатся с указанными фильтрами.
+
+    Параллельные вызовы получают разных пользователей без повторных попыток.
+    Если all_or_nothing равен True, то при нехватке свободных пользователей
+    не блокируется никто. Аренда блокировки длится lease секунд,
+    каждый пользователь получает свой токен аренды. Пользователи сверх лимита
+    блокировок проекта не блокируются.
+    """
+    conditions = await _filter_conditions(session, project_name=project_name, domain=domain, env=env)
+    candidates = sa.select(models.User.id).where(*conditions)
+    try:
+        locked = await locks.get_backend().checkout(candidates, count, session, all_or_nothing, lease, owner)
+    except exceptions.BotfarmNotEnoughFreeUsersError:
+        metrics.LOCK_ACQUIRES.inc(result='conflict')
+        raise
+    except exceptions.BotfarmNoFreeUsersError:
+        if await quotas.is_exhausted(project_name, env, session):
+            metrics.LOCK_ACQUIRES.inc(result='quota')
+            raise exceptions.BotfarmLockQuotaExceededError
+        metrics.LOCK_ACQUIRES.inc(result='conflict')
+        raise
+    metrics.LOCK_ACQUIRES.inc(len(locked), result='acquired')
+    return locked
+
+
+async def checkout_user(
+    session: sa_asyncio.AsyncSession,
+    project_name: str | None = None,
+    domain: models.DomainType | None = None,
+    env: models.EnvType | None = None,
+    lease: int = constants.LOCK_LEASE_SECONDS,
+    wait: float = 0,
+    owner: str | None = None,
+) -> schemas.LockedUser:
+    """Блокирует любого свободного пользователя, который матчится с указанными фильтрами.
+
+    Если свободных нет, то ждет до wait секунд в FIFO-очереди процесса. Ожидающих будят
+    уведомления об освобождении пользователей, а редкий опрос страхует от потерянных событий.
+    """
+    if wait <= 0:
+        locked = await checkout_users(
+            1, session, project_name=project_name, domain=domain, env=env, lease=lease, owner=owner)
+        return locked[0]
+
+    project_id = None
+    if project_name is not None:
+        project_id = await projects.get_project_id(project_name, session=session)
+        # Отпускаем соединение, чтобы не держать его на время ожидания
+        await session.rollback()
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    with waiters.queue.enqueue(project_id, domain, env) as waiter:
+        should_try = not waiters.queue.has_queued_before(waiter)
+        while True:
+            if should_try:
+                try:
+                    locked = await checkout_users(
+                        1, session, project_name=project_name, domain=domain, env=env, lease=lease, owner=owner)
+                    return locked[0]
+                except exceptions.BotfarmNoFreeUsersError:
+                    pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise exceptions.BotfarmNoFreeUsersError
+            await waiter.wait(min(remaining, constants.CHECKOUT_WAIT_POLL_SECONDS))
+            should_try = True
 
 
 async def release_lock(login: str, session: sa_asyncio.AsyncSession) -> schemas.User:
     """Снимает блокировку с пользователя"""
+    released = await locks.get_backend().release(login, session)
+    metrics.LOCK_RELEASES.inc(reason='login')
+    return released
+
+
+async def extend_lock(
+    login: str,
+    session: sa_asyncio.AsyncSession,
+    lease: int = constants.LOCK_LEASE_SECONDS,
+    token: uuid.UUID | None = None,
+) -> schemas.User:
+    """Продлевает аренду блокировки пользователя на lease секунд от текущего момента.
+
+    Если передан token, то продлевается только блокировка с этим токеном аренды.
+    """
+    return await locks.get_backend().extend(login, session, lease, token)
+
+
+async def release_lock_by_token(token: uuid.UUID, session: sa_asyncio.AsyncSession) -> schemas.User:
+    """Снимает блокировку, выданную с указанным токеном аренды"""
+    released = await locks.get_backend().release_by_token(token, session)
+    metrics.LOCK_RELEASES.inc(reason='token')
+    return released
+
+
+async def release_owner_locks(owner: str, session: sa_asyncio.AsyncSession) -> int:
+    """Снимает все блокировки владельца и возвращает их количество"""
+    released = await locks.get_backend().release_owner(owner, session)
+    metrics.LOCK_RELEASES.inc(released, reason='owner')
+    return released
+
+
+async def release_expired_locks(session: sa_asyncio.AsyncSession) -> int:
+    """Снимает все блокировки с истекшей арендой и возвращает их количество"""
+    released = await locks.get_backend().release_expired(session)
+    metrics.LOCK_RELEASES.inc(released, reason='expired')
+    return released
+
+
+async def run_lock_reaper(interval: float) -> None:
+    """Раз в interval секунд снимает блокировки с истекшей арендой, пока задачу не отменят"""
+    while True:
+        try:
+            async with db.get_sessionmaker()() as session:
+                released = await release_expired_locks(session)
+            if released:
+                logger.info('Сняты блокировки с истекшей арендой: %d', released)
+        except Exception:
+            logger.exception('Не удалось снять блокировки с истекшей арендой')
+        await asyncio.sleep(interval)
+
+
+async def verify_password(login: str, password: str, session: sa_asyncio.AsyncSession) -> schemas.User:
+    """Проверяет пароль пользователя и возвращает пользователя.
+
+    Хеш старого формата или с устаревшими параметрами после успешной проверки пересчитывается
+    текущим алгоритмом. Новый хеш записывается, только если пароль за это время не сменили.
+    """
     user = await _fetch_user(session, login)
     if user is None:
         raise exceptions.BotfarmUserNotExistsError
-    user.locktime = None
-    await session.commit()
-    await session.refresh(user)
-    return schemas.User.model_validate(user)
+    encoded = user.password
+    if not await hashing.verify_password(password, encoded):
+        raise exceptions.BotfarmInvalidPasswordError
+    result = schemas.User.model_validate(user)
+    if hashing.needs_rehash(encoded):
+        await session.execute(
+            sa.update(models.User)
+            .where(models.User.id == user.id, models.User.password == encoded)
+            .values(password=await hashing.hash_password(password))
+        )
+        await session.commit()
+    return result
 
 
 async def update_user(login: str, request: schemas.UserUpdate, session: sa_asyncio.AsyncSession) -> schemas.User:
-    """Обновляет данные пользователя"""
-    user = await _fetch_user(session, login)
-    if user is None:
-        raise exceptions.BotfarmUserNotExistsError
+    """Обновляет данные пользователя одним UPDATE ... RETURNING.
 
-    if request.project_name is not None:
-        if request.project_name == '':
-            user.project_id = None
-        else:
-            project = await session.scalar(
-                sa.select(models.Project).where(
-                    models.Project.name == request.project_name)
-            )
-            if project is None:
-                raise exceptions.BotfarmProjectNotExistsError
-            user.project_id = project.id
+    Новый проект подставляется подзапросом. Если его нет, то строка не обновляется,
+    а причина выясняется дополнительным запросом только в этом случае. Вместе с locktime
+    ставится аренда по умолчанию, чтобы такую блокировку снял сборщик просроченных.
+    """
+    values = {}
+    conditions = [models.User.login == login]
+    if request.project_name == '':
+        values['project_id'] = None
+    elif request.project_name is not None:
+        project_id = sa.select(models.Project.id).where(
+            models.Project.name == request.project_name).scalar_subquery()
+        values['project_id'] = project_id
+        conditions.append(project_id.is_not(None))
     if request.password is not None:
-        user.password = utils.hash_password(request.password)
+        values['password'] = await hashing.hash_password(request.password)
     if request.env is not None:
-        user.env = request.env
+        values['env'] = request.env
     if request.domain is not None:
-        user.domain = request.domain
+        values['domain'] = request.domain
     if request.locktime is not None:
-        user.locktime = request.locktime
+        values['locktime'] = request.locktime
+        values['lease_expires_at'] = request.locktime + timedelta(seconds=constants.LOCK_LEASE_SECONDS)
+    if not values:
+        user = await _fetch_user(session, login)
+        if user is None:
+            raise exceptions.BotfarmUserNotExistsError
+        return schemas.User.model_validate(user)
 
+    result = await session.execute(
+        sa.update(models.User)
+        .where(*conditions)
+        .values(**values)
+        .returning(*models.User.__table__.c)
+    )
+    row = result.one_or_none()
+    if row is None:
+        await session.rollback()
+        await _raise_update_error(login, request, session)
+    user = schemas.User.model_validate(row)
     await session.commit()
-    await session.refresh(user)
-    return schemas.User.model_validate(user)
+    return user
+
+
+async def _raise_update_error(login: str, request: schemas.UserUpdate, session: sa_asyncio.AsyncSession) -> None:
+    """Выясняет, почему UPDATE пользователя не вернул строку: его нет, нет нового проекта
+    или триггер лимитов пропустил блокировку свободного пользователя
+    """
+    user = await _fetch_user(session, login)
+    if user is None:
+        raise exceptions.BotfarmUserNotExistsError
+    if request.locktime is not None and user.locktime is None:
+        project_id = user.project_id
+        if request.project_name == '':
+            project_id = None
+        elif request.project_name is not None:
+            project_id = await projects.get_project_id(request.project_name, session=session)
+        if await quotas.is_project_exhausted(project_id, request.env or user.env, session=session):
+            raise exceptions.BotfarmLockQuotaExceededError
+    raise exceptions.BotfarmProjectNotExistsError
 
 
 async def delete_user(login: str, session: sa_asyncio.AsyncSession) -> None:
@@ -133,3 +677,84 @@ async def delete_user(login: str, session: sa_asyncio.AsyncSession) -> None:
         raise exceptions.BotfarmUserNotExistsError
     await session.delete(user)
     await session.commit()
+
+
+async def _selector_conditions(
+    selector: schemas.UserSelector, session: sa_asyncio.AsyncSession,
+) -> list[sa.ColumnElement]:
+    """Возвращает условия выборки пользователей для массовых изменений"""
+    conditions = await _filter_conditions(
+        session, project_name=selector.project_name, domain=selector.domain, env=selector.env)
+    if selector.logins is not None:
+        conditions.append(models.User.login.in_(selector.logins))
+    if selector.locked is not None:
+        conditions.append(models.User.locktime.is_not(None) if selector.locked else models.User.locktime.is_(None))
+    return conditions
+
+
+async def _apply_in_batches(
+    statement: sa.Update | sa.Delete,
+    conditions: list[sa.ColumnElement],
+    session: sa_asyncio.AsyncSession,
+    count_skipped: bool = False,
+) -> schemas.UsersAffected:
+    """Применяет UPDATE или DELETE к выбранным пользователям пачками по BULK_BATCH_SIZE.
+
+    Пачки идут по возрастанию id, и каждая коммитится отдельно, поэтому строки не остаются
+    заблокированными до конца всей операции. Условия повторяются в самом изменении, чтобы не
+    задеть строки, которые успели измениться после выборки пачки. Если изменение блокирует
+    пользователей, то свободные, которые остались свободными, пропущены триггером лимитов.
+    """
+    statement = statement.execution_options(synchronize_session=False)
+    report = schemas.UsersAffected(affected=0)
+    last_id = None
+    while True:
+        batch = sa.select(models.User.id).where(*conditions).order_by(models.User.id).limit(constants.BULK_BATCH_SIZE)
+        if last_id is not None:
+            batch = batch.where(models.User.id > last_id)
+        ids = (await session.scalars(batch)).all()
+        if not ids:
+            return report
+        result = await session.execute(statement.where(models.User.id.in_(ids), *conditions))
+        report.affected += result.rowcount
+        if count_skipped:
+            report.skipped += await session.scalar(sa.select(sa.func.count()).where(
+                models.User.id.in_(ids), *conditions, models.User.locktime.is_(None)))
+        await session.commit()
+        if len(ids) < constants.BULK_BATCH_SIZE:
+            return report
+        last_id = ids[-1]
+
+
+async def update_users(request: schemas.UserBulkUpdate, session: sa_asyncio.AsyncSession) -> schemas.UsersAffected:
+    """Применяет одни и те же изменения ко всем выбранным пользователям и возвращает их количество.
+
+    Новый проект резолвится и пароль хешируется один раз, а строки обновляются пачками.
+    Пользователи, блокировку которых не пропустил лимит проекта, считаются в skipped.
+    """
+    changes = request.changes
+    values = {}
+    if changes.project_name == '':
+        values['project_id'] = None
+    elif changes.project_name is not None:
+        values['project_id'] = await projects.get_project_id(changes.project_name, session=session)
+    if changes.password is not None:
+        values['password'] = await hashing.hash_password(changes.password)
+    if changes.env is not None:
+        values['env'] = changes.env
+    if changes.domain is not None:
+        values['domain'] = changes.domain
+    if changes.locktime is not None:
+        values['locktime'] = changes.locktime
+        values['lease_expires_at'] = changes.locktime + timedelta(seconds=constants.LOCK_LEASE_SECONDS)
+    conditions = await _selector_conditions(request.selector, session=session)
+    if not values:
+        return schemas.UsersAffected(affected=0)
+    return await _apply_in_batches(
+        sa.update(models.User).values(**values), conditions, session=session, count_skipped='locktime' in values)
+
+
+async def delete_users(selector: schemas.UserSelector, session: sa_asyncio.AsyncSession) -> schemas.UsersAffected:
+    """Удаляет выбранных пользователей пачками и возвращает их количество"""
+    conditions = await _selector_conditions(selector, session=session)
+    return await _apply_in_batches(sa.delete(models.User), conditions, session=session)
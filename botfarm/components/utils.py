@@ -1,5 +1,13 @@
+import base64
+import binascii
+import functools
 import hashlib
+import json
+import os
 import pathlib
+from collections import abc
+
+from botfarm.entities import constants, exceptions
 
 
 def load_env(path: pathlib.Path) -> dict[str, str]:
@@ -20,6 +28,62 @@ def load_env(path: pathlib.Path) -> dict[str, str]:
     return env
 
 
+@functools.cache
+def get_settings() -> dict[str, str]:
+    """Один раз загружает настройки приложения: файл настроек, поверх него переменные окружения.
+
+    Путь к файлу можно переопределить переменной окружения, при ее отсутствии файл необязателен.
+    """
+    path = pathlib.Path(os.environ.get(constants.SETTINGS_FILE_ENV, constants.SETTINGS_FILE))
+    env = load_env(path) if path.exists() else {}
+    return env | dict(os.environ)
+
+
 def hash_password(password: str) -> str:
     """Возвращает SHA-256 хеш переданного пароля в шестнадцатеричном виде"""
     return hashlib.sha256(password.encode()).hexdigest()
+
+
+def encode_cursor(*values: str) -> str:
+    """Упаковывает значения ключа последней записи страницы в непрозрачный курсор"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, size: int) -> list[str]:
+    """Распаковывает курсор, проверяя, что в нем ровно size строковых значений"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise exceptions.BotfarmInvalidCursorError
+    if not isinstance(values, list) or len(values) != size or not all(isinstance(value, str) for value in values):
+        raise exceptions.BotfarmInvalidCursorError
+    return values
+
+
+async def iter_lines(chunks: abc.AsyncIterable[bytes], max_length: int) -> abc.AsyncIterator[str | None]:
+    """Собирает строки из потока байтов, не держа в памяти больше одной строки.
+
+    Вместо строки длиннее max_length байт возвращает None, а ее содержимое пропускает.
+    """
+    buffer = bytearray()
+    overflow = False
+    async for chunk in chunks:
+        buffer.extend(chunk)
+        while True:
+            end = buffer.find(b'\n')
+            if end == -1:
+                break
+            line = bytes(buffer[:end])
+            del buffer[:end + 1]
+            if overflow or len(line) > max_length:
+                overflow = False
+                yield None
+            else:
+                yield line.rstrip(b'\r').decode(errors='replace')
+        if len(buffer) > max_length:
+            overflow = True
+            buffer.clear()
+    if overflow or len(buffer) > max_length:
+        yield None
+    elif buffer:
+        yield bytes(buffer).rstrip(b'\r').decode(errors='replace')
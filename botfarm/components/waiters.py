@@ -0,0 +1,124 @@
+import asyncio
+import contextlib
+import uuid
+from collections import abc, deque
+
+from botfarm.components import events
+from botfarm.entities import models
+
+# События, после которых в пуле может появиться свободный пользователь
+FREEING_EVENTS = frozenset({'release', 'create'})
+
+
+class Waiter:
+    """Запрос, ожидающий освобождения пользователя, который матчится с фильтрами.
+
+    Args:
+        project_id: UUID проекта из фильтра
+        domain: тип пользователя из фильтра
+        env: окружение из фильтра
+    """
+
+    def __init__(
+        self,
+        project_id: uuid.UUID | None,
+        domain: models.DomainType | None,
+        env: models.EnvType | None,
+    ) -> None:
+        self.project_id = project_id
+        self.domain = domain
+        self.env = env
+        self._wakeup = asyncio.get_running_loop().create_future()
+
+    @property
+    def filters(self) -> tuple:
+        return self.project_id, self.domain, self.env
+
+    @property
+    def woken(self) -> bool:
+        return self._wakeup.done()
+
+    @property
+    def pending_event(self) -> dict | None:
+        return self._wakeup.result() if self._wakeup.done() else None
+
+    def matches(self, event: dict) -> bool:
+        """Проверяет, подходит ли освободившийся пользователь под фильтры ожидающего"""
+        return events.matches_user_filters(event, self.project_id, self.domain, self.env)
+
+    def wake(self, event: dict) -> None:
+        if not self._wakeup.done():
+            self._wakeup.set_result(event)
+
+    async def wait(self, timeout: float) -> None:
+        """Ждет пробуждения не дольше timeout секунд и готовится к следующему ожиданию"""
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(asyncio.shield(self._wakeup), timeout)
+        if self._wakeup.done():
+            self._wakeup = asyncio.get_running_loop().create_future()
+
+
+class WaitQueue:
+    """Очередь запросов, ожидающих освобождения пользователей.
+
+    Освободившийся пользователь достается по кругу между группами запросов с одинаковыми
+    фильтрами (проект, домен, окружение): из подходящих ожидающих выбирается группа, которая
+    получала пользователя дольше всех назад, а внутри группы - самый ранний запрос. Поэтому
+    проект с множеством ожидающих не забирает всех освобождающихся пользователей у остальных.
+    Ожидающий остается на своем месте в очереди, пока не получит пользователя или не истечет
+    его таймаут.
+    """
+
+    def __init__(self) -> None:
+        self._waiters: deque[Waiter] = deque()
+        # Номер последней выдачи по фильтрам ожидающего
+        self._served: dict[tuple, int] = {}
+        self._grants = 0
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    @contextlib.contextmanager
+    def enqueue(
+        self,
+        project_id: uuid.UUID | None = None,
+        domain: models.DomainType | None = None,
+        env: models.EnvType | None = None,
+    ) -> abc.Iterator[Waiter]:
+        """Ставит ожидающего в конец очереди и убирает его оттуда по выходу из контекста"""
+        waiter = Waiter(project_id, domain, env)
+        self._waiters.append(waiter)
+        try:
+            yield waiter
+        finally:
+            self._waiters.remove(waiter)
+            if waiter.woken:
+                # Пробуждение не было использовано, передаем событие следующему
+                self.notify(waiter.pending_event)
+
+    def has_queued_before(self, waiter: Waiter) -> bool:
+        """Проверяет, есть ли в очереди перед waiter ожидающий с теми же фильтрами"""
+        for queued in self._waiters:
+            if queued is waiter:
+                return False
+            if queued.filters == waiter.filters:
+                return True
+        return False
+
+    def notify(self, event: dict) -> None:
+        """Будит ожидающего, которому подходит освободившийся пользователь, по кругу между группами"""
+        if event.get('event') not in FREEING_EVENTS:
+            return
+        chosen = None
+        for waiter in self._waiters:
+            if waiter.woken or not waiter.matches(event):
+                continue
+            if chosen is None or self._served.get(waiter.filters, -1) < self._served.get(chosen.filters, -1):
+                chosen = waiter
+        if chosen is not None:
+            self._grants += 1
+            self._served[chosen.filters] = self._grants
+            chosen.wake(event)
+
+
+queue = WaitQueue()
@@ -1 +1,21 @@
 SETTINGS_FILE = 'settings.env'
+SETTINGS_FILE_ENV = 'BOTFARM_SETTINGS_FILE'
+
+LOCK_LEASE_SECONDS = 600
+LOCK_LEASE_MAX_SECONDS = 24 * 60 * 60
+LOCK_REAPER_INTERVAL_SECONDS = 30
+LOCK_CHECKOUT_BATCH_SIZE = 100
+LOCK_CHECKOUT_MAX_COUNT = 1000
+LOCK_CHECKOUT_QUOTA_RETRIES = 3
+CHECKOUT_MAX_WAIT_SECONDS = 300
+CHECKOUT_WAIT_POLL_SECONDS = 5
+PROJECT_CACHE_SIZE = 1024
+PROJECT_CACHE_TTL_SECONDS = 60
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_LINE_BYTES = 64 * 1024
+IMPORT_MAX_REPORTED_ERRORS = 1000
+EXPORT_BATCH_SIZE = 1000
+BULK_BATCH_SIZE = 1000
+USER_STATS_CACHE_TTL_SECONDS = 5
+EVENTS_BUFFER_SIZE = 1000
+EVENTS_KEEPALIVE_SECONDS = 15
@@ -1,10 +1,10 @@
 import enum
+import functools
 import pathlib
 
 import pydantic
 
 from botfarm.components import utils
-from botfarm.entities import constants
 
 
 class DBCredentialsEnvFields(enum.Enum):
@@ -31,20 +31,106 @@ class DBDefaultCredentialsEnvFields(enum.Enum):
         return cls.name_.name[:-1]
 
 
+class DBReplicaCredentialsEnvFields(enum.Enum):
+    user = 'DB_REPLICA_USER'
+    password = 'DB_REPLICA_PASSWORD'
+    host = 'DB_REPLICA_HOST'
+    port = 'DB_REPLICA_PORT'
+    name_ = 'DB_REPLICA_NAME'
+
+    @classmethod
+    def get_name_field(cls) -> str:
+        return cls.name_.name[:-1]
+
+
+class DBReplicaEnvFields(enum.Enum):
+    max_lag_seconds = 'DB_REPLICA_MAX_LAG_SECONDS'
+    lag_check_interval_seconds = 'DB_REPLICA_LAG_CHECK_INTERVAL_SECONDS'
+
+
+CredentialsEnvFields = DBCredentialsEnvFields | DBDefaultCredentialsEnvFields | DBReplicaCredentialsEnvFields
+
+
+class DBPoolEnvFields(enum.Enum):
+    pool_size = 'DB_POOL_SIZE'
+    max_overflow = 'DB_POOL_MAX_OVERFLOW'
+    pool_timeout = 'DB_POOL_TIMEOUT'
+    pool_recycle = 'DB_POOL_RECYCLE'
+    pool_pre_ping = 'DB_POOL_PRE_PING'
+    statement_cache_size = 'DB_STATEMENT_CACHE_SIZE'
+    statement_timeout_ms = 'DB_STATEMENT_TIMEOUT_MS'
+    lock_timeout_ms = 'DB_LOCK_TIMEOUT_MS'
+
+
 class DBCredentials(pydantic.BaseModel):
+    """Параметры подключения к БД и настройки пула соединений.
+
+    Args:
+        pool_size: количество постоянно открытых соединений
+        max_overflow: сколько соединений можно открыть сверх pool_size под нагрузкой
+        pool_timeout: сколько секунд ждать свободное соединение из пула
+        pool_recycle: через сколько секунд переоткрывать соединение, -1 - никогда
+        pool_pre_ping: проверять соединение перед выдачей из пула
+        statement_cache_size: размер кеша prepared statements на соединение, 0 - отключен
+        statement_timeout_ms: statement_timeout сессии в миллисекундах, None - по умолчанию сервера
+        lock_timeout_ms: lock_timeout сессии в миллисекундах, None - по умолчанию сервера
+    """
     user: str
     password: str
     host: str
     port: str
     name: str
+    pool_size: int = pydantic.Field(default=5, ge=1)
+    max_overflow: int = pydantic.Field(default=10, ge=0)
+    pool_timeout: float = pydantic.Field(default=30, gt=0)
+    pool_recycle: int = -1
+    pool_pre_ping: bool = False
+    statement_cache_size: int = pydantic.Field(default=100, ge=0)
+    statement_timeout_ms: int | None = pydantic.Field(default=None, ge=0)
+    lock_timeout_ms: int | None = pydantic.Field(default=None, ge=0)
 
     @property
     def url(self) -> str:
         return f'postgresql+asyncpg://{self.user}:{self.password}@{self.host}:{self.port}/{self.name}'
 
+    @property
+    def engine_options(self) -> dict:
+        """Аргументы create_async_engine: настройки пула и параметры подключения asyncpg.
+
+        Диалект asyncpg в SQLAlchemy сам готовит запросы и держит их в своем кеше, поэтому размер
+        кеша передается и ему, и asyncpg. Иначе его нельзя отключить, например, за pgbouncer.
+        """
+        server_settings = {}
+        if self.statement_timeout_ms is not None:
+            server_settings['statement_timeout'] = str(self.statement_timeout_ms)
+        if self.lock_timeout_ms is not None:
+            server_settings['lock_timeout'] = str(self.lock_timeout_ms)
+        connect_args = {
+            'statement_cache_size': self.statement_cache_size,
+            'prepared_statement_cache_size': self.statement_cache_size,
+        }
+        if server_settings:
+            connect_args['server_settings'] = server_settings
+        return {
+            'pool_size': self.pool_size,
+            'max_overflow': self.max_overflow,
+            'pool_timeout': self.pool_timeout,
+            'pool_recycle': self.pool_recycle,
+            'pool_pre_ping': self.pool_pre_ping,
+            'connect_args': connect_args,
+        }
+
+    @classmethod
+    def from_env_file(cls, env_path: pathlib.Path, fields: type[CredentialsEnvFields]) -> 'DBCredentials':
+        return cls.from_env(utils.load_env(env_path), fields, source=str(env_path))
+
     @classmethod
-    def from_env_file(cls, env_path: pathlib.Path, fields: DBCredentialsEnvFields | DBDefaultCredentialsEnvFields) -> 'DBCredentials':
-        env_vars = utils.load_env(env_path)
+    def from_env(
+        cls,
+        env_vars: dict[str, str],
+        fields: type[CredentialsEnvFields],
+        source: str = 'настройках',
+    ) -> 'DBCredentials':
         try:
             return cls(
                 user=env_vars[fields.user.value],
@@ -52,13 +138,57 @@ class DBCredentials(pydantic.BaseModel):
                 host=env_vars[fields.host.value],
                 port=env_vars[fields.port.value],
                 name=env_vars[fields.name_.value],
+                **{
+                    field.name: env_vars[field.value]
+                    for field in DBPoolEnvFields
+                    if field.value in env_vars
+                },
             )
         except KeyError as exc:
             missing = exc.args[0]
-            raise KeyError(f'Отсутствует ключ {missing} в {env_path}')
+            raise KeyError(f'Отсутствует ключ {missing} в {source}')
+
+
+@functools.cache
+def get_db_credentials() -> DBCredentials:
+    """Лениво читает параметры подключения к основной БД"""
+    return DBCredentials.from_env(utils.get_settings(), DBCredentialsEnvFields)
+
+
+@functools.cache
+def get_db_default_credentials() -> DBCredentials:
+    """Лениво читает параметры подключения к дефолтной БД, нужны только для ее создания"""
+    return DBCredentials.from_env(utils.get_settings(), DBDefaultCredentialsEnvFields)
+
+
+class DBReplicaSettings(pydantic.BaseModel):
+    """Настройки реплики для чтения.
+
+    Args:
+        credentials: параметры подключения к реплике
+        max_lag_seconds: при большем отставании реплики чтение уходит на основную БД
+        lag_check_interval_seconds: как часто перепроверять отставание реплики
+    """
+    credentials: DBCredentials
+    max_lag_seconds: float = pydantic.Field(default=5, ge=0)
+    lag_check_interval_seconds: float = pydantic.Field(default=1, gt=0)
+
+    @classmethod
+    def from_env(cls, env_vars: dict[str, str]) -> 'DBReplicaSettings | None':
+        """Возвращает настройки реплики или None, если реплика не указана"""
+        if DBReplicaCredentialsEnvFields.host.value not in env_vars:
+            return None
+        return cls(
+            credentials=DBCredentials.from_env(env_vars, DBReplicaCredentialsEnvFields),
+            **{
+                field.name: env_vars[field.value]
+                for field in DBReplicaEnvFields
+                if field.value in env_vars
+            },
+        )
 
 
-db_default_credentials = DBCredentials.from_env_file(
-    pathlib.Path(constants.SETTINGS_FILE), DBDefaultCredentialsEnvFields)
-db_credentials = DBCredentials.from_env_file(
-    pathlib.Path(constants.SETTINGS_FILE), DBCredentialsEnvFields)
+@functools.cache
+def get_db_replica_settings() -> DBReplicaSettings | None:
+    """Лениво читает настройки реплики для чтения, если она указана"""
+    return DBReplicaSettings.from_env(utils.get_settings())
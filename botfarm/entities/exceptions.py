@@ -6,6 +6,20 @@ class BotfarmDBError(BotfarmError):
     """Базовое исключение, связанное с БД"""
 
 
+class BotfarmMigrationLockTimeoutError(BotfarmDBError):
+    """Исключение, связанное со слишком долгим ожиданием блокировки миграций"""
+
+    def __str__(self) -> str:
+        return 'Не удалось дождаться блокировки миграций: их применяет другой процесс'
+
+
+class BotfarmInvalidCursorError(BotfarmError):
+    """Исключение, связанное с некорректным курсором пагинации"""
+
+    def __str__(self) -> str:
+        return 'Некорректный курсор пагинации'
+
+
 class BotfarmProjectError(BotfarmError):
     """Исключение, связанное с проектами"""
 
@@ -28,8 +42,64 @@ class BotfarmUserNotExistsError(BotfarmUserError):
         return 'Указанный пользователь не существует'
 
 
+class BotfarmUserExistsError(BotfarmUserError):
+    """Исключение, связанное с уже существующим пользователем"""
+
+    def __str__(self) -> str:
+        return 'Пользователь с таким логином уже существует'
+
+
+class BotfarmInvalidPasswordError(BotfarmUserError):
+    """Исключение, связанное с неверным паролем пользователя"""
+
+    def __str__(self) -> str:
+        return 'Неверный пароль пользователя'
+
+
 class BotfarmUserLockedError(BotfarmUserError):
     """Исключение, связанное с занятым пользователем"""
 
     def __str__(self) -> str:
         return 'Указанный пользователь занят'
+
+
+class BotfarmNoFreeUsersError(BotfarmUserError):
+    """Исключение, связанное с отсутствием свободных пользователей"""
+
+    def __str__(self) -> str:
+        return 'Нет свободных пользователей, подходящих под фильтры'
+
+
+class BotfarmNotEnoughFreeUsersError(BotfarmNoFreeUsersError):
+    """Исключение, связанное с нехваткой свободных пользователей для блокировки всех сразу"""
+
+    def __str__(self) -> str:
+        return 'Недостаточно свободных пользователей, подходящих под фильтры'
+
+
+class BotfarmLockQuotaExceededError(BotfarmNoFreeUsersError):
+    """Исключение, связанное с исчерпанием лимита одновременных блокировок проекта"""
+
+    def __str__(self) -> str:
+        return 'Достигнут лимит одновременно заблокированных пользователей проекта'
+
+
+class BotfarmUserNotLockedError(BotfarmUserError):
+    """Исключение, связанное с попыткой продлить блокировку свободного пользователя"""
+
+    def __str__(self) -> str:
+        return 'Указанный пользователь не заблокирован'
+
+
+class BotfarmLockNotExistsError(BotfarmUserError):
+    """Исключение, связанное с отсутствием блокировки с указанным токеном"""
+
+    def __str__(self) -> str:
+        return 'Блокировка с указанным токеном не существует'
+
+
+class BotfarmLockBackendBusyError(BotfarmError):
+    """Исключение, связанное с запуском advisory-блокировок во втором процессе"""
+
+    def __str__(self) -> str:
+        return 'Advisory-блокировки уже использует другой процесс, этот бэкенд работает только в одном процессе'
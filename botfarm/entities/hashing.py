@@ -0,0 +1,54 @@
+import enum
+import functools
+
+import pydantic
+
+from botfarm.components import utils
+
+
+class HashAlgorithm(enum.Enum):
+    scrypt = 'scrypt'
+    pbkdf2_sha256 = 'pbkdf2_sha256'
+    sha256 = 'sha256'
+
+
+class HashingEnvFields(enum.Enum):
+    algorithm = 'PASSWORD_HASH_ALGORITHM'
+    workers = 'PASSWORD_HASH_WORKERS'
+    scrypt_n = 'PASSWORD_HASH_SCRYPT_N'
+    scrypt_r = 'PASSWORD_HASH_SCRYPT_R'
+    scrypt_p = 'PASSWORD_HASH_SCRYPT_P'
+    pbkdf2_iterations = 'PASSWORD_HASH_PBKDF2_ITERATIONS'
+
+
+class HashingSettings(pydantic.BaseModel):
+    """Настройки хеширования паролей.
+
+    Args:
+        algorithm: алгоритм, которым хешируются новые пароли
+        workers: количество потоков, в которых считаются хеши
+        scrypt_n: параметр стоимости scrypt (степень двойки)
+        scrypt_r: размер блока scrypt
+        scrypt_p: параметр параллелизма scrypt
+        pbkdf2_iterations: количество итераций PBKDF2
+    """
+    algorithm: HashAlgorithm = HashAlgorithm.scrypt
+    workers: int = pydantic.Field(default=4, ge=1)
+    scrypt_n: int = pydantic.Field(default=2 ** 14, ge=2)
+    scrypt_r: int = pydantic.Field(default=8, ge=1)
+    scrypt_p: int = pydantic.Field(default=1, ge=1)
+    pbkdf2_iterations: int = pydantic.Field(default=600_000, ge=1)
+
+    @classmethod
+    def from_env(cls, env_vars: dict[str, str]) -> 'HashingSettings':
+        return cls(**{
+            field.name: env_vars[field.value]
+            for field in HashingEnvFields
+            if field.value in env_vars
+        })
+
+
+@functools.cache
+def get_hashing_settings() -> HashingSettings:
+    """Лениво читает настройки хеширования"""
+    return HashingSettings.from_env(utils.get_settings())
@@ -0,0 +1,45 @@
+import enum
+import functools
+
+import pydantic
+
+from botfarm.components import utils
+
+
+class LockBackendType(enum.Enum):
+    column = 'column'
+    advisory = 'advisory'
+
+
+class LockEnvFields(enum.Enum):
+    backend = 'LOCK_BACKEND'
+    advisory_connections = 'LOCK_ADVISORY_CONNECTIONS'
+
+
+class LockSettings(pydantic.BaseModel):
+    """Настройки блокировки пользователей.
+
+    Args:
+        backend: column - блокировка колонками таблицы users, видна всем процессам и переживает
+            перезапуск; advisory - session-level advisory locks Postgres без записи в users,
+            блокировка живет в памяти процесса, который ее выдал, поэтому приложение с ним
+            запускается только в одном процессе на БД
+        advisory_connections: сколько подключений из пула основной БД держат advisory locks,
+            между ними делятся ключи пользователей
+    """
+    backend: LockBackendType = LockBackendType.column
+    advisory_connections: int = pydantic.Field(default=4, ge=1)
+
+    @classmethod
+    def from_env(cls, env_vars: dict[str, str]) -> 'LockSettings':
+        return cls(**{
+            field.name: env_vars[field.value]
+            for field in LockEnvFields
+            if field.value in env_vars
+        })
+
+
+@functools.cache
+def get_lock_settings() -> LockSettings:
+    """Лениво читает настройки блокировки"""
+    return LockSettings.from_env(utils.get_settings())
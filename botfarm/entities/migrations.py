@@ -0,0 +1,287 @@
+import functools
+import hashlib
+
+import pydantic
+
+MIGRATIONS_TABLE = 'schema_migrations'
+# Ключ advisory lock, под которым миграции применяются только одним процессом
+MIGRATIONS_LOCK_KEY = 7_460_148_306_297
+# Как часто процесс проверяет, не освободился ли advisory lock миграций, и сколько всего его ждет
+MIGRATIONS_LOCK_POLL_SECONDS = 1
+MIGRATIONS_LOCK_WAIT_SECONDS = 30 * 60
+
+
+class Migration(pydantic.BaseModel):
+    """Миграция схемы БД.
+
+    Args:
+        version: номер миграции, миграции применяются по возрастанию
+        name: краткое описание миграции
+        statements: SQL-выражения, которые выполняются по порядку
+        transactional: выполнять ли выражения в одной транзакции. Выражения
+            с CREATE INDEX CONCURRENTLY должны выполняться вне транзакции
+    """
+    version: int
+    name: str
+    statements: tuple[str, ...]
+    transactional: bool = True
+
+
+MIGRATIONS = (
+    Migration(
+        version=1,
+        name='initial',
+        statements=(
+            """
+            DO $$ BEGIN
+                CREATE TYPE env_type AS ENUM ('prod', 'preprod', 'stage');
+            EXCEPTION WHEN duplicate_object THEN NULL;
+            END $$
+            """,
+            """
+            DO $$ BEGIN
+                CREATE TYPE domain_type AS ENUM ('canary', 'regular');
+            EXCEPTION WHEN duplicate_object THEN NULL;
+            END $$
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS projects (
+                id UUID PRIMARY KEY,
+                name VARCHAR(255) NOT NULL UNIQUE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id UUID PRIMARY KEY,
+                created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+                login VARCHAR(255) NOT NULL UNIQUE,
+                password VARCHAR(255) NOT NULL,
+                project_id UUID REFERENCES projects (id) ON DELETE SET NULL,
+                env env_type NOT NULL,
+                domain domain_type NOT NULL,
+                locktime TIMESTAMP WITH TIME ZONE
+            )
+            """,
+        ),
+    ),
+    Migration(
+        version=2,
+        name='lock leases and owners',
+        statements=(
+            'ALTER TABLE users ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE',
+            'ALTER TABLE users ADD COLUMN IF NOT EXISTS owner VARCHAR(255)',
+            'ALTER TABLE users ADD COLUMN IF NOT EXISTS lease_token UUID',
+        ),
+    ),
+    Migration(
+        version=3,
+        name='change notifications',
+        statements=(
+            """
+            CREATE OR REPLACE FUNCTION botfarm_notify_user_freed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('botfarm_users', json_build_object(
+                    'event', CASE TG_OP WHEN 'INSERT' THEN 'create' ELSE 'release' END,
+                    'login', NEW.login,
+                    'project_id', NEW.project_id,
+                    'env', NEW.env,
+                    'domain', NEW.domain
+                )::text);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            """
+            CREATE OR REPLACE TRIGGER users_notify_freed
+            AFTER INSERT OR UPDATE OF locktime ON users
+            FOR EACH ROW WHEN (NEW.locktime IS NULL)
+            EXECUTE FUNCTION botfarm_notify_user_freed()
+            """,
+            """
+            CREATE OR REPLACE FUNCTION botfarm_notify_project_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('botfarm_projects', json_build_object(
+                    'event', lower(TG_OP),
+                    'id', OLD.id,
+                    'name', OLD.name
+                )::text);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            """
+            CREATE OR REPLACE TRIGGER projects_notify_changed
+            AFTER UPDATE OR DELETE ON projects
+            FOR EACH ROW EXECUTE FUNCTION botfarm_notify_project_changed()
+            """,
+        ),
+    ),
+    Migration(
+        version=4,
+        name='users indexes',
+        statements=(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_created_at_id ON users (created_at, id)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_filters '
+            'ON users (project_id, env, domain, created_at, id)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_free '
+            'ON users (project_id, env, domain) WHERE locktime IS NULL',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_lease_expires_at '
+            'ON users (lease_expires_at) WHERE lease_expires_at IS NOT NULL',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_owner ON users (owner) WHERE owner IS NOT NULL',
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_users_lease_token '
+            'ON users (lease_token) WHERE lease_token IS NOT NULL',
+        ),
+        transactional=False,
+    ),
+    Migration(
+        version=5,
+        name='users server defaults',
+        statements=(
+            'ALTER TABLE users ALTER COLUMN id SET DEFAULT gen_random_uuid()',
+            'ALTER TABLE users ALTER COLUMN created_at SET DEFAULT now()',
+        ),
+    ),
+    Migration(
+        version=6,
+        name='lock and delete notifications',
+        statements=(
+            """
+            CREATE OR REPLACE FUNCTION botfarm_notify_user_changed() RETURNS trigger AS $$
+            DECLARE
+                changed users%ROWTYPE;
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    changed := OLD;
+                ELSE
+                    changed := NEW;
+                END IF;
+                PERFORM pg_notify('botfarm_users', json_build_object(
+                    'event', CASE
+                        WHEN TG_OP = 'INSERT' THEN 'create'
+                        WHEN TG_OP = 'DELETE' THEN 'delete'
+                        WHEN NEW.locktime IS NULL THEN 'release'
+                        ELSE 'lock'
+                    END,
+                    'login', changed.login,
+                    'project_id', changed.project_id,
+                    'env', changed.env,
+                    'domain', changed.domain,
+                    'owner', changed.owner
+                )::text);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            'DROP TRIGGER IF EXISTS users_notify_freed ON users',
+            """
+            CREATE OR REPLACE TRIGGER users_notify_changed
+            AFTER INSERT OR DELETE ON users
+            FOR EACH ROW EXECUTE FUNCTION botfarm_notify_user_changed()
+            """,
+            """
+            CREATE OR REPLACE TRIGGER users_notify_locktime
+            AFTER UPDATE OF locktime ON users
+            FOR EACH ROW WHEN (OLD.locktime IS DISTINCT FROM NEW.locktime)
+            EXECUTE FUNCTION botfarm_notify_user_changed()
+            """,
+            'DROP FUNCTION IF EXISTS botfarm_notify_user_freed()',
+        ),
+    ),
+    Migration(
+        version=7,
+        name='last released at',
+        statements=(
+            'ALTER TABLE users ADD COLUMN IF NOT EXISTS last_released_at TIMESTAMP WITH TIME ZONE',
+        ),
+    ),
+    Migration(
+        version=8,
+        name='least recently released free users index',
+        statements=(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_free_lru '
+            'ON users (project_id, env, domain, last_released_at NULLS FIRST) WHERE locktime IS NULL',
+            'DROP INDEX CONCURRENTLY IF EXISTS ix_users_free',
+        ),
+        transactional=False,
+    ),
+    Migration(
+        version=9,
+        name='lock quotas',
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS lock_quotas (
+                id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+                project_id UUID NOT NULL REFERENCES projects (id) ON DELETE CASCADE,
+                env env_type,
+                max_locked INTEGER NOT NULL CHECK (max_locked >= 0),
+                locked INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_lock_quotas_project '
+            'ON lock_quotas (project_id) WHERE env IS NULL',
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_lock_quotas_project_env '
+            'ON lock_quotas (project_id, env) WHERE env IS NOT NULL',
+            """
+            CREATE OR REPLACE FUNCTION botfarm_count_quota_locks() RETURNS trigger AS $$
+            DECLARE
+                was_locked boolean := TG_OP <> 'INSERT' AND OLD.locktime IS NOT NULL;
+                is_locked boolean := TG_OP <> 'DELETE' AND NEW.locktime IS NOT NULL;
+                exceeded integer;
+            BEGIN
+                IF was_locked AND is_locked
+                        AND OLD.project_id IS NOT DISTINCT FROM NEW.project_id AND OLD.env = NEW.env THEN
+                    RETURN NEW;
+                END IF;
+                IF is_locked AND NEW.project_id IS NOT NULL THEN
+                    WITH counted AS (
+                        UPDATE lock_quotas SET locked = locked + 1
+                        WHERE project_id = NEW.project_id AND (env IS NULL OR env = NEW.env)
+                        RETURNING locked, max_locked
+                    )
+                    SELECT count(*) FILTER (WHERE locked > max_locked) INTO exceeded FROM counted;
+                    -- Лимит проверяется только при постановке блокировки: строка пропускается,
+                    -- и UPDATE блокировки ее не вернет. Перенос занятого пользователя не запрещается
+                    IF exceeded > 0 AND NOT was_locked THEN
+                        UPDATE lock_quotas SET locked = locked - 1
+                        WHERE project_id = NEW.project_id AND (env IS NULL OR env = NEW.env);
+                        RETURN NULL;
+                    END IF;
+                END IF;
+                IF was_locked AND OLD.project_id IS NOT NULL THEN
+                    UPDATE lock_quotas SET locked = greatest(locked - 1, 0)
+                    WHERE project_id = OLD.project_id AND (env IS NULL OR env = OLD.env);
+                END IF;
+                IF TG_OP = 'DELETE' THEN
+                    RETURN OLD;
+                END IF;
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            """
+            CREATE OR REPLACE TRIGGER users_count_quota_locks
+            BEFORE INSERT OR DELETE OR UPDATE OF locktime, project_id, env ON users
+            FOR EACH ROW EXECUTE FUNCTION botfarm_count_quota_locks()
+            """,
+        ),
+    ),
+    Migration(
+        version=10,
+        name='lease expiration backfill',
+        statements=(
+            # Блокировки, поставленные до появления аренды, получают аренду по умолчанию
+            # (LOCK_LEASE_SECONDS на момент миграции), иначе их никогда не снимет сборщик
+            """
+            UPDATE users SET lease_expires_at = locktime + interval '600 seconds'
+            WHERE locktime IS NOT NULL AND lease_expires_at IS NULL
+            """,
+        ),
+    ),
+)
+
+
+@functools.cache
+def get_schema_fingerprint() -> str:
+    """Отпечаток списка миграций. Совпадение с сохраненным в БД значит, что схема актуальна"""
+    payload = '\n'.join(migration.model_dump_json() for migration in MIGRATIONS)
+    return hashlib.sha256(payload.encode()).hexdigest()
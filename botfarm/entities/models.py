@@ -1,6 +1,6 @@
 import enum
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime
 
 import sqlalchemy as sa
 from sqlalchemy import orm
@@ -34,14 +34,39 @@ class User(Base):
         env: название окружения (prod, preprod, stage)
         domain: тип пользователя (canary, regular)
         locktime: временная метка (timestamp)
+        lease_expires_at: момент, после которого блокировка снимается автоматически
+        owner: идентификатор владельца блокировки (например, id тестового прогона)
+        lease_token: токен аренды, выданный при постановке блокировки
+        last_released_at: момент последнего снятия блокировки, по нему выдаются давно не использованные
     """
     __tablename__ = 'users'
+    # Схема меняется только миграциями из entities.migrations, индексы здесь для справки
+    __table_args__ = (
+        sa.Index('ix_users_created_at_id', 'created_at', 'id'),
+        sa.Index('ix_users_filters', 'project_id', 'env', 'domain', 'created_at', 'id'),
+        sa.Index(
+            'ix_users_free_lru', 'project_id', 'env', 'domain', sa.text('last_released_at NULLS FIRST'),
+            postgresql_where=sa.text('locktime IS NULL'),
+        ),
+        sa.Index(
+            'ix_users_lease_expires_at', 'lease_expires_at',
+            postgresql_where=sa.text('lease_expires_at IS NOT NULL'),
+        ),
+        sa.Index(
+            'ix_users_owner', 'owner',
+            postgresql_where=sa.text('owner IS NOT NULL'),
+        ),
+        sa.Index(
+            'ix_users_lease_token', 'lease_token', unique=True,
+            postgresql_where=sa.text('lease_token IS NOT NULL'),
+        ),
+    )
 
     id: orm.Mapped[uuid.UUID] = orm.mapped_column(
-        pg.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
+        pg.UUID(as_uuid=True), primary_key=True, server_default=sa.func.gen_random_uuid()
     )
     created_at: orm.Mapped[datetime] = orm.mapped_column(
-        sa.DateTime(timezone=True), default=datetime.now(timezone.utc), nullable=False,
+        sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False,
     )
     login: orm.Mapped[str] = orm.mapped_column(
         sa.String(255), nullable=False, unique=True)
@@ -59,6 +84,17 @@ class User(Base):
     locktime: orm.Mapped[datetime | None] = orm.mapped_column(
         sa.TIMESTAMP(timezone=True), nullable=True
     )
+    lease_expires_at: orm.Mapped[datetime | None] = orm.mapped_column(
+        sa.TIMESTAMP(timezone=True), nullable=True
+    )
+    owner: orm.Mapped[str | None] = orm.mapped_column(
+        sa.String(255), nullable=True)
+    lease_token: orm.Mapped[uuid.UUID | None] = orm.mapped_column(
+        pg.UUID(as_uuid=True), nullable=True
+    )
+    last_released_at: orm.Mapped[datetime | None] = orm.mapped_column(
+        sa.TIMESTAMP(timezone=True), nullable=True
+    )
 
 
 class Project(Base):
@@ -75,3 +111,37 @@ class Project(Base):
     )
     name: orm.Mapped[str] = orm.mapped_column(
         sa.String(255), nullable=False, unique=True)
+
+
+class LockQuota(Base):
+    """Лимит одновременно заблокированных пользователей проекта.
+
+    Счетчик locked ведет триггер на users, блокировка сверх лимита не ставится.
+
+    Args:
+        id: UUID лимита
+        project_id: UUID проекта
+        env: окружение, на которое действует лимит, или NULL для всего проекта
+        max_locked: максимальное количество одновременно заблокированных пользователей
+        locked: сколько пользователей заблокировано сейчас
+    """
+    __tablename__ = 'lock_quotas'
+    __table_args__ = (
+        sa.Index('ix_lock_quotas_project', 'project_id', unique=True, postgresql_where=sa.text('env IS NULL')),
+        sa.Index(
+            'ix_lock_quotas_project_env', 'project_id', 'env', unique=True,
+            postgresql_where=sa.text('env IS NOT NULL'),
+        ),
+    )
+
+    id: orm.Mapped[uuid.UUID] = orm.mapped_column(
+        pg.UUID(as_uuid=True), primary_key=True, server_default=sa.func.gen_random_uuid()
+    )
+    project_id: orm.Mapped[uuid.UUID] = orm.mapped_column(
+        pg.UUID(as_uuid=True), sa.ForeignKey('projects.id', ondelete='CASCADE'), nullable=False
+    )
+    env: orm.Mapped[EnvType | None] = orm.mapped_column(
+        sa.Enum(EnvType, name='env_type'), nullable=True
+    )
+    max_locked: orm.Mapped[int] = orm.mapped_column(sa.Integer, nullable=False)
+    locked: orm.Mapped[int] = orm.mapped_column(sa.Integer, nullable=False, server_default='0')
@@ -1,4 +1,6 @@
+import enum
 from datetime import datetime
+from typing import Annotated
 from uuid import UUID
 
 import pydantic
@@ -6,6 +8,16 @@ import pydantic
 from botfarm.entities import models
 
 
+# Логин, прочитанный из БД, уже проверен при создании, а повторная проверка email-validator
+# в ответах стоит дороже всей остальной сериализации. В схеме OpenAPI это по-прежнему email
+StoredEmail = Annotated[str, pydantic.WithJsonSchema({'type': 'string', 'format': 'email'})]
+
+
+class DataFormat(enum.Enum):
+    ndjson = 'ndjson'
+    csv = 'csv'
+
+
 class ProjectCreate(pydantic.BaseModel):
     name: str
 
@@ -21,6 +33,25 @@ class ProjectUpdate(pydantic.BaseModel):
     name: str | None = None
 
 
+class ProjectPage(pydantic.BaseModel):
+    items: list[Project]
+    next_cursor: str | None = None
+    total: int | None = None
+
+
+class LockQuotaUpdate(pydantic.BaseModel):
+    max_locked: int = pydantic.Field(ge=0)
+    env: models.EnvType | None = None
+
+
+class LockQuota(pydantic.BaseModel):
+    env: models.EnvType | None
+    max_locked: int
+    locked: int
+
+    model_config = pydantic.ConfigDict(from_attributes=True)
+
+
 class UserCreate(pydantic.BaseModel):
     login: pydantic.EmailStr
     password: str
@@ -29,6 +60,10 @@ class UserCreate(pydantic.BaseModel):
     domain: models.DomainType
 
 
+class PasswordCheck(pydantic.BaseModel):
+    password: str
+
+
 class UserUpdate(pydantic.BaseModel):
     password: str | None = None
     project_name: str | None = None
@@ -37,13 +72,96 @@ class UserUpdate(pydantic.BaseModel):
     locktime: datetime | None = None
 
 
+class UserSelector(pydantic.BaseModel):
+    """Пользователи для массовых изменений: список логинов и/или фильтры, которые должны совпасть все"""
+    logins: list[pydantic.EmailStr] | None = None
+    project_name: str | None = None
+    env: models.EnvType | None = None
+    domain: models.DomainType | None = None
+    locked: bool | None = None
+
+    @pydantic.model_validator(mode='after')
+    def check_not_empty(self) -> 'UserSelector':
+        if all(getattr(self, name) is None for name in type(self).model_fields):
+            raise ValueError('Нужно указать логины или хотя бы один фильтр')
+        return self
+
+
+class UserBulkUpdate(pydantic.BaseModel):
+    selector: UserSelector
+    changes: UserUpdate
+
+
 class User(pydantic.BaseModel):
     id: UUID
     created_at: datetime
-    login: pydantic.EmailStr
+    login: StoredEmail
     project_id: UUID | None
     env: models.EnvType
     domain: models.DomainType
     locktime: datetime | None = None
+    lease_expires_at: datetime | None = None
+    owner: str | None = None
+    last_released_at: datetime | None = None
 
     model_config = pydantic.ConfigDict(from_attributes=True)
+
+
+class LockedUser(User):
+    lease_token: UUID | None = None
+
+
+class LocksReleased(pydantic.BaseModel):
+    released: int
+
+
+class UsersAffected(pydantic.BaseModel):
+    affected: int
+    skipped: int = 0
+
+
+class UserPage(pydantic.BaseModel):
+    items: list[User]
+    next_cursor: str | None = None
+    total: int | None = None
+
+
+class UserStatsGroup(pydantic.BaseModel):
+    project_name: str | None
+    env: models.EnvType
+    domain: models.DomainType
+    free: int
+    locked: int
+
+
+class UserStats(pydantic.BaseModel):
+    free: int
+    locked: int
+    groups: list[UserStatsGroup]
+    generated_at: datetime
+
+
+project_list_adapter = pydantic.TypeAdapter(list[Project])
+user_list_adapter = pydantic.TypeAdapter(list[User])
+locked_user_list_adapter = pydantic.TypeAdapter(list[LockedUser])
+
+
+class ImportRowError(pydantic.BaseModel):
+    line: int
+    login: str | None = None
+    detail: str
+
+
+class ImportReport(pydantic.BaseModel):
+    created: int = 0
+    failed: int = 0
+    errors: list[ImportRowError] = []
+
+
+class PoolStats(pydantic.BaseModel):
+    size: int
+    max_overflow: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    timeout: float
@@ -1,27 +1,58 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 import uvicorn
 from fastapi import FastAPI
 
 from botfarm import api
-from botfarm.components import db, exceptions
+from botfarm.components import db, events, exceptions, hashing, locks, migrations, projects, streams, users, waiters
+from botfarm.entities import constants
 from botfarm.entities import exceptions as exception_entities
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await db.ensure_db_exists()
-    await db.create_tables()
+    await migrations.upgrade(db.get_engine())
+    await locks.start_backend()
+    events.listener.subscribe(events.USERS_CHANNEL, waiters.queue.notify)
+    events.listener.subscribe(events.USERS_CHANNEL, streams.hub.publish)
+    events.listener.subscribe(events.PROJECTS_CHANNEL, projects.invalidate_cache)
+    await events.listener.start(db.get_engine())
+    reaper = asyncio.create_task(
+        users.run_lock_reaper(constants.LOCK_REAPER_INTERVAL_SECONDS))
     yield
+    reaper.cancel()
+    with suppress(asyncio.CancelledError):
+        await reaper
+    await events.listener.stop()
+    events.listener.unsubscribe(events.USERS_CHANNEL, waiters.queue.notify)
+    events.listener.unsubscribe(events.USERS_CHANNEL, streams.hub.publish)
+    events.listener.unsubscribe(events.PROJECTS_CHANNEL, projects.invalidate_cache)
+    await locks.close_backend()
+    hashing.shutdown()
+    await db.dispose_engine()
 
 app = FastAPI(lifespan=lifespan)
 app.include_router(api.router)
+app.add_exception_handler(
+    exception_entities.BotfarmInvalidCursorError, exceptions.handle_invalid_cursor_error)
 app.add_exception_handler(exception_entities.BotfarmProjectNotExistsError,
                           exceptions.handle_project_not_exists_error)
 app.add_exception_handler(
     exception_entities.BotfarmUserNotExistsError, exceptions.handle_user_not_exists_error)
+app.add_exception_handler(
+    exception_entities.BotfarmInvalidPasswordError, exceptions.handle_invalid_password_error)
 app.add_exception_handler(
     exception_entities.BotfarmUserLockedError, exceptions.handle_user_locked_error)
+app.add_exception_handler(
+    exception_entities.BotfarmNoFreeUsersError, exceptions.handle_no_free_users_error)
+app.add_exception_handler(
+    exception_entities.BotfarmLockQuotaExceededError, exceptions.handle_lock_quota_exceeded_error)
+app.add_exception_handler(
+    exception_entities.BotfarmUserNotLockedError, exceptions.handle_user_not_locked_error)
+app.add_exception_handler(
+    exception_entities.BotfarmLockNotExistsError, exceptions.handle_lock_not_exists_error)
 
 if __name__ == '__main__':
     uvicorn.run(app='main:app', reload=True)
@@ -0,0 +1,32 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from botfarm import api
+from botfarm.components import db, metrics, users
+from botfarm.entities import schemas
+
+
+@pytest.mark.asyncio
+async def test_get_metrics(monkeypatch):
+    loads = []
+
+    async def mock_load_user_stats():
+        loads.append(True)
+        return schemas.UserStats(free=7, locked=3, groups=[], generated_at=datetime.now(timezone.utc))
+
+    monkeypatch.setattr(users, '_load_user_stats', mock_load_user_stats)
+    monkeypatch.setattr(db, 'get_pool_stats', lambda: schemas.PoolStats(
+        size=5, max_overflow=10, checked_in=3, checked_out=2, overflow=0, timeout=30))
+
+    response = await api.get_metrics()
+    await api.get_metrics()
+    body = response.body.decode()
+
+    # Повторный сбор метрик берет количество пользователей из кеша сводки
+    assert len(loads) == 1
+    assert response.media_type == metrics.CONTENT_TYPE
+    assert 'botfarm_users{state="free"} 7' in body
+    assert 'botfarm_users{state="locked"} 3' in body
+    assert 'botfarm_db_pool_checked_out 2' in body
+    assert '# TYPE botfarm_http_request_duration_seconds histogram' in body
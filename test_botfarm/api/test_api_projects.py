@@ -4,6 +4,7 @@ import uuid
 import pytest
 
 from botfarm import api
+from botfarm.components import utils
 from botfarm.entities import schemas
 from test_botfarm.conftest import MockScalarResult
 
@@ -59,11 +60,13 @@ async def test_get_projects():
             ])
 
     mock_session = MockSession()
-    result = await api.get_projects(limit=2, session=mock_session)
+    response = await api.get_projects(limit=2, cursor=None, total=False, session=mock_session)
+    result = schemas.project_list_adapter.validate_json(response.body)
 
     assert mock_session.scalars_calls == 1
     assert len(result) == 2
     assert all(isinstance(item, schemas.Project) for item in result)
+    assert utils.decode_cursor(response.headers[api.NEXT_CURSOR_HEADER], 1) == ['p2']
 
 
 @pytest.mark.asyncio
@@ -1,44 +1,61 @@
+import csv
+import io
+import json
 import types
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
+import annotated_types
 import pytest
+from sqlalchemy.dialects import postgresql
 
 from botfarm import api
-from botfarm.components import projects, utils
-from botfarm.entities import exceptions, models, schemas
-from test_botfarm.conftest import MockScalarResult
+from botfarm.components import db, hashing, utils
+from botfarm.entities import constants, exceptions, models, schemas
+from botfarm.entities import hashing as hashing_entities
+from test_botfarm.conftest import MockResult, MockScalarResult
 
 
 class MockSession:
-    """Моковая сессия, которая считает вызовы add/commit/refresh"""
+    """Моковая сессия, которая выполняет INSERT ... RETURNING и считает вызовы execute/commit"""
 
-    def __init__(self):
-        self.add_count = 0
+    def __init__(self, project_id=None):
+        self.project_id = project_id
+        self.statements = []
         self.commit_count = 0
-        self.refresh_count = 0
-        self.last_added = None
-
-    def add(self, obj):
-        self.add_count += 1
-        self.last_added = obj
-        if getattr(obj, 'id', None) is None:
-            obj.id = uuid.uuid4()
-        if getattr(obj, 'created_at', None) is None:
-            obj.created_at = datetime.now(timezone.utc)
-        if getattr(obj, 'locktime', None) is None:
-            obj.locktime = None
+        self.rollback_count = 0
+
+    async def execute(self, stmt):
+        self.statements.append(stmt)
+        params = stmt.compile(dialect=postgresql.dialect()).params
+        if 'name_1' in params and self.project_id is None:
+            return MockResult([])
+        values = [value for name, value in params.items() if name.startswith('param_')] or [
+            params['login'], params['password'], params['env'], params['domain']]
+        login, password, env, domain = values
+        return MockResult([types.SimpleNamespace(
+            id=uuid.uuid4(),
+            created_at=datetime.now(timezone.utc),
+            login=login,
+            password=password,
+            project_id=self.project_id,
+            env=env,
+            domain=domain,
+            locktime=None,
+            lease_expires_at=None,
+            owner=None,
+        )])
 
     async def commit(self):
         self.commit_count += 1
 
-    async def refresh(self, obj):
-        self.refresh_count += 1
+    async def rollback(self):
+        self.rollback_count += 1
 
 
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
-    'payload, expected_project_id, expected_project_calls',
+    'payload, expected_project_id',
     [
         pytest.param(
             {
@@ -49,7 +66,6 @@ class MockSession:
                 'project_name': None,
             },
             None,
-            0,
         ),
         pytest.param(
             {
@@ -60,37 +76,45 @@ class MockSession:
                 'project_name': 'proj',
             },
             uuid.uuid4(),
-            1,
         ),
     ],
 )
-async def test_create_user(payload, expected_project_id, expected_project_calls, monkeypatch):
-    mock_session = MockSession()
-    calls = {'projects': 0}
-
-    async def mock_get_project(name, session):
-        calls['projects'] += 1
-        assert name == payload['project_name']
-        assert session is mock_session
-        return types.SimpleNamespace(id=expected_project_id)
-
-    monkeypatch.setattr(projects, 'get_project', mock_get_project)
+async def test_create_user(payload, expected_project_id, monkeypatch):
+    mock_session = MockSession(project_id=expected_project_id)
 
     request = schemas.UserCreate(**payload)
     result = await api.create_user(request=request, session=mock_session)
 
-    assert calls['projects'] == expected_project_calls
-    assert mock_session.add_count == 1
+    assert len(mock_session.statements) == 1
     assert mock_session.commit_count == 1
-    assert mock_session.refresh_count == 1
+    compiled = str(mock_session.statements[0].compile(dialect=postgresql.dialect()))
+    assert 'RETURNING' in compiled
+    assert ('FROM projects' in compiled) == (payload['project_name'] is not None)
 
     assert result.login == request.login
     assert result.project_id == expected_project_id
     assert result.env == request.env
     assert result.domain == request.domain
     assert result.locktime is None
-    assert mock_session.last_added.password == utils.hash_password(
-        request.password)
+    stored_password = mock_session.statements[0].compile(dialect=postgresql.dialect()).params
+    assert any(
+        isinstance(value, str) and hashing.verify_password_sync(request.password, value)
+        for value in stored_password.values()
+    )
+
+
+@pytest.mark.asyncio
+async def test_create_user_project_not_exists():
+    mock_session = MockSession()
+    request = schemas.UserCreate(
+        login='user@example.com', password='password', env=models.EnvType.prod,
+        domain=models.DomainType.regular, project_name='missing')
+
+    with pytest.raises(exceptions.BotfarmProjectNotExistsError):
+        await api.create_user(request=request, session=mock_session)
+
+    assert mock_session.commit_count == 0
+    assert mock_session.rollback_count == 1
 
 
 @pytest.mark.asyncio
@@ -109,7 +133,7 @@ async def test_get_users(project_name, project_obj, expected_scalar_calls, limit
 
         async def scalar(self, stmt):
             self.scalar_calls.append(stmt)
-            return project_obj
+            return project_obj.id
 
         async def scalars(self, stmt):
             self.scalars_calls.append(stmt)
@@ -138,11 +162,13 @@ async def test_get_users(project_name, project_obj, expected_scalar_calls, limit
         ),
     ]
 
-    result = await api.get_users(
+    response = await api.get_users(
         limit=limit_two,
         project_name=project_name,
         domain=models.DomainType.regular,
         env=models.EnvType.prod,
+        cursor=None,
+        total=False,
         session=mock_session,
     )
 
@@ -153,10 +179,16 @@ async def test_get_users(project_name, project_obj, expected_scalar_calls, limit
     compiled_params = stmt.compile().params
     assert limit_two in compiled_params.values()
 
+    assert response.media_type == 'application/json'
+    result = schemas.user_list_adapter.validate_json(response.body)
     assert len(result) == len(mock_users)
     assert all(isinstance(item, schemas.User) for item in result)
     assert all(item.domain == models.DomainType.regular for item in result)
     assert all(item.env == models.EnvType.prod for item in result)
+    assert 'ORDER BY users.created_at, users.id' in str(stmt)
+    assert utils.decode_cursor(response.headers[api.NEXT_CURSOR_HEADER], 2) == [
+        mock_users[-1].created_at.isoformat(), str(mock_users[-1].id)]
+    assert api.TOTAL_COUNT_HEADER not in response.headers
 
 
 @pytest.mark.asyncio
@@ -164,7 +196,6 @@ async def test_get_users(project_name, project_obj, expected_scalar_calls, limit
     'lock_flag, initial_locktime, expect_commit, expect_refresh, expect_exception',
     [
         pytest.param(False, None, 0, 0, None),
-        pytest.param(True, None, 1, 1, None),
         pytest.param(False, datetime.now(timezone.utc), 0,
                      0, exceptions.BotfarmUserLockedError),
     ],
@@ -219,7 +250,313 @@ async def test_get_user(lock_flag, initial_locktime, expect_commit, expect_refre
 
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
-    'payload, project_obj, expected_project_calls',
+    'row_state, expected_exception',
+    [
+        pytest.param('free', None),
+        pytest.param('locked', exceptions.BotfarmUserLockedError),
+        pytest.param('quota', exceptions.BotfarmLockQuotaExceededError),
+        pytest.param('missing', exceptions.BotfarmUserNotExistsError),
+    ],
+)
+async def test_get_user_lock(row_state, expected_exception, make_mock_user):
+    class MockSession:
+        def __init__(self):
+            self.statements = []
+            self.commit_count = 0
+            self.rollback_count = 0
+
+        async def execute(self, stmt):
+            self.statements.append(stmt)
+            if row_state == 'missing':
+                return MockResult([])
+            user = make_mock_user(locktime=datetime.now(timezone.utc))
+            return MockResult([(user.id, user if row_state == 'free' else None)])
+
+        async def scalar(self, stmt):
+            assert 'lock_quotas.locked >= lock_quotas.max_locked' in str(stmt)
+            return row_state == 'quota'
+
+        async def commit(self):
+            self.commit_count += 1
+
+        async def rollback(self):
+            self.rollback_count += 1
+
+    mock_session = MockSession()
+
+    if expected_exception:
+        with pytest.raises(expected_exception):
+            await api.get_user(
+                login='user@example.com', lock=True, lease=60, owner=None, session=mock_session)
+        assert mock_session.rollback_count == 1
+        assert mock_session.commit_count == 0
+        return
+
+    result = await api.get_user(
+        login='user@example.com', lock=True, lease=60, owner=None, session=mock_session)
+
+    assert len(mock_session.statements) == 1
+    compiled = str(mock_session.statements[0].compile(
+        dialect=postgresql.dialect()))
+    assert 'users.locktime IS NULL RETURNING' in compiled
+    assert mock_session.commit_count == 1
+    assert result.locktime is not None
+
+
+class MockCheckoutSession:
+    """Моковая сессия для checkout: execute блокирует свободных пользователей, scalar возвращает id проекта
+    или исчерпан ли его лимит блокировок.
+
+    Пользователи проектов из full_projects выбираются, только если запрос не отсекает исчерпанные лимиты
+    или лимит исчерпан уже после выборки (первые stale_quota_reads запросов), а затем их пропускает триггер.
+    """
+
+    def __init__(self, free_users, project_id=None, quota_exhausted=False, full_projects=(), stale_quota_reads=0):
+        self.free_users = list(free_users)
+        self.project_id = project_id
+        self.quota_exhausted = quota_exhausted
+        self.full_projects = set(full_projects)
+        self.stale_quota_reads = stale_quota_reads
+        self.statements = []
+        self.commit_count = 0
+        self.rollback_count = 0
+
+    async def execute(self, stmt):
+        self.statements.append(stmt)
+        compiled = stmt.compile(dialect=postgresql.dialect())
+        selected = self.free_users
+        if 'NOT (EXISTS (SELECT *' in str(compiled) and len(self.statements) > self.stale_quota_reads:
+            selected = [user for user in selected if user.project_id not in self.full_projects]
+        selected = selected[:compiled.params['param_1']]
+        locked = [user for user in selected if user.project_id not in self.full_projects]
+        self.free_users = [user for user in self.free_users if user not in locked]
+        return MockResult([(len(selected), user) for user in locked] or [(len(selected), None)])
+
+    async def scalar(self, stmt):
+        self.statements.append(stmt)
+        if 'lock_quotas' in str(stmt):
+            return self.quota_exhausted
+        return self.project_id
+
+    async def commit(self):
+        self.commit_count += 1
+
+    async def rollback(self):
+        self.rollback_count += 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'free_count, project_id, quota_exhausted, expected_exception',
+    [
+        pytest.param(1, uuid.uuid4(), False, None),
+        pytest.param(0, uuid.uuid4(), False, exceptions.BotfarmNoFreeUsersError),
+        pytest.param(0, uuid.uuid4(), True, exceptions.BotfarmLockQuotaExceededError),
+        pytest.param(0, None, False, exceptions.BotfarmProjectNotExistsError),
+    ],
+)
+async def test_checkout_user(free_count, project_id, quota_exhausted, expected_exception, make_mock_user):
+    mock_session = MockCheckoutSession(
+        [make_mock_user(locktime=datetime.now(timezone.utc)) for _ in range(free_count)], project_id, quota_exhausted)
+
+    if expected_exception:
+        with pytest.raises(expected_exception) as exc_info:
+            await api.checkout_user(project_name='proj', domain=None, env=None, lease=60, wait=0, owner=None, session=mock_session)
+        assert type(exc_info.value) is expected_exception
+        # Несуществующий проект отсекается еще до блокировки
+        assert mock_session.rollback_count == (project_id is not None)
+        assert mock_session.commit_count == 0
+        return
+
+    result = await api.checkout_user(
+        project_name='proj', domain=models.DomainType.regular, env=models.EnvType.prod, lease=60, wait=0,
+        owner='run-1', session=mock_session)
+
+    assert len(mock_session.statements) == 2
+    assert mock_session.commit_count == 1
+    compiled = str(mock_session.statements[1].compile(dialect=postgresql.dialect()))
+    assert 'users.project_id = %(project_id_1)s::UUID' in compiled
+    assert 'lock_quotas.locked >= lock_quotas.max_locked' in compiled
+    assert 'projects' not in compiled
+    assert 'FOR UPDATE SKIP LOCKED' in compiled
+    assert 'ORDER BY users.last_released_at ASC NULLS FIRST' in compiled
+    assert result.locktime is not None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'free_count, all_or_nothing, expected_exception',
+    [
+        pytest.param(3, False, None),
+        pytest.param(2, False, None),
+        pytest.param(2, True, exceptions.BotfarmNotEnoughFreeUsersError),
+    ],
+)
+async def test_checkout_users(free_count, all_or_nothing, expected_exception, make_mock_user):
+    mock_session = MockCheckoutSession(
+        [make_mock_user(login=f'u{i}@example.com', locktime=datetime.now(timezone.utc)) for i in range(free_count)])
+
+    if expected_exception:
+        with pytest.raises(expected_exception):
+            await api.checkout_users(
+                count=3, all_or_nothing=all_or_nothing, project_name=None, domain=None, env=None, lease=60, owner=None, session=mock_session)
+        assert mock_session.rollback_count == 1
+        assert mock_session.commit_count == 0
+        return
+
+    response = await api.checkout_users(
+        count=3, all_or_nothing=all_or_nothing, project_name=None, domain=None, env=None, lease=60, owner=None, session=mock_session)
+    result = schemas.locked_user_list_adapter.validate_json(response.body)
+
+    assert len(mock_session.statements) == 1
+    assert mock_session.commit_count == 1
+    compiled_params = mock_session.statements[0].compile().params
+    assert 3 in compiled_params.values()
+    assert len(result) == free_count
+
+
+@pytest.mark.asyncio
+async def test_checkout_users_skips_projects_at_quota(make_mock_user):
+    full_project, other_project = uuid.uuid4(), uuid.uuid4()
+    oldest = make_mock_user(login='oldest@example.com', project_id=full_project, locktime=datetime.now(timezone.utc))
+    other = make_mock_user(login='other@example.com', project_id=other_project, locktime=datetime.now(timezone.utc))
+    mock_session = MockCheckoutSession([oldest, other], full_projects={full_project})
+
+    result = await api.checkout_user(
+        project_name=None, domain=None, env=None, lease=60, wait=0, owner=None, session=mock_session)
+
+    # Самый давно освобожденный пользователь из проекта с исчерпанным лимитом не мешает выдать другого
+    assert result.login == 'other@example.com'
+    assert len(mock_session.statements) == 1
+
+
+@pytest.mark.asyncio
+async def test_checkout_retries_rows_skipped_by_quota_trigger(make_mock_user):
+    full_project = uuid.uuid4()
+    users = [
+        make_mock_user(login=f'u{i}@example.com', project_id=project_id, locktime=datetime.now(timezone.utc))
+        for i, project_id in enumerate([full_project, None, None])
+    ]
+    # Лимит исчерпан параллельной блокировкой уже после выборки, поэтому строку пропускает только триггер
+    mock_session = MockCheckoutSession(users, full_projects={full_project}, stale_quota_reads=1)
+
+    response = await api.checkout_users(
+        count=2, all_or_nothing=True, project_name=None, domain=None, env=None, lease=60, owner=None,
+        session=mock_session)
+    result = schemas.locked_user_list_adapter.validate_json(response.body)
+
+    assert [user.login for user in result] == ['u1@example.com', 'u2@example.com']
+    assert len(mock_session.statements) == 2
+    assert mock_session.commit_count == 1
+
+
+def test_checkout_users_count_is_bounded():
+    route = next(route for route in api.router.routes if route.path == '/users/checkout/batch')
+    count = next(param for param in route.dependant.query_params if param.name == 'count')
+
+    assert annotated_types.Le(constants.LOCK_CHECKOUT_MAX_COUNT) in count.field_info.metadata
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'locked, exists, expected_exception',
+    [
+        pytest.param(True, True, None),
+        pytest.param(False, True, exceptions.BotfarmUserNotLockedError),
+        pytest.param(False, False, exceptions.BotfarmUserNotExistsError),
+    ],
+)
+async def test_extend_lock(locked, exists, expected_exception, make_mock_user):
+    class MockSession:
+        def __init__(self):
+            self.statements = []
+            self.commit_count = 0
+            self.rollback_count = 0
+
+        async def scalar(self, stmt):
+            self.statements.append(stmt)
+            if len(self.statements) == 1 and locked:
+                return make_mock_user(
+                    locktime=datetime.now(timezone.utc), lease_expires_at=datetime.now(timezone.utc))
+            if len(self.statements) == 2 and exists:
+                return make_mock_user()
+            return None
+
+        async def commit(self):
+            self.commit_count += 1
+
+        async def rollback(self):
+            self.rollback_count += 1
+
+    mock_session = MockSession()
+
+    if expected_exception:
+        with pytest.raises(expected_exception):
+            await api.extend_lock(login='user@example.com', lease=60, token=None, session=mock_session)
+        assert mock_session.commit_count == 0
+        return
+
+    result = await api.extend_lock(login='user@example.com', lease=60, token=None, session=mock_session)
+
+    assert len(mock_session.statements) == 1
+    assert mock_session.commit_count == 1
+    assert result.lease_expires_at is not None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'legacy, password, expected_exception',
+    [
+        pytest.param(True, 'secret', None),
+        pytest.param(False, 'secret', None),
+        pytest.param(True, 'wrong', exceptions.BotfarmInvalidPasswordError),
+    ],
+)
+async def test_verify_password(legacy, password, expected_exception, monkeypatch, make_mock_user):
+    settings = hashing_entities.HashingSettings(algorithm=hashing_entities.HashAlgorithm.scrypt, scrypt_n=2 ** 4)
+    monkeypatch.setattr(hashing_entities, 'get_hashing_settings', lambda: settings)
+    encoded = utils.hash_password('secret') if legacy else hashing.hash_password_sync('secret', settings)
+
+    class MockSession:
+        def __init__(self):
+            self.statements = []
+            self.commit_count = 0
+
+        async def scalar(self, stmt):
+            return make_mock_user(password=encoded)
+
+        async def execute(self, stmt):
+            self.statements.append(stmt)
+
+        async def commit(self):
+            self.commit_count += 1
+
+    mock_session = MockSession()
+
+    if expected_exception:
+        with pytest.raises(expected_exception):
+            await api.verify_password(
+                login='user@example.com', request=schemas.PasswordCheck(password=password), session=mock_session)
+        assert mock_session.statements == []
+        return
+
+    result = await api.verify_password(
+        login='user@example.com', request=schemas.PasswordCheck(password=password), session=mock_session)
+
+    assert result.login == 'user@example.com'
+    # Старый хеш SHA-256 заменяется хешем текущего алгоритма, а актуальный не трогается
+    assert len(mock_session.statements) == legacy
+    assert mock_session.commit_count == legacy
+    if legacy:
+        params = mock_session.statements[0].compile(dialect=postgresql.dialect()).params
+        assert params['password_1'] == encoded
+        assert params['password'].startswith('scrypt$')
+        assert hashing.verify_password_sync('secret', params['password'])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'payload, project_id',
     [
         pytest.param(
             {
@@ -230,7 +567,6 @@ async def test_get_user(lock_flag, initial_locktime, expect_commit, expect_refre
                 'locktime': None,
             },
             None,
-            0,
         ),
         pytest.param(
             {
@@ -240,71 +576,112 @@ async def test_get_user(lock_flag, initial_locktime, expect_commit, expect_refre
                 'domain': models.DomainType.regular,
                 'locktime': datetime.now(timezone.utc),
             },
-            types.SimpleNamespace(id=uuid.uuid4()),
-            1,
+            uuid.uuid4(),
         ),
     ],
 )
-async def test_update_user(payload, project_obj, expected_project_calls, monkeypatch):
-    calls = {'scalar': 0, 'project': 0, 'commit': 0, 'refresh': 0}
-
+async def test_update_user(payload, project_id):
     class MockSession:
         def __init__(self):
-            self.user = types.SimpleNamespace(
+            self.statements = []
+            self.commit_count = 0
+
+        async def execute(self, stmt):
+            self.statements.append(stmt)
+            return MockResult([types.SimpleNamespace(
                 id=uuid.uuid4(),
                 created_at=datetime.now(timezone.utc),
                 login='user@example.com',
-                password='old',
-                project_id=None,
-                env=models.EnvType.prod,
-                domain=models.DomainType.regular,
-                locktime=None,
-            )
-
-        async def scalar(self, stmt):
-            calls['scalar'] += 1
-            if calls['scalar'] == 1 and 'projects' in str(stmt):
-                calls['project'] += 1
-                return project_obj
-            if calls['scalar'] == 1:
-                return self.user
-            if calls['scalar'] == 2 and payload['project_name'] is not None:
-                calls['project'] += 1
-                return project_obj
-            return self.user
+                password='hash',
+                project_id=project_id,
+                env=payload['env'],
+                domain=payload['domain'],
+                locktime=payload['locktime'],
+                lease_expires_at=None,
+                owner=None,
+            )])
 
         async def commit(self):
-            calls['commit'] += 1
-
-        async def refresh(self, _):
-            calls['refresh'] += 1
-
-    async def mock_get_project(name, session):
-        calls['project'] += 1
-        assert session is mock_session
-        assert name == payload['project_name']
-        return project_obj
+            self.commit_count += 1
 
     mock_session = MockSession()
 
-    if payload['project_name'] is not None:
-        monkeypatch.setattr(projects, 'get_project', mock_get_project)
-
     request = schemas.UserUpdate(**payload)
     result = await api.update_user(login='user@example.com', request=request, session=mock_session)
 
-    assert calls['commit'] == 1
-    assert calls['refresh'] == 1
-    assert calls['scalar'] >= 1
-    assert calls['project'] == expected_project_calls
+    assert len(mock_session.statements) == 1
+    assert mock_session.commit_count == 1
+    compiled = str(mock_session.statements[0].compile(dialect=postgresql.dialect()))
+    assert compiled.startswith('UPDATE users SET')
+    assert 'RETURNING' in compiled
+    assert ('FROM projects' in compiled) == (payload['project_name'] is not None)
+    assert ('lease_expires_at=' in compiled) == (payload['locktime'] is not None)
+    assert ('lease_expires_at=' in compiled) == (payload['locktime'] is not None)
 
     assert result.login == 'user@example.com'
-    assert result.project_id == (project_obj.id if project_obj else None)
+    assert result.project_id == project_id
     assert result.env == payload['env']
     assert result.domain == payload['domain']
     assert result.locktime == payload['locktime']
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'user_exists, expected_exception',
+    [
+        pytest.param(False, exceptions.BotfarmUserNotExistsError),
+        pytest.param(True, exceptions.BotfarmProjectNotExistsError),
+    ],
+)
+async def test_update_user_not_updated(user_exists, expected_exception, make_mock_user):
+    class MockSession:
+        async def execute(self, stmt):
+            return MockResult([])
+
+        async def scalar(self, stmt):
+            return make_mock_user() if user_exists else None
+
+        async def rollback(self):
+            pass
+
+    request = schemas.UserUpdate(project_name='missing')
+
+    with pytest.raises(expected_exception):
+        await api.update_user(login='user@example.com', request=request, session=MockSession())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'quota_exhausted, expected_exception',
+    [
+        pytest.param(True, exceptions.BotfarmLockQuotaExceededError),
+        pytest.param(False, exceptions.BotfarmProjectNotExistsError),
+    ],
+)
+async def test_update_user_lock_skipped_by_quota(quota_exhausted, expected_exception, make_mock_user):
+    project_id = uuid.uuid4()
+
+    class MockSession:
+        async def execute(self, stmt):
+            return MockResult([])
+
+        async def scalar(self, stmt):
+            compiled = stmt.compile(dialect=postgresql.dialect())
+            if 'lock_quotas' in str(compiled):
+                assert project_id in compiled.params.values()
+                return quota_exhausted
+            return make_mock_user(project_id=project_id)
+
+        async def rollback(self):
+            pass
+
+    request = schemas.UserUpdate(locktime=datetime.now(timezone.utc))
+
+    with pytest.raises(expected_exception) as exc_info:
+        await api.update_user(login='user@example.com', request=request, session=MockSession())
+    assert type(exc_info.value) is expected_exception
+
+
 @pytest.mark.asyncio
 async def test_delete_user():
     calls = {'scalar': 0, 'delete': 0, 'commit': 0}
@@ -332,3 +709,308 @@ async def test_delete_user():
     assert calls['scalar'] == 1
     assert calls['delete'] == 1
     assert calls['commit'] == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'lock_exists, expected_exception',
+    [
+        pytest.param(True, None),
+        pytest.param(False, exceptions.BotfarmLockNotExistsError),
+    ],
+)
+async def test_release_lock(lock_exists, expected_exception, make_mock_user):
+    token = uuid.uuid4()
+
+    class MockSession:
+        def __init__(self):
+            self.statements = []
+            self.commit_count = 0
+            self.rollback_count = 0
+
+        async def scalar(self, stmt):
+            self.statements.append(stmt)
+            return make_mock_user() if lock_exists else None
+
+        async def commit(self):
+            self.commit_count += 1
+
+        async def rollback(self):
+            self.rollback_count += 1
+
+    mock_session = MockSession()
+
+    if expected_exception:
+        with pytest.raises(expected_exception):
+            await api.release_lock(token=token, session=mock_session)
+        assert mock_session.rollback_count == 1
+        return
+
+    result = await api.release_lock(token=token, session=mock_session)
+
+    assert len(mock_session.statements) == 1
+    assert token in mock_session.statements[0].compile().params.values()
+    assert mock_session.commit_count == 1
+    assert result.locktime is None
+
+
+@pytest.mark.asyncio
+async def test_release_owner_locks():
+    class MockSession:
+        def __init__(self):
+            self.statements = []
+            self.commit_count = 0
+
+        async def execute(self, stmt):
+            self.statements.append(stmt)
+            return types.SimpleNamespace(rowcount=500)
+
+        async def commit(self):
+            self.commit_count += 1
+
+    mock_session = MockSession()
+
+    result = await api.release_owner_locks(owner='run-1', session=mock_session)
+
+    assert len(mock_session.statements) == 1
+    assert 'run-1' in mock_session.statements[0].compile().params.values()
+    assert mock_session.commit_count == 1
+    assert result == schemas.LocksReleased(released=500)
+
+
+class MockBulkSession:
+    """Моковая сессия, которая отдает id пачками и считает изменения и коммиты"""
+
+    def __init__(self, ids, project_id=None, skipped=0):
+        self.ids = ids
+        self.project_id = project_id
+        self.skipped = skipped
+        self.selects = []
+        self.statements = []
+        self.commit_count = 0
+
+    async def scalar(self, stmt):
+        if 'count' in str(stmt):
+            return self.skipped
+        return self.project_id
+
+    async def scalars(self, stmt):
+        self.selects.append(str(stmt.compile(dialect=postgresql.dialect())))
+        limit = stmt._limit
+        offset = len(self.statements) * limit
+        return MockScalarResult(self.ids[offset:offset + limit])
+
+    async def execute(self, stmt):
+        self.statements.append(stmt)
+        return types.SimpleNamespace(rowcount=len(stmt.compile().params['id_1']))
+
+    async def commit(self):
+        self.commit_count += 1
+
+
+@pytest.mark.asyncio
+async def test_update_users_in_batches(monkeypatch):
+    monkeypatch.setattr(constants, 'BULK_BATCH_SIZE', 2)
+    project_id = uuid.uuid4()
+    mock_session = MockBulkSession([uuid.uuid4() for _ in range(3)], project_id=project_id)
+    request = schemas.UserBulkUpdate(
+        selector=schemas.UserSelector(project_name='proj', env=models.EnvType.stage, locked=False),
+        changes=schemas.UserUpdate(env=models.EnvType.preprod),
+    )
+
+    result = await api.update_users(request=request, session=mock_session)
+
+    assert result == schemas.UsersAffected(affected=3)
+    assert mock_session.commit_count == 2
+    assert 'users.id >' not in mock_session.selects[0]
+    assert 'users.id >' in mock_session.selects[1]
+    compiled = mock_session.statements[0].compile(dialect=postgresql.dialect())
+    assert str(compiled).startswith('UPDATE users SET env=')
+    assert 'users.locktime IS NULL' in str(compiled)
+    assert project_id in compiled.params.values()
+
+
+@pytest.mark.asyncio
+async def test_update_users_reports_locks_skipped_by_quota(monkeypatch):
+    monkeypatch.setattr(constants, 'BULK_BATCH_SIZE', 2)
+    mock_session = MockBulkSession([uuid.uuid4() for _ in range(3)], project_id=uuid.uuid4(), skipped=1)
+    request = schemas.UserBulkUpdate(
+        selector=schemas.UserSelector(project_name='proj'),
+        changes=schemas.UserUpdate(locktime=datetime.now(timezone.utc)),
+    )
+
+    result = await api.update_users(request=request, session=mock_session)
+
+    assert result == schemas.UsersAffected(affected=3, skipped=2)
+    assert mock_session.commit_count == 2
+    compiled = mock_session.statements[0].compile(dialect=postgresql.dialect())
+    assert compiled.params['lease_expires_at'] == request.changes.locktime + timedelta(
+        seconds=constants.LOCK_LEASE_SECONDS)
+
+
+@pytest.mark.asyncio
+async def test_delete_users_by_logins():
+    logins = ['a@example.com', 'b@example.com']
+    mock_session = MockBulkSession([uuid.uuid4()])
+
+    result = await api.delete_users(selector=schemas.UserSelector(logins=logins), session=mock_session)
+
+    assert result == schemas.UsersAffected(affected=1)
+    assert mock_session.commit_count == 1
+    compiled = mock_session.statements[0].compile(dialect=postgresql.dialect())
+    assert str(compiled).startswith('DELETE FROM users')
+    assert logins in compiled.params.values()
+
+
+def test_user_selector_requires_criteria():
+    with pytest.raises(ValueError):
+        schemas.UserSelector()
+
+
+@pytest.mark.asyncio
+async def test_get_users_next_page(make_mock_user):
+    created_at = datetime.now(timezone.utc)
+    last_id = uuid.uuid4()
+
+    class MockSession:
+        def __init__(self):
+            self.scalars_calls = []
+            self.scalar_calls = []
+
+        async def scalar(self, stmt):
+            self.scalar_calls.append(stmt)
+            return 7
+
+        async def scalars(self, stmt):
+            self.scalars_calls.append(stmt)
+            return MockScalarResult([make_mock_user()])
+
+    mock_session = MockSession()
+    response = await api.get_users(
+        limit=2,
+        project_name=None,
+        domain=None,
+        env=None,
+        cursor=utils.encode_cursor(created_at.isoformat(), str(last_id)),
+        total=True,
+        session=mock_session,
+    )
+
+    assert len(schemas.user_list_adapter.validate_json(response.body)) == 1
+    assert len(mock_session.scalar_calls) == 1
+    stmt = mock_session.scalars_calls[0]
+    assert '(users.created_at, users.id) >' in str(stmt)
+    assert created_at in stmt.compile().params.values()
+    assert api.NEXT_CURSOR_HEADER not in response.headers
+    assert response.headers[api.TOTAL_COUNT_HEADER] == '7'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'cursor',
+    [
+        pytest.param('not a cursor'),
+        pytest.param(utils.encode_cursor('yesterday', 'id')),
+        pytest.param(utils.encode_cursor('only-one')),
+    ],
+)
+async def test_get_users_invalid_cursor(cursor):
+    with pytest.raises(exceptions.BotfarmInvalidCursorError):
+        await api.get_users(
+            limit=2, project_name=None, domain=None, env=None,
+            cursor=cursor, total=False, session=object())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'data_format, expected_media_type',
+    [
+        pytest.param(schemas.DataFormat.ndjson, 'application/x-ndjson'),
+        pytest.param(schemas.DataFormat.csv, 'text/csv'),
+    ],
+)
+async def test_export_users(data_format, expected_media_type, monkeypatch, make_mock_user):
+    mock_users = [make_mock_user(login=f'u{i}@example.com') for i in range(3)]
+    statements = []
+
+    class MockStreamResult:
+        async def partitions(self):
+            yield mock_users[:2]
+            yield mock_users[2:]
+
+    class MockStreamSession:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, exc_type, exc, tb):
+            return
+
+        async def stream_scalars(self, stmt, execution_options):
+            statements.append(stmt)
+            assert execution_options['yield_per'] > 0
+            return MockStreamResult()
+
+    async def mock_get_read_sessionmaker():
+        return MockStreamSession
+
+    class MockSession:
+        def __init__(self):
+            self.rollback_count = 0
+
+        async def scalar(self, stmt):
+            return uuid.uuid4()
+
+        async def rollback(self):
+            self.rollback_count += 1
+
+    monkeypatch.setattr(db, 'get_read_sessionmaker', mock_get_read_sessionmaker)
+    mock_session = MockSession()
+
+    response = await api.export_users(
+        data_format=data_format, project_name='proj', domain=None, env=None, session=mock_session)
+    # Транзакция сессии запроса, в которой резолвился проект, закрыта еще до начала потока
+    assert mock_session.rollback_count == 1
+    body = b''.join([chunk async for chunk in response.body_iterator]).decode()
+
+    assert response.media_type == expected_media_type
+    assert len(statements) == 1
+    assert 'ORDER BY users.created_at, users.id' in str(statements[0])
+    if data_format == schemas.DataFormat.csv:
+        rows = list(csv.DictReader(io.StringIO(body)))
+        assert [row['login'] for row in rows] == [user.login for user in mock_users]
+        assert rows[0]['locktime'] == ''
+    else:
+        rows = [json.loads(line) for line in body.splitlines()]
+        assert [row['login'] for row in rows] == [user.login for user in mock_users]
+        assert 'password' not in rows[0]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('lock', [True, False])
+async def test_get_user_session_checks_replica_only_for_reads(lock, monkeypatch):
+    markers = {'primary': object(), 'read': object()}
+    read_sessionmaker_calls = []
+
+    async def mock_get_read_sessionmaker():
+        read_sessionmaker_calls.append(True)
+        return make_sessionmaker(markers['read'])
+
+    def make_sessionmaker(marker):
+        class MockSessionContext:
+            async def __aenter__(self):
+                return marker
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return MockSessionContext
+
+    monkeypatch.setattr(db, 'get_sessionmaker', lambda: make_sessionmaker(markers['primary']))
+    monkeypatch.setattr(db, 'get_read_sessionmaker', mock_get_read_sessionmaker)
+
+    sessions = api._get_user_session(lock=lock)
+    session = await anext(sessions)
+    await sessions.aclose()
+
+    assert session is markers['primary' if lock else 'read']
+    assert read_sessionmaker_calls == ([] if lock else [True])
@@ -1,7 +1,12 @@
+import math
+
 import asyncpg
 import pytest
+from sqlalchemy.ext import asyncio as sa_asyncio
+from sqlalchemy.util import greenlet_spawn
 
 from botfarm.components import db
+from botfarm.entities import db as entities_db
 from botfarm.entities import exceptions
 
 
@@ -43,6 +48,10 @@ class DummyEngine:
     def __init__(self) -> None:
         self.conn = DummyConn()
         self.connect_called = False
+        self.disposed = False
+
+    async def dispose(self) -> None:
+        self.disposed = True
 
     def connect(self) -> DummyConn:
         self.connect_called = True
@@ -73,39 +82,111 @@ async def test_is_db_exists(dummy_sessionmaker, exists):
 )
 @pytest.mark.asyncio
 async def test_ensure_db_exists(monkeypatch, default_db_exists, db_exists):
-    default_marker = object()
     target_marker = object()
     calls = []
 
     async def mock_is_db_exists(sessionmaker):
         calls.append(sessionmaker)
-        if sessionmaker is default_marker:
-            return default_db_exists
         if sessionmaker is target_marker:
             return db_exists
-        return False
+        return default_db_exists
 
     dummy_engine = DummyEngine()
+    created_engines = []
+
+    def mock_create_default_engine():
+        created_engines.append(dummy_engine)
+        return dummy_engine
 
     monkeypatch.setattr(db, 'is_db_exists', mock_is_db_exists)
-    monkeypatch.setattr(db, 'async_default_engine', dummy_engine)
-    monkeypatch.setattr(db, 'async_default_sessionmaker', default_marker)
-    monkeypatch.setattr(db, 'async_sessionmaker', target_marker)
+    monkeypatch.setattr(db, 'create_default_engine', mock_create_default_engine)
+    monkeypatch.setattr(db, 'get_sessionmaker', lambda: target_marker)
+
+    if db_exists:
+        await db.ensure_db_exists()
+        assert calls == [target_marker]
+        assert created_engines == []
+        return
 
-    should_raise = not default_db_exists and not db_exists
-    if should_raise:
+    if not default_db_exists:
         with pytest.raises(exceptions.BotfarmDBError):
             await db.ensure_db_exists()
         assert dummy_engine.connect_called == False
-        assert len(calls) == 2
-        return
-
-    await db.ensure_db_exists()
-
-    assert len(calls) == 2
-    if default_db_exists and not db_exists:
+    else:
+        await db.ensure_db_exists()
         assert dummy_engine.connect_called == True
         assert dummy_engine.conn.execution_options_called == True
         assert dummy_engine.conn.executed_statement is not None
+    assert len(calls) == 2
+    assert dummy_engine.disposed == True
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'replica_configured, lag, expected',
+    [
+        pytest.param(False, None, 'primary'),
+        pytest.param(True, 0.5, 'replica'),
+        pytest.param(True, 10.0, 'primary'),
+        pytest.param(True, None, 'primary'),
+    ],
+)
+async def test_get_read_sessionmaker(monkeypatch, replica_configured, lag, expected):
+    markers = {'primary': object(), 'replica': object()}
+    settings = entities_db.DBReplicaSettings(
+        credentials=entities_db.DBCredentials(user='u', password='p', host='replica', port='1', name='n'),
+        max_lag_seconds=5,
+        lag_check_interval_seconds=60,
+    )
+    measurements = []
+
+    async def mock_measure_replica_lag(sessionmaker):
+        measurements.append(sessionmaker)
+        return lag
+
+    monkeypatch.setattr(db.db, 'get_db_replica_settings', lambda: settings if replica_configured else None)
+    monkeypatch.setattr(db, 'get_sessionmaker', lambda: markers['primary'])
+    monkeypatch.setattr(db, '_replica_sessionmaker', markers['replica'])
+    monkeypatch.setattr(db, '_replica_lag', None)
+    monkeypatch.setattr(db, '_replica_lag_checked_at', -math.inf)
+    monkeypatch.setattr(db, '_measure_replica_lag', mock_measure_replica_lag)
+
+    assert await db.get_read_sessionmaker() is markers[expected]
+    assert await db.get_read_sessionmaker() is markers[expected]
+    assert measurements == ([markers['replica']] if replica_configured else [])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('cache_size', [0, 500])
+async def test_engine_passes_statement_cache_size_to_dialect(monkeypatch, cache_size):
+    credentials = entities_db.DBCredentials(
+        user='u', password='p', host='host', port='1', name='n', statement_cache_size=cache_size)
+    engine = sa_asyncio.create_async_engine(credentials.url, **credentials.engine_options)
+    connect_kwargs = {}
+
+    async def mock_connect(*args, **kwargs):
+        connect_kwargs.update(kwargs)
+        return object()
+
+    monkeypatch.setattr(asyncpg, 'connect', mock_connect)
+
+    connection = await greenlet_spawn(engine.sync_engine.pool._creator)
+
+    assert connect_kwargs['statement_cache_size'] == cache_size
+    if cache_size:
+        assert connection._prepared_statement_cache.capacity == cache_size
     else:
-        assert dummy_engine.connect_called == False
+        assert connection._prepared_statement_cache is None
+
+
+def test_replica_engine_uses_timed_pool(monkeypatch):
+    settings = entities_db.DBReplicaSettings(
+        credentials=entities_db.DBCredentials(user='u', password='p', host='replica', port='1', name='n'))
+    monkeypatch.setattr(db.db, 'get_db_replica_settings', lambda: settings)
+    monkeypatch.setattr(db, '_replica_engine', None)
+    monkeypatch.setattr(db, '_replica_sessionmaker', None)
+
+    db.get_replica_sessionmaker()
+
+    assert isinstance(db._replica_engine.pool, db.ReplicaTimedQueuePool)
+    assert db._replica_engine.pool.target == 'replica'
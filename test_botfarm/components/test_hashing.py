@@ -0,0 +1,61 @@
+import pytest
+
+from botfarm.components import hashing, utils
+from botfarm.entities import hashing as hashing_entities
+
+FAST_SETTINGS = {
+    hashing_entities.HashAlgorithm.scrypt: hashing_entities.HashingSettings(
+        algorithm=hashing_entities.HashAlgorithm.scrypt, scrypt_n=2 ** 4),
+    hashing_entities.HashAlgorithm.pbkdf2_sha256: hashing_entities.HashingSettings(
+        algorithm=hashing_entities.HashAlgorithm.pbkdf2_sha256, pbkdf2_iterations=10),
+    hashing_entities.HashAlgorithm.sha256: hashing_entities.HashingSettings(
+        algorithm=hashing_entities.HashAlgorithm.sha256),
+}
+
+
+@pytest.mark.parametrize('algorithm', list(hashing_entities.HashAlgorithm))
+def test_hash_and_verify(algorithm):
+    settings = FAST_SETTINGS[algorithm]
+    encoded = hashing.hash_password_sync('secret', settings)
+
+    assert hashing.verify_password_sync('secret', encoded)
+    assert not hashing.verify_password_sync('wrong', encoded)
+    assert not hashing.needs_rehash(encoded, settings)
+
+
+def test_hash_uses_random_salt():
+    settings = FAST_SETTINGS[hashing_entities.HashAlgorithm.scrypt]
+
+    assert hashing.hash_password_sync('secret', settings) != hashing.hash_password_sync('secret', settings)
+
+
+def test_verify_legacy_sha256():
+    encoded = utils.hash_password('secret')
+
+    assert hashing.verify_password_sync('secret', encoded)
+    assert hashing.needs_rehash(encoded, FAST_SETTINGS[hashing_entities.HashAlgorithm.scrypt])
+
+
+@pytest.mark.parametrize('encoded', ['scrypt$broken', 'unknown$1$c2FsdA==$aGFzaA=='])
+def test_verify_malformed_hash(encoded):
+    assert not hashing.verify_password_sync('secret', encoded)
+
+
+def test_needs_rehash_on_changed_params():
+    encoded = hashing.hash_password_sync('secret', FAST_SETTINGS[hashing_entities.HashAlgorithm.pbkdf2_sha256])
+    settings = hashing_entities.HashingSettings(
+        algorithm=hashing_entities.HashAlgorithm.pbkdf2_sha256, pbkdf2_iterations=20)
+
+    assert hashing.needs_rehash(encoded, settings)
+
+
+@pytest.mark.asyncio
+async def test_hash_passwords_keeps_order(monkeypatch):
+    monkeypatch.setattr(
+        hashing.hashing, 'get_hashing_settings', lambda: FAST_SETTINGS[hashing_entities.HashAlgorithm.scrypt])
+    passwords = [f'password-{i}' for i in range(5)]
+
+    encoded = await hashing.hash_passwords(passwords)
+
+    assert [await hashing.verify_password(p, e) for p, e in zip(passwords, encoded)] == [True] * 5
+    hashing.shutdown()
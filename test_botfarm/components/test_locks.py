@@ -0,0 +1,261 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+import sqlalchemy as sa
+
+from botfarm.components import events, locks
+from botfarm.entities import exceptions, models
+from botfarm.entities import locks as lock_entities
+from test_botfarm.conftest import MockScalarResult
+
+CANDIDATES = sa.select(models.User.id)
+
+
+class MockConnection:
+    """Мок выделенного подключения, который держит advisory locks в множестве held"""
+
+    def __init__(self, busy=(), guard_busy=False):
+        self.busy = set(busy)
+        self.guard_busy = guard_busy
+        self.held = set()
+        self.statements = []
+        self.invalidated = False
+        self.closed = False
+
+    async def execution_options(self, **options):
+        return self
+
+    async def execute(self, statement, parameters):
+        self.statements.append((str(statement), parameters))
+        if 'pg_try_advisory_lock(:classid, 0)' in str(statement):
+            assert parameters == {'classid': locks.PROCESS_GUARD_CLASSID}
+            return MockResult([not self.guard_busy])
+        if 'pg_locks' in str(statement):
+            key = parameters['classid'] << 32 | parameters['objid']
+            return MockResult([any(held & 0xFFFF_FFFF_FFFF_FFFF == key for held in self.held | self.busy)])
+        keys = parameters['keys']
+        if 'pg_try_advisory_lock' in str(statement):
+            taken = [key for key in keys if key not in self.busy and key not in self.held]
+            self.held.update(taken)
+            return MockResult(taken)
+        self.held.difference_update(keys)
+        return MockResult([True] * len(keys))
+
+    async def close(self):
+        self.closed = True
+
+
+class MockResult:
+    def __init__(self, items):
+        self._items = items
+
+    def scalars(self):
+        return MockScalarResult(self._items)
+
+    def scalar(self):
+        return self._items[0]
+
+
+class MockSession:
+    def __init__(self, users=()):
+        self.users = list(users)
+
+    async def scalar(self, statement):
+        return self.users[0] if self.users else None
+
+    async def scalars(self, statement):
+        # Первая пачка отдает всех кандидатов, следующая - пустая
+        batch, self.users = self.users, []
+        return MockScalarResult(batch)
+
+    async def rollback(self):
+        pass
+
+
+def make_backend(connection, connections=1):
+    async def connect():
+        return connection
+
+    class MockEngine:
+        pass
+
+    engine = MockEngine()
+    engine.connect = connect
+    return locks.AdvisoryLockBackend(get_engine=lambda: engine, connections=connections)
+
+
+def test_incomplete_backend_fails_on_creation():
+    class IncompleteBackend(locks.LockBackend):
+        async def acquire(self, login, session, lease, owner):
+            pass
+
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+
+
+def test_advisory_key():
+    user_id = uuid.UUID('ffffffff-ffff-ffff-0000-000000000000')
+
+    assert locks.advisory_key(user_id) == -1
+    assert locks.advisory_key(user_id) == locks.advisory_key(uuid.UUID(str(user_id)))
+    assert -2 ** 63 <= locks.advisory_key(uuid.uuid4()) < 2 ** 63
+
+
+@pytest.mark.asyncio
+async def test_advisory_acquire_is_not_reentrant(make_mock_user):
+    user = make_mock_user()
+    connection = MockConnection()
+    backend = make_backend(connection)
+
+    locked = await backend.acquire(user.login, MockSession([user]), lease=60, owner='ci')
+    with pytest.raises(exceptions.BotfarmUserLockedError):
+        await backend.acquire(user.login, MockSession([user]), lease=60, owner='ci')
+
+    assert locked.owner == 'ci'
+    assert locked.lease_token is not None
+    assert len(connection.statements) == 2
+    assert 'pg_try_advisory_lock(:classid, 0)' in connection.statements[0][0]
+    assert await backend.is_locked(user, MockSession())
+
+
+@pytest.mark.asyncio
+async def test_advisory_acquire_missing_user():
+    backend = make_backend(MockConnection())
+
+    with pytest.raises(exceptions.BotfarmUserNotExistsError):
+        await backend.acquire('missing@example.com', MockSession(), lease=60, owner=None)
+
+
+@pytest.mark.asyncio
+async def test_advisory_checkout_skips_busy_and_unlocks_extra(make_mock_user):
+    candidates = [make_mock_user(login=f'user{i}@example.com') for i in range(4)]
+    connection = MockConnection(busy={locks.advisory_key(candidates[0].id)})
+    backend = make_backend(connection)
+
+    locked = await backend.checkout(
+        CANDIDATES, 2, MockSession(candidates), all_or_nothing=False, lease=60, owner=None)
+
+    assert [user.login for user in locked] == ['user1@example.com', 'user2@example.com']
+    assert connection.held == {locks.advisory_key(user.id) for user in locked}
+    assert 'pg_notify' not in connection.statements[-1][0]
+
+
+@pytest.mark.asyncio
+async def test_advisory_checkout_all_or_nothing(make_mock_user):
+    candidates = [make_mock_user(login=f'user{i}@example.com') for i in range(2)]
+    connection = MockConnection(busy={locks.advisory_key(candidates[0].id)})
+    backend = make_backend(connection)
+
+    with pytest.raises(exceptions.BotfarmNotEnoughFreeUsersError):
+        await backend.checkout(CANDIDATES, 2, MockSession(candidates), all_or_nothing=True, lease=60, owner=None)
+
+    assert connection.held == set()
+    assert not await backend.is_locked(candidates[1], MockSession())
+
+
+@pytest.mark.asyncio
+async def test_advisory_release_by_token_notifies(make_mock_user):
+    user = make_mock_user()
+    connection = MockConnection()
+    backend = make_backend(connection)
+    locked = await backend.acquire(user.login, MockSession([user]), lease=60, owner=None)
+
+    released = await backend.release_by_token(locked.lease_token, MockSession())
+    with pytest.raises(exceptions.BotfarmLockNotExistsError):
+        await backend.release_by_token(locked.lease_token, MockSession())
+
+    statement, parameters = connection.statements[-1]
+    assert 'pg_notify' in statement
+    assert parameters['channel'] == events.USERS_CHANNEL
+    assert json.loads(parameters['payloads'][0]) == {
+        'event': 'release', 'login': user.login, 'project_id': None, 'env': 'prod', 'domain': 'regular',
+        'owner': None}
+    assert released.locktime is None
+    assert connection.held == set()
+
+
+@pytest.mark.asyncio
+async def test_advisory_release_owner_and_expired(make_mock_user):
+    backend = make_backend(MockConnection())
+    for i, owner in enumerate(['ci', 'ci', 'dev']):
+        user = make_mock_user(login=f'user{i}@example.com')
+        await backend.acquire(user.login, MockSession([user]), lease=0 if owner == 'dev' else 60, owner=owner)
+
+    assert await backend.release_owner('ci', MockSession()) == 2
+    assert await backend.release_expired(MockSession()) == 1
+    assert await backend.release_expired(MockSession()) == 0
+
+
+@pytest.mark.asyncio
+async def test_advisory_close_forgets_locks(make_mock_user):
+    user = make_mock_user()
+    connection = MockConnection()
+    backend = make_backend(connection)
+    await backend.acquire(user.login, MockSession([user]), lease=60, owner=None)
+
+    await backend.close()
+
+    assert connection.closed
+    with pytest.raises(exceptions.BotfarmUserNotLockedError):
+        await backend.extend(user.login, MockSession([user]), lease=60, token=None)
+
+
+@pytest.mark.asyncio
+async def test_advisory_connections_lock_in_parallel(make_mock_user):
+    users = [make_mock_user(login=f'user{i}@example.com') for i in range(20)]
+    slow, fast = (
+        next(user for user in users if locks.advisory_key(user.id) % 2 == index) for index in range(2))
+    started = asyncio.Event()
+    resume = asyncio.Event()
+
+    class SlowConnection(MockConnection):
+        async def execute(self, statement, parameters):
+            if locks.advisory_key(slow.id) in parameters.get('keys', ()):
+                started.set()
+                await resume.wait()
+            return await super().execute(statement, parameters)
+
+    connection = SlowConnection()
+    backend = make_backend(connection, connections=2)
+
+    slow_lock = asyncio.create_task(backend.acquire(slow.login, MockSession([slow]), lease=60, owner=None))
+    await started.wait()
+    fast_locked = await asyncio.wait_for(backend.acquire(fast.login, MockSession([fast]), lease=60, owner=None), 1)
+    resume.set()
+    slow_locked = await slow_lock
+
+    assert {fast_locked.login, slow_locked.login} == {fast.login, slow.login}
+    assert connection.held == {locks.advisory_key(slow.id), locks.advisory_key(fast.id)}
+
+
+@pytest.mark.asyncio
+async def test_advisory_is_locked_ignores_caller_session(make_mock_user):
+    user = make_mock_user()
+    backend = make_backend(MockConnection(busy={locks.advisory_key(user.id)}), connections=4)
+
+    class ReplicaSession:
+        async def scalar(self, statement, parameters=None):
+            raise AssertionError('pg_locks реплики не видит advisory locks основной БД')
+
+    assert await backend.is_locked(user, ReplicaSession())
+
+
+@pytest.mark.asyncio
+async def test_advisory_backend_refuses_second_process():
+    connection = MockConnection(guard_busy=True)
+    backend = make_backend(connection, connections=2)
+
+    with pytest.raises(exceptions.BotfarmLockBackendBusyError):
+        await backend.start()
+
+    assert connection.closed
+
+
+def test_lock_settings_from_env():
+    assert lock_entities.LockSettings.from_env({}).backend == lock_entities.LockBackendType.column
+    settings = lock_entities.LockSettings.from_env({'LOCK_BACKEND': 'advisory'})
+
+    assert settings.backend == lock_entities.LockBackendType.advisory
+    assert lock_entities.LockSettings.from_env({'LOCK_ADVISORY_CONNECTIONS': '8'}).advisory_connections == 8
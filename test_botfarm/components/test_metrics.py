@@ -0,0 +1,97 @@
+import contextlib
+
+import fastapi
+import pytest
+
+from botfarm.components import exceptions as exception_handlers
+from botfarm.components import metrics
+from botfarm.entities import exceptions
+
+
+def test_counter_render():
+    counter = metrics.Counter('test_total', 'Тестовый счетчик', ('result',))
+    counter.inc(result='ok')
+    counter.inc(2, result='ok')
+    counter.inc(result='fail "quoted"')
+
+    assert counter.render() == (
+        '# HELP test_total Тестовый счетчик\n'
+        '# TYPE test_total counter\n'
+        'test_total{result="ok"} 3\n'
+        'test_total{result="fail \\"quoted\\""} 1\n'
+    )
+
+
+def test_counter_rejects_wrong_labels():
+    counter = metrics.Counter('test_total', 'Тестовый счетчик', ('result',))
+
+    with pytest.raises(ValueError):
+        counter.inc(other='x')
+
+
+def test_metric_without_samples_fails_on_creation():
+    class IncompleteMetric(metrics._Metric):
+        kind = 'gauge'
+
+    with pytest.raises(TypeError):
+        IncompleteMetric('test_incomplete', 'Метрика без значений')
+
+
+def test_histogram_render_is_cumulative():
+    histogram = metrics.Histogram('test_seconds', 'Тестовая гистограмма', buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert histogram.render().splitlines()[2:] == [
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        'test_seconds_sum 5.55',
+        'test_seconds_count 3',
+    ]
+
+
+def _make_request(app: fastapi.FastAPI, path: str, stack: contextlib.AsyncExitStack) -> fastapi.Request:
+    return fastapi.Request({
+        'fastapi_middleware_astack': stack,
+        'fastapi_inner_astack': stack,
+        'fastapi_function_astack': stack,
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'path_params': {'login': path.rsplit('/', 1)[-1]},
+        'query_string': b'',
+        'headers': [],
+        'app': app,
+    })
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'locked, expected_status',
+    [
+        pytest.param(False, '200'),
+        pytest.param(True, '423'),
+    ],
+)
+async def test_metrics_route_observes_status(locked, expected_status):
+    app = fastapi.FastAPI()
+    app.add_exception_handler(exceptions.BotfarmUserLockedError, exception_handlers.handle_user_locked_error)
+    router = fastapi.APIRouter(route_class=metrics.MetricsRoute)
+    path = f'/test/{expected_status}/{{login}}'
+
+    @router.get(path)
+    async def endpoint(login: str) -> dict:
+        assert metrics.HTTP_REQUESTS_IN_PROGRESS.value(method='GET', route=path) == 1
+        if locked:
+            raise exceptions.BotfarmUserLockedError
+        return {'login': login}
+
+    handler = router.routes[0].get_route_handler()
+    async with contextlib.AsyncExitStack() as stack:
+        response = await handler(_make_request(app, f'/test/{expected_status}/user', stack))
+
+    assert response.status_code == int(expected_status)
+    assert metrics.HTTP_REQUESTS_IN_PROGRESS.value(method='GET', route=path) == 0
+    assert metrics.HTTP_REQUEST_DURATION.count(method='GET', route=path, status=expected_status) == 1
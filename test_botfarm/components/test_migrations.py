@@ -0,0 +1,161 @@
+import pytest
+
+from botfarm.components import migrations
+from botfarm.entities import constants, exceptions, models
+from botfarm.entities import migrations as migration_entities
+
+
+class DummyResult:
+    def __init__(self, items) -> None:
+        self._items = items
+
+    def all(self):
+        return self._items
+
+
+class DummyConn:
+    def __init__(self, engine: 'DummyEngine', autocommit: bool = False) -> None:
+        self.engine = engine
+        self.autocommit = autocommit
+
+    async def execution_options(self, isolation_level) -> 'DummyConn':
+        self.autocommit = isolation_level == 'AUTOCOMMIT'
+        return self
+
+    async def execute(self, statement, parameters=None) -> None:
+        self.engine.executed.append((str(statement).strip(), self.autocommit))
+
+    async def scalar(self, statement, parameters=None) -> str | bool | None:
+        if 'pg_try_advisory_lock' in str(statement):
+            self.engine.executed.append((str(statement).strip(), self.autocommit))
+            self.engine.lock_polls += 1
+            return self.engine.lock_polls > self.engine.busy_polls
+        if 'indisvalid' in str(statement):
+            return parameters['name'] in self.engine.invalid_indexes
+        return self.engine.fingerprint
+
+    async def scalars(self, statement) -> DummyResult:
+        return DummyResult(list(self.engine.applied))
+
+    async def __aenter__(self) -> 'DummyConn':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        return
+
+
+class DummyEngine:
+    def __init__(self, applied, fingerprint=None, invalid_indexes=(), busy_polls=0) -> None:
+        self.applied = applied
+        self.fingerprint = fingerprint
+        self.invalid_indexes = set(invalid_indexes)
+        self.busy_polls = busy_polls
+        self.lock_polls = 0
+        self.executed = []
+
+    def connect(self) -> DummyConn:
+        return DummyConn(self)
+
+    def begin(self) -> DummyConn:
+        return DummyConn(self)
+
+
+def test_migration_versions_are_unique_and_ordered():
+    versions = [migration.version for migration in migration_entities.MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+
+def test_migrations_cover_model_columns():
+    sql = '\n'.join(
+        statement for migration in migration_entities.MIGRATIONS for statement in migration.statements)
+    for table in models.Base.metadata.sorted_tables:
+        for column in table.columns:
+            assert column.name in sql, f'{table.name}.{column.name} не создается миграциями'
+        for index in table.indexes:
+            assert index.name in sql, f'{index.name} не создается миграциями'
+
+
+def test_lease_backfill_uses_default_lease():
+    migration = next(
+        migration for migration in migration_entities.MIGRATIONS if migration.name == 'lease expiration backfill')
+    statement, = migration.statements
+
+    assert f"locktime + interval '{constants.LOCK_LEASE_SECONDS} seconds'" in statement
+    assert 'WHERE locktime IS NOT NULL AND lease_expires_at IS NULL' in statement
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'applied',
+    [
+        pytest.param(set()),
+        pytest.param({1, 2}),
+        pytest.param({migration.version for migration in migration_entities.MIGRATIONS}),
+    ],
+)
+async def test_upgrade_applies_pending_migrations(applied):
+    engine = DummyEngine(applied)
+
+    result = await migrations.upgrade(engine)
+
+    expected = [migration for migration in migration_entities.MIGRATIONS if migration.version not in applied]
+    assert result == [migration.version for migration in expected]
+    statements = [statement for statement, _ in engine.executed]
+    lock_index = next(i for i, statement in enumerate(statements) if 'pg_try_advisory_lock' in statement)
+    assert 'SET lock_timeout = 0' in statements[:lock_index]
+    assert 'pg_advisory_unlock' in statements[-3]
+    assert statements[-2:] == ['RESET statement_timeout', 'RESET lock_timeout']
+    assert migration_entities.get_schema_fingerprint() in statements[-4]
+    recorded = [statement for statement in statements if statement.startswith('INSERT INTO')]
+    assert len(recorded) == len(expected)
+    for statement, autocommit in engine.executed:
+        if 'CONCURRENTLY' in statement:
+            assert autocommit
+
+
+@pytest.mark.asyncio
+async def test_upgrade_skips_when_fingerprint_matches():
+    engine = DummyEngine(set(), fingerprint=migration_entities.get_schema_fingerprint())
+
+    assert await migrations.upgrade(engine) == []
+    assert engine.executed == []
+
+
+@pytest.mark.asyncio
+async def test_upgrade_rebuilds_invalid_concurrent_indexes():
+    applied = {migration.version for migration in migration_entities.MIGRATIONS if migration.version != 4}
+    engine = DummyEngine(applied, invalid_indexes={'ix_users_lease_token'})
+
+    await migrations.upgrade(engine)
+
+    statements = [statement for statement, _ in engine.executed]
+    drop = statements.index('DROP INDEX CONCURRENTLY IF EXISTS ix_users_lease_token')
+    assert statements[drop + 1].startswith('CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_users_lease_token')
+    assert sum(statement.startswith('DROP INDEX') for statement in statements) == 1
+
+
+@pytest.mark.asyncio
+async def test_upgrade_polls_for_migrations_lock(monkeypatch):
+    monkeypatch.setattr(migration_entities, 'MIGRATIONS_LOCK_POLL_SECONDS', 0)
+    engine = DummyEngine({migration.version for migration in migration_entities.MIGRATIONS}, busy_polls=2)
+
+    await migrations.upgrade(engine)
+
+    # Пока блокировку держит другой процесс, ожидание не держит открытым ни одного запроса
+    statements = [statement for statement, _ in engine.executed]
+    assert sum('pg_try_advisory_lock' in statement for statement in statements) == 3
+    assert not any('pg_advisory_lock' in statement for statement in statements)
+
+
+@pytest.mark.asyncio
+async def test_upgrade_gives_up_waiting_for_migrations_lock(monkeypatch):
+    monkeypatch.setattr(migration_entities, 'MIGRATIONS_LOCK_POLL_SECONDS', 0)
+    monkeypatch.setattr(migration_entities, 'MIGRATIONS_LOCK_WAIT_SECONDS', 0)
+    engine = DummyEngine(set(), busy_polls=1)
+
+    with pytest.raises(exceptions.BotfarmMigrationLockTimeoutError):
+        await migrations.upgrade(engine)
+
+    statements = [statement for statement, _ in engine.executed]
+    assert not any('pg_advisory_unlock' in statement for statement in statements)
+    assert statements[-2:] == ['RESET statement_timeout', 'RESET lock_timeout']
@@ -0,0 +1,103 @@
+import types
+import uuid
+
+import pytest
+
+from botfarm.components import projects
+from botfarm.entities import exceptions, schemas
+
+
+def test_cache_get_and_put():
+    cache = projects.ProjectCache(maxsize=2, ttl=60)
+    project_id = uuid.uuid4()
+
+    assert cache.get_id('proj') is None
+    cache.put(project_id, 'proj', cache.version)
+
+    assert cache.get_id('proj') == project_id
+    assert cache.get_name(project_id) == 'proj'
+
+
+def test_cache_evicts_least_recently_used():
+    cache = projects.ProjectCache(maxsize=2, ttl=60)
+    ids = [uuid.uuid4() for _ in range(3)]
+    cache.put(ids[0], 'p0', cache.version)
+    cache.put(ids[1], 'p1', cache.version)
+    cache.get_id('p0')
+    cache.put(ids[2], 'p2', cache.version)
+
+    assert cache.get_id('p0') == ids[0]
+    assert cache.get_id('p1') is None
+    assert cache.get_name(ids[1]) is None
+    assert cache.get_id('p2') == ids[2]
+
+
+def test_cache_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(projects.time, 'monotonic', lambda: now[0])
+    cache = projects.ProjectCache(maxsize=2, ttl=10)
+    cache.put(uuid.uuid4(), 'proj', cache.version)
+
+    now[0] += 11
+
+    assert cache.get_id('proj') is None
+
+
+def test_cache_ignores_reads_started_before_invalidation():
+    cache = projects.ProjectCache(maxsize=2, ttl=60)
+    version = cache.version
+    cache.invalidate()
+    cache.put(uuid.uuid4(), 'proj', version)
+
+    assert cache.get_id('proj') is None
+
+
+@pytest.mark.asyncio
+async def test_get_project_id_uses_cache():
+    project_id = uuid.uuid4()
+
+    class MockSession:
+        def __init__(self):
+            self.scalar_calls = 0
+
+        async def scalar(self, stmt):
+            self.scalar_calls += 1
+            return project_id
+
+    mock_session = MockSession()
+
+    assert await projects.get_project_id('proj', session=mock_session) == project_id
+    assert await projects.get_project_id('proj', session=mock_session) == project_id
+    assert await projects.get_project_name(project_id, session=mock_session) == 'proj'
+    assert mock_session.scalar_calls == 1
+
+
+@pytest.mark.asyncio
+async def test_get_project_id_missing():
+    class MockSession:
+        async def scalar(self, stmt):
+            return None
+
+    with pytest.raises(exceptions.BotfarmProjectNotExistsError):
+        await projects.get_project_id('proj', session=MockSession())
+    assert projects.cache.get_id('proj') is None
+
+
+@pytest.mark.asyncio
+async def test_update_project_invalidates_cache():
+    project = types.SimpleNamespace(id=uuid.uuid4(), name='old')
+    projects.cache.put(project.id, 'old', projects.cache.version)
+
+    class MockSession:
+        async def scalar(self, stmt):
+            return project
+
+        async def commit(self):
+            pass
+
+        async def refresh(self, obj):
+            pass
+
+    await projects.update_project('old', schemas.ProjectUpdate(name='new'), session=MockSession())
+
+    assert projects.cache.get_id('old') is None
@@ -0,0 +1,84 @@
+import types
+import uuid
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from botfarm.components import projects, quotas
+from botfarm.entities import migrations, models, schemas
+
+
+@pytest.fixture
+def project_id(monkeypatch):
+    project_id = uuid.uuid4()
+
+    async def mock_get_project_id(name, session):
+        return project_id
+
+    monkeypatch.setattr(projects, 'get_project_id', mock_get_project_id)
+    return project_id
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'env, conflict_target',
+    [
+        pytest.param(None, 'ON CONFLICT (project_id) WHERE env IS NULL'),
+        pytest.param(models.EnvType.prod, 'ON CONFLICT (project_id, env) WHERE env IS NOT NULL'),
+    ],
+)
+async def test_set_quota(env, conflict_target, project_id):
+    class MockSession:
+        def __init__(self):
+            self.statements = []
+            self.commit_count = 0
+
+        async def execute(self, stmt):
+            self.statements.append(str(stmt))
+
+        async def scalar(self, stmt):
+            self.statements.append(str(stmt.compile(dialect=postgresql.dialect())))
+            return types.SimpleNamespace(env=env, max_locked=5, locked=2)
+
+        async def commit(self):
+            self.commit_count += 1
+
+    mock_session = MockSession()
+
+    result = await quotas.set_quota('proj', schemas.LockQuotaUpdate(max_locked=5, env=env), session=mock_session)
+
+    lock_table, upsert = mock_session.statements
+    assert lock_table == 'LOCK TABLE users IN SHARE MODE'
+    assert conflict_target in upsert
+    assert 'DO UPDATE SET max_locked = excluded.max_locked' in upsert
+    assert ('users.env =' in upsert) == (env is not None)
+    assert mock_session.commit_count == 1
+    assert result == schemas.LockQuota(env=env, max_locked=5, locked=2)
+
+
+@pytest.mark.asyncio
+async def test_is_exhausted_without_project_skips_query():
+    assert not await quotas.is_exhausted(None, None, session=object())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('env', [None, models.EnvType.stage])
+async def test_is_exhausted(env, project_id):
+    class MockSession:
+        async def scalar(self, stmt):
+            compiled = str(stmt.compile(dialect=postgresql.dialect()))
+            assert 'lock_quotas.locked >= lock_quotas.max_locked' in compiled
+            assert ('lock_quotas.env IS NULL OR lock_quotas.env =' in compiled) == (env is not None)
+            # Без окружения учитывается только лимит всего проекта, а не лимит любого окружения
+            assert 'lock_quotas.env IS NULL' in compiled
+            return True
+
+    assert await quotas.is_exhausted('proj', env, session=MockSession())
+
+
+def test_quota_trigger_skips_only_new_locks():
+    migration = next(migration for migration in migrations.MIGRATIONS if migration.name == 'lock quotas')
+    function = next(statement for statement in migration.statements if 'botfarm_count_quota_locks()' in statement)
+
+    assert 'IF exceeded > 0 AND NOT was_locked THEN' in function
+    assert 'RETURN NULL' in function
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from botfarm.components import projects, streams
+from botfarm.entities import constants, models
+
+
+def make_event(event='lock', project_id=None, env='prod', domain='regular'):
+    return {
+        'event': event,
+        'login': 'user@example.com',
+        'project_id': str(project_id) if project_id else None,
+        'env': env,
+        'domain': domain,
+        'owner': None,
+    }
+
+
+@pytest.mark.asyncio
+async def test_publish_fans_out_by_filters():
+    hub = streams.Hub()
+    with hub.subscribe() as everything, hub.subscribe(env=models.EnvType.stage) as stage:
+        hub.publish(make_event('lock'))
+        hub.publish(make_event('release', env='stage'))
+        hub.publish(make_event('unknown'))
+
+        assert (await everything.get(0.1))['event'] == 'lock'
+        assert (await everything.get(0.1))['event'] == 'release'
+        assert await everything.get(0.01) is None
+        assert (await stage.get(0.1))['event'] == 'release'
+        assert await stage.get(0.01) is None
+    assert len(hub) == 0
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_gets_dropped_count():
+    hub = streams.Hub()
+    with hub.subscribe(buffer_size=2) as subscriber:
+        for event in ('lock', 'release', 'create', 'delete', 'lock'):
+            hub.publish(make_event(event))
+
+        received = [(await subscriber.get(0.1))['event'] for _ in range(3)]
+        hub.publish(make_event('release'))
+
+        assert received == ['lock', 'release', 'dropped']
+        assert (await subscriber.get(0.1))['event'] == 'release'
+
+
+@pytest.mark.asyncio
+async def test_watch_users_streams_sse(monkeypatch):
+    project_id = uuid.uuid4()
+    hub = streams.Hub()
+
+    class MockSession:
+        rolled_back = False
+
+        async def rollback(self):
+            self.rolled_back = True
+
+    async def mock_get_project_id(name, session):
+        assert name == 'proj'
+        return project_id
+
+    monkeypatch.setattr(streams, 'hub', hub)
+    monkeypatch.setattr(projects, 'get_project_id', mock_get_project_id)
+    monkeypatch.setattr(constants, 'EVENTS_KEEPALIVE_SECONDS', 0.01)
+    session = MockSession()
+
+    body = await streams.watch_users(session, project_name='proj')
+    assert session.rolled_back
+    assert await anext(body) == b': connected\n\n'
+    assert len(hub) == 1
+
+    hub.publish(make_event('lock', project_id=uuid.uuid4()))
+    assert await anext(body) == b': keepalive\n\n'
+    hub.publish(make_event('lock', project_id=project_id))
+    message = (await asyncio.wait_for(anext(body), 1)).decode()
+
+    event_line, data_line, *_ = message.split('\n')
+    assert event_line == 'event: lock'
+    assert json.loads(data_line.removeprefix('data: '))['project_id'] == str(project_id)
+
+    await body.aclose()
+    assert len(hub) == 0
@@ -0,0 +1,253 @@
+import asyncio
+import types
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from botfarm.components import hashing, users, waiters
+from botfarm.entities import constants, exceptions, schemas
+from test_botfarm.conftest import MockResult, MockScalarResult
+
+
+@pytest.mark.asyncio
+async def test_release_expired_locks():
+    class MockSession:
+        def __init__(self):
+            self.statements = []
+            self.commit_count = 0
+
+        async def execute(self, stmt):
+            self.statements.append(stmt)
+            return types.SimpleNamespace(rowcount=3)
+
+        async def commit(self):
+            self.commit_count += 1
+
+    mock_session = MockSession()
+
+    assert await users.release_expired_locks(mock_session) == 3
+    assert len(mock_session.statements) == 1
+    assert mock_session.commit_count == 1
+    compiled = str(mock_session.statements[0])
+    assert 'lease_expires_at <= now()' in compiled
+    assert 'locktime=:locktime' in compiled
+    assert 'last_released_at=CASE WHEN (users.locktime IS NOT NULL) THEN now()' in compiled
+
+
+@pytest.mark.asyncio
+async def test_checkout_user_waits_for_release(monkeypatch, make_mock_user):
+    attempts = []
+    queue = waiters.WaitQueue()
+
+    async def mock_checkout_users(count, session, **kwargs):
+        attempts.append(kwargs)
+        if len(attempts) == 1:
+            asyncio.get_running_loop().call_soon(queue.notify, {
+                'event': 'release', 'project_id': None, 'env': 'prod', 'domain': 'regular'})
+            raise exceptions.BotfarmNoFreeUsersError
+        return [schemas.User.model_validate(make_mock_user(locktime=datetime.now(timezone.utc)))]
+
+    monkeypatch.setattr(users, 'checkout_users', mock_checkout_users)
+    monkeypatch.setattr(waiters, 'queue', queue)
+    monkeypatch.setattr(constants, 'CHECKOUT_WAIT_POLL_SECONDS', 10)
+
+    result = await asyncio.wait_for(users.checkout_user(object(), wait=5), timeout=1)
+
+    assert len(attempts) == 2
+    assert result.locktime is not None
+    assert len(queue) == 0
+
+
+@pytest.mark.asyncio
+async def test_checkout_user_wait_timeout(monkeypatch):
+    async def mock_checkout_users(count, session, **kwargs):
+        raise exceptions.BotfarmNoFreeUsersError
+
+    monkeypatch.setattr(users, 'checkout_users', mock_checkout_users)
+    monkeypatch.setattr(waiters, 'queue', waiters.WaitQueue())
+
+    with pytest.raises(exceptions.BotfarmNoFreeUsersError):
+        await users.checkout_user(object(), wait=0.05)
+
+
+async def _lines(*lines):
+    for line in lines:
+        yield line
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'data_format, lines, expected_errors',
+    [
+        pytest.param(
+            schemas.DataFormat.ndjson,
+            [
+                '{"login": "a@example.com", "password": "p", "env": "prod", "domain": "regular"}',
+                '{"login": "b@example.com", "password": "p", "env": "prod", "domain": "regular",'
+                ' "project_name": "proj"}',
+                '',
+                'not json',
+                '{"login": "c@example.com", "password": "p", "env": "unknown", "domain": "regular"}',
+                '{"login": "d@example.com", "password": "p", "env": "prod", "domain": "regular",'
+                ' "project_name": "missing"}',
+                '{"login": "a@example.com", "password": "p", "env": "prod", "domain": "regular"}',
+                None,
+            ],
+            [(4, None), (5, 'c@example.com'), (8, None), (6, 'd@example.com'), (7, 'a@example.com')],
+        ),
+        pytest.param(
+            schemas.DataFormat.csv,
+            [
+                'login,password,env,domain,project_name',
+                'a@example.com,p,prod,regular,',
+                'b@example.com,p,prod,regular,proj',
+                '',
+                'broken',
+                'c@example.com,p,unknown,regular,',
+                'd@example.com,p,prod,regular,missing',
+                'a@example.com,p,prod,regular,',
+                None,
+            ],
+            [(5, 'broken'), (6, 'c@example.com'), (9, None), (7, 'd@example.com'), (8, 'a@example.com')],
+        ),
+    ],
+)
+async def test_import_users(data_format, lines, expected_errors, monkeypatch):
+    project_id = uuid.uuid4()
+
+    class MockSession:
+        def __init__(self):
+            self.inserted_rows = []
+            self.commit_count = 0
+
+        async def execute(self, stmt):
+            return MockResult([(project_id, 'proj')])
+
+        async def scalars(self, stmt):
+            self.inserted_rows = [
+                {column.key: value for column, value in row.items()} for row in stmt._multi_values[0]]
+            logins = {row['login'] for row in self.inserted_rows}
+            return MockScalarResult(list(logins))
+
+        async def commit(self):
+            self.commit_count += 1
+
+    monkeypatch.setattr(constants, 'IMPORT_BATCH_SIZE', 100)
+    mock_session = MockSession()
+
+    report = await users.import_users(_lines(*lines), data_format, session=mock_session)
+
+    assert report.created == 2
+    assert report.failed == 5
+    assert mock_session.commit_count == 1
+    assert [(error.line, error.login) for error in report.errors] == expected_errors
+    assert {row['login']: row['project_id'] for row in mock_session.inserted_rows} == {
+        'a@example.com': None, 'b@example.com': project_id}
+    assert all(hashing.verify_password_sync('p', row['password']) for row in mock_session.inserted_rows)
+
+
+@pytest.mark.asyncio
+async def test_import_users_csv_multiline_fields():
+    class MockSession:
+        def __init__(self):
+            self.inserted_rows = []
+
+        async def scalars(self, stmt):
+            self.inserted_rows = [
+                {column.key: value for column, value in row.items()} for row in stmt._multi_values[0]]
+            return MockScalarResult([row['login'] for row in self.inserted_rows])
+
+        async def commit(self):
+            pass
+
+    mock_session = MockSession()
+    lines = [
+        'login,password,env,domain',
+        'a@example.com,"first',
+        'second",prod,regular',
+        'b@example.com,"one',
+        'two',
+        'three",prod,regular',
+        'c@example.com,p,unknown,regular',
+        'd@example.com,"unclosed,prod,regular',
+    ]
+
+    report = await users.import_users(_lines(*lines), schemas.DataFormat.csv, session=mock_session)
+
+    assert report.created == 2
+    passwords = {row['login']: row['password'] for row in mock_session.inserted_rows}
+    assert hashing.verify_password_sync('first\nsecond', passwords['a@example.com'])
+    assert hashing.verify_password_sync('one\ntwo\nthree', passwords['b@example.com'])
+    # Ошибки указывают на первую строку записи, а незакрытые кавычки не ломают импорт
+    assert [(error.line, error.login) for error in report.errors] == [(7, 'c@example.com'), (8, 'd@example.com')]
+
+
+@pytest.mark.asyncio
+async def test_stats_cache_single_flight():
+    cache = users.StatsCache(ttl=60)
+    calls = 0
+    release = asyncio.Event()
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return schemas.UserStats(free=1, locked=0, groups=[], generated_at=datetime.now(timezone.utc))
+
+    pending = [asyncio.create_task(cache.get(load)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*pending)
+
+    assert calls == 1
+    assert all(result is results[0] for result in results)
+    assert await cache.get(load) is results[0]
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_stats_cache_reloads_after_ttl():
+    cache = users.StatsCache(ttl=0)
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        return schemas.UserStats(free=calls, locked=0, groups=[], generated_at=datetime.now(timezone.utc))
+
+    assert (await cache.get(load)).free == 1
+    assert (await cache.get(load)).free == 2
+
+
+@pytest.mark.asyncio
+async def test_get_user_stats(monkeypatch):
+    statements = []
+
+    class MockStatsSession:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, exc_type, exc, tb):
+            return
+
+        async def execute(self, stmt):
+            statements.append(stmt)
+            return MockResult([
+                (None, 'prod', 'regular', 2, 1),
+                ('proj', 'stage', 'canary', 5, 0),
+            ])
+
+    async def mock_get_read_sessionmaker():
+        return MockStatsSession
+
+    monkeypatch.setattr(users.db, 'get_read_sessionmaker', mock_get_read_sessionmaker)
+
+    stats = await users.get_user_stats()
+    await users.get_user_stats()
+
+    assert len(statements) == 1
+    assert 'GROUP BY' in str(statements[0])
+    assert (stats.free, stats.locked) == (7, 1)
+    assert [(group.project_name, group.free, group.locked) for group in stats.groups] == [
+        (None, 2, 1), ('proj', 5, 0)]
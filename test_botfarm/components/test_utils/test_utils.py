@@ -1,7 +1,7 @@
 import pytest
 
 from botfarm.components import utils
-from botfarm.entities import constants, db
+from botfarm.entities import constants, db, exceptions
 
 
 @pytest.mark.parametrize(
@@ -45,3 +45,52 @@ def test_load_env(file_name, expected_env, expected_exception, get_file_path):
 )
 def test_hash_password(password, expected_hash):
     assert utils.hash_password(password) == expected_hash
+
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'chunks, expected_lines',
+    [
+        pytest.param([b'a\nb', b'c\r\n', b'd'], ['a', 'bc', 'd']),
+        pytest.param([b'a\n', b'\n'], ['a', '']),
+        pytest.param([b'ok\n', b'x' * 6, b'x\nok'], ['ok', None, 'ok']),
+        pytest.param([b'ok\nxxxxxxxxx'], ['ok', None]),
+    ],
+)
+async def test_iter_lines(chunks, expected_lines):
+    lines = [line async for line in utils.iter_lines(_chunks(*chunks), max_length=5)]
+    assert lines == expected_lines
+
+
+@pytest.mark.parametrize(
+    'cursor, size, expected_exception',
+    [
+        pytest.param(utils.encode_cursor('a', 'b'), 2, None),
+        pytest.param(utils.encode_cursor('a', 'b'), 1, exceptions.BotfarmInvalidCursorError),
+        pytest.param('@@@', 1, exceptions.BotfarmInvalidCursorError),
+    ],
+)
+def test_decode_cursor(cursor, size, expected_exception):
+    if expected_exception:
+        with pytest.raises(expected_exception):
+            utils.decode_cursor(cursor, size)
+    else:
+        assert utils.decode_cursor(cursor, size) == ['a', 'b']
+
+
+def test_get_settings_env_overrides_file(monkeypatch, get_file_path):
+    monkeypatch.setenv(constants.SETTINGS_FILE_ENV, str(get_file_path(constants.SETTINGS_FILE)))
+    monkeypatch.setenv(db.DBCredentialsEnvFields.host.value, 'override')
+    utils.get_settings.cache_clear()
+    try:
+        settings = utils.get_settings()
+    finally:
+        utils.get_settings.cache_clear()
+
+    assert settings[db.DBCredentialsEnvFields.user.value] == 'user'
+    assert settings[db.DBCredentialsEnvFields.host.value] == 'override'
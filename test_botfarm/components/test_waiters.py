@@ -0,0 +1,96 @@
+import asyncio
+import uuid
+
+import pytest
+
+from botfarm.components import waiters
+from botfarm.entities import models
+
+
+def make_event(project_id=None, env='prod', domain='regular'):
+    return {
+        'event': 'release',
+        'login': 'user@example.com',
+        'project_id': str(project_id) if project_id else None,
+        'env': env,
+        'domain': domain,
+    }
+
+
+@pytest.mark.asyncio
+async def test_notify_wakes_waiters_in_fifo_order():
+    queue = waiters.WaitQueue()
+    with queue.enqueue() as first, queue.enqueue() as second:
+        queue.notify(make_event())
+        assert first.woken
+        assert not second.woken
+
+        queue.notify(make_event())
+        assert second.woken
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'project_id, domain, env, event, expected',
+    [
+        pytest.param(None, None, None, make_event(), True),
+        pytest.param(None, models.DomainType.canary, None, make_event(), False),
+        pytest.param(None, None, models.EnvType.prod, make_event(), True),
+        pytest.param(uuid.UUID(int=1), None, None, make_event(uuid.UUID(int=1)), True),
+        pytest.param(uuid.UUID(int=1), None, None, make_event(uuid.UUID(int=2)), False),
+    ],
+)
+async def test_notify_respects_filters(project_id, domain, env, event, expected):
+    queue = waiters.WaitQueue()
+    with queue.enqueue(project_id, domain, env) as waiter:
+        queue.notify(event)
+        assert waiter.woken == expected
+
+
+@pytest.mark.asyncio
+async def test_notify_alternates_between_filter_groups():
+    project_id = uuid.UUID(int=1)
+    queue = waiters.WaitQueue()
+    with queue.enqueue(project_id) as first, queue.enqueue(project_id) as second, queue.enqueue() as other:
+        queue.notify(make_event(project_id))
+        assert first.woken
+        queue.notify(make_event(project_id))
+        assert other.woken
+        assert not second.woken
+
+        queue.notify(make_event(project_id))
+        assert second.woken
+
+
+@pytest.mark.asyncio
+async def test_unused_wakeup_is_passed_to_next_waiter():
+    queue = waiters.WaitQueue()
+    first_context = queue.enqueue()
+    first = first_context.__enter__()
+    with queue.enqueue() as second:
+        queue.notify(make_event())
+        assert first.woken
+        assert not second.woken
+
+        first_context.__exit__(None, None, None)
+        assert second.woken
+    assert len(queue) == 0
+
+
+@pytest.mark.asyncio
+async def test_has_queued_before():
+    queue = waiters.WaitQueue()
+    with queue.enqueue(env=models.EnvType.prod) as first, queue.enqueue(env=models.EnvType.stage) as other:
+        with queue.enqueue(env=models.EnvType.prod) as second:
+            assert not queue.has_queued_before(first)
+            assert not queue.has_queued_before(other)
+            assert queue.has_queued_before(second)
+
+
+@pytest.mark.asyncio
+async def test_wait_returns_on_wakeup():
+    queue = waiters.WaitQueue()
+    with queue.enqueue() as waiter:
+        asyncio.get_running_loop().call_soon(queue.notify, make_event())
+        await asyncio.wait_for(waiter.wait(10), timeout=1)
+        assert not waiter.woken
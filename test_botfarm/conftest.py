@@ -5,6 +5,8 @@ from datetime import datetime, timezone
 
 import pytest
 
+from botfarm.components import projects, users
+
 DB_USER = 'user'
 DB_PASSWORD = 'password'
 DB_HOST = 'host'
@@ -22,9 +24,41 @@ class MockScalarResult:
         return self._items
 
 
+class MockResult:
+    """Мок execute() с построчным результатом"""
+
+    def __init__(self, rows):
+        self._rows = rows
+
+    def one_or_none(self):
+        return self._rows[0] if self._rows else None
+
+    def one(self):
+        assert len(self._rows) == 1
+        return self._rows[0]
+
+    def all(self):
+        return self._rows
+
+
+@pytest.fixture(autouse=True)
+def clear_project_cache():
+    projects.cache.invalidate()
+    yield
+    projects.cache.invalidate()
+
+
+@pytest.fixture(autouse=True)
+def clear_stats_cache():
+    users.stats_cache.invalidate()
+    yield
+    users.stats_cache.invalidate()
+
+
 @pytest.fixture
 def make_mock_user():
-    def _make(login='user@example.com', project_id=None, env='prod', domain='regular', locktime=None, password='hash'):
+    def _make(login='user@example.com', project_id=None, env='prod', domain='regular', locktime=None, password='hash',
+              lease_expires_at=None):
         return types.SimpleNamespace(
             id=uuid.uuid4(),
             created_at=datetime.now(timezone.utc),
@@ -34,6 +68,7 @@ def make_mock_user():
             env=env,
             domain=domain,
             locktime=locktime,
+            lease_expires_at=lease_expires_at,
         )
     return _make
 
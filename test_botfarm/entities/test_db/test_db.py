@@ -32,3 +32,45 @@ def test_from_env_file(file_name, expected_exception, expected_credentials, get_
     else:
         assert db.DBCredentials.from_env_file(pathlib.Path(
             env_file), db.DBCredentialsEnvFields) == db.DBCredentials(**expected_credentials)
+
+
+def test_from_env_file_pool_settings(get_file_path):
+    credentials = db.DBCredentials.from_env_file(
+        pathlib.Path(get_file_path('pool.env')), db.DBCredentialsEnvFields)
+
+    assert credentials.engine_options == {
+        'pool_size': 20,
+        'max_overflow': 5,
+        'pool_timeout': 30,
+        'pool_recycle': -1,
+        'pool_pre_ping': True,
+        'connect_args': {
+            'statement_cache_size': 0,
+            'prepared_statement_cache_size': 0,
+            'server_settings': {'statement_timeout': '30000'},
+        },
+    }
+
+
+@pytest.mark.parametrize(
+    'env_vars, expected',
+    [
+        pytest.param({}, None),
+        pytest.param(
+            {
+                'DB_REPLICA_USER': 'user',
+                'DB_REPLICA_PASSWORD': 'password',
+                'DB_REPLICA_HOST': 'replica',
+                'DB_REPLICA_PORT': '1',
+                'DB_REPLICA_NAME': 'name',
+                'DB_REPLICA_MAX_LAG_SECONDS': '2.5',
+            },
+            db.DBReplicaSettings(
+                credentials=db.DBCredentials(user='user', password='password', host='replica', port='1', name='name'),
+                max_lag_seconds=2.5,
+            ),
+        ),
+    ]
+)
+def test_replica_settings_from_env(env_vars, expected):
+    assert db.DBReplicaSettings.from_env(env_vars) == expected